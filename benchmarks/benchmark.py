@@ -0,0 +1,337 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Benchmarks for the magazine importer.
+
+The benchmarks generate a configuration with a given number of magazine
+sections and a list of synthetic file names, and measure:
+
+* the matcher's throughput in files per second,
+* the end-to-end latency of importing a file, as the time spent on the
+  file in the stages of the import, and the time from the start of the
+  run until the file's report is printed, using a stub calibredb with a
+  configurable latency,
+* the peak memory use.
+
+The results are written as JSON, so that runs can be compared over
+time. Run the benchmarks from the repository's root directory:
+
+    PYTHONPATH=. python benchmarks/benchmark.py --output results.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import stat
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.import_index import ImportIndex
+from closingbrace.calibre.importer import MagazineImporter
+from closingbrace.calibre.journal import ImportJournal
+from closingbrace.calibre.library import close_libraries
+from closingbrace.calibre.library import open_libraries
+from closingbrace.calibre.match_cache import NegativeMatchCache
+from closingbrace.calibre.matcher import MagazineMatcher
+from closingbrace.calibre.metrics import DisabledMetrics
+from closingbrace.calibre.metrics import StageTimer
+from closingbrace.calibre.retry import RetryQueue
+from os.path import join
+
+
+STUB_CALIBREDB = """#!{python}
+import sys
+import time
+
+time.sleep({latency})
+if sys.argv[1] == "add":
+    files = [arg for arg in sys.argv[2:] if arg.endswith(".pdf")]
+    first = int(time.time() * 1000) % 1000000
+    print("Added book ids: " + ", ".join(
+        str(first + index) for index in range(len(files))))
+"""
+
+MAGAZINE_SECTION = """
+[Magazine {number}]
+format = {prefix}{number:04d}-{{Y:4d}}-{{M:2}}.pdf
+authors = Author {number}
+languages = eng
+publisher = Publisher {number}
+volume = Y - 2000
+index = M
+tags = Magazine
+title = Magazine {number} {{month:s}} {{year}}
+archivedir = {archive_dir}
+"""
+
+PREFIXES = ["mag", "weekly", "monthly", "digest", "review", "journal"]
+
+
+def write_stub_calibredb(directory, latency):
+    """Write a stub calibredb that sleeps latency seconds for every call
+    and reports a book id for every added file. Returns its path.
+    """
+    path = join(directory, "calibredb")
+    with open(path, "w") as f:
+        f.write(STUB_CALIBREDB.format(python=sys.executable, latency=latency))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def write_config(directory, magazines, calibredb, workers, batch_size):
+    """Write a configuration with the given number of magazine sections
+    to directory. Returns the path to the configuration file.
+    """
+    import_dir = join(directory, "import")
+    archive_dir = join(directory, "archive")
+    os.makedirs(import_dir, exist_ok=True)
+    os.makedirs(archive_dir, exist_ok=True)
+    lines = [f"importdir = {import_dir}",
+            f"calibredb = {calibredb}",
+            f"librarypath = {join(directory, 'library')}",
+            f"workers = {workers}",
+            f"batchsize = {batch_size}"]
+    for number in range(magazines):
+        lines.append(MAGAZINE_SECTION.format(number=number,
+            prefix=PREFIXES[number % len(PREFIXES)], archive_dir=archive_dir))
+
+    config_path = join(directory, "config")
+    with open(config_path, "w") as f:
+        f.write("\n".join(lines))
+    return config_path
+
+
+def file_names(count, magazines, match_ratio, rng):
+    """Generate count file names, of which about match_ratio match one
+    of the magazines.
+    """
+    names = []
+    for index in range(count):
+        if rng.random() < match_ratio:
+            number = rng.randrange(magazines)
+            prefix = PREFIXES[number % len(PREFIXES)]
+            names.append(f"{prefix}{number:04d}-{rng.randrange(2000, 2030)}-"
+                    f"{rng.randrange(1, 13):02d}.pdf")
+        else:
+            names.append(f"download-{index}-{rng.randrange(10 ** 6)}.tmp")
+    return names
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Return the given percentiles of the values, as a dictionary."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {f"p{point}": ordered[min(len(ordered) - 1,
+        int(len(ordered) * point / 100))] for point in points}
+
+
+def peak_rss_kib():
+    """Return the peak resident set size of this process in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def build_matcher(config_path):
+    """Read the configuration and build the matcher from it."""
+    importer_config = ImporterConfiguration(config_path)
+    return MagazineMatcher([importer_config.get_magazine(magazine)
+        for magazine in importer_config.magazines])
+
+
+def bench_matcher(config_path, names):
+    """Measure the time to build the matcher and to match all names, and
+    the peak memory that is allocated while doing so. The memory is
+    traced in a separate pass, as tracing slows down the matcher.
+    """
+    start = time.perf_counter()
+    matcher = build_matcher(config_path)
+    built = time.perf_counter()
+    matches = sum(len(matcher.match(name)) for name in names)
+    matched = time.perf_counter()
+
+    tracemalloc.start()
+    matcher = build_matcher(config_path)
+    for name in names:
+        matcher.match(name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"files": len(names),
+            "matches": matches,
+            "build_seconds": built - start,
+            "match_seconds": matched - built,
+            "files_per_second": len(names) / (matched - built),
+            "peak_traced_kib": peak // 1024}
+
+
+class TimedOutput(object):
+    """A stdout replacement that records when each file's report is
+    printed.
+    """
+
+    def __init__(self):
+        """Initialize the output without any reports."""
+        self.report_times = []
+
+
+    def write(self, text):
+        """Record the time of every file report in text."""
+        now = time.perf_counter()
+        self.report_times.extend(now for line in text.splitlines()
+                if line.startswith("File '"))
+        return len(text)
+
+
+    def flush(self):
+        """Nothing is buffered."""
+
+
+class FileTimes(DisabledMetrics):
+    """Run metrics that add up the time spent on every file in the
+    stages of the import. The time of a stage that works on several
+    files at once, like adding a batch, is shared equally among them.
+    """
+
+    def __init__(self):
+        """Initialize the metrics without any time spent."""
+        self._lock = threading.Lock()
+        self.seconds = {}
+
+
+    def time(self, stage, files=()):
+        """Return a context manager that times stage for files."""
+        return StageTimer(self, stage, files)
+
+
+    def observe(self, stage, seconds, files=()):
+        """Add the time that stage took to the time of its files."""
+        with self._lock:
+            for file in files:
+                self.seconds[file] = (self.seconds.get(file, 0.0)
+                        + seconds / len(files))
+
+
+def bench_end_to_end(config_path, names):
+    """Import the files with the given names, and measure the time spent
+    on every file in the stages of the import, and the time from the
+    start of the run until its report is printed.
+    """
+    importer_config = ImporterConfiguration(config_path)
+    for name in names:
+        with open(join(importer_config.import_dir, name), "wb") as f:
+            f.write(b"%PDF-1.4\n" + os.urandom(4096) + b"\n%%EOF\n")
+
+    output = TimedOutput()
+    file_times = FileTimes()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        matcher = MagazineMatcher([importer_config.get_magazine(magazine)
+            for magazine in importer_config.magazines])
+        import_index = ImportIndex(importer_config.state_file("index"))
+        journal = ImportJournal(importer_config.state_file("journal"))
+        match_cache = NegativeMatchCache(
+                importer_config.state_file("nomatch"), importer_config.formats)
+        retry_queue = RetryQueue(importer_config.state_file("retry"),
+                importer_config.retry_delay, importer_config.max_retry_delay)
+        libraries = open_libraries(importer_config)
+        try:
+            MagazineImporter(importer_config, matcher, libraries,
+                    import_index, journal, match_cache, retry_queue,
+                    False, file_times).import_files(
+                            os.listdir(importer_config.import_dir))
+        finally:
+            close_libraries(libraries)
+            import_index.close()
+            journal.close()
+    elapsed = time.perf_counter() - start
+
+    reports = [report - start for report in output.report_times]
+    return {"files": len(names),
+            "imported": len(reports),
+            "seconds": elapsed,
+            "latency_seconds": percentiles(list(file_times.seconds.values())),
+            "report_seconds": percentiles(reports)}
+
+
+def parse_command_line():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+            description="Benchmark the magazine importer")
+    parser.add_argument("--magazines", default="10,100,1000",
+            help="comma separated numbers of magazine sections "
+            "(default: 10,100,1000)")
+    parser.add_argument("--files", default="1000,10000,100000",
+            help="comma separated numbers of file names to match "
+            "(default: 1000,10000,100000)")
+    parser.add_argument("--match-ratio", type=float, default=0.5,
+            help="fraction of the file names that match a magazine "
+            "(default: 0.5)")
+    parser.add_argument("--import-files", type=int, default=100,
+            help="number of files imported end-to-end (default: 100)")
+    parser.add_argument("--latency", type=float, default=0.05,
+            help="seconds that every stub calibredb call takes "
+            "(default: 0.05)")
+    parser.add_argument("--workers", type=int, default=4,
+            help="workers setting of the importer (default: 4)")
+    parser.add_argument("--batch-size", type=int, default=1,
+            help="batchsize setting of the importer (default: 1)")
+    parser.add_argument("--seed", type=int, default=1,
+            help="seed for the generated file names (default: 1)")
+    parser.add_argument("--output", help="file to write the JSON results "
+            "to (default: stdout)")
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmarks and write the results."""
+    cmd_line = parse_command_line()
+    rng = random.Random(cmd_line.seed)
+    results = {"timestamp": time.time(),
+            "python": platform.python_version(),
+            "settings": vars(cmd_line),
+            "matcher": [],
+            "end_to_end": []}
+
+    for magazines in [int(count) for count in cmd_line.magazines.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            calibredb = write_stub_calibredb(directory, cmd_line.latency)
+            config_path = write_config(directory, magazines, calibredb,
+                    cmd_line.workers, cmd_line.batch_size)
+            for files in [int(count) for count in cmd_line.files.split(",")]:
+                names = file_names(files, magazines, cmd_line.match_ratio, rng)
+                result = bench_matcher(config_path, names)
+                result["magazines"] = magazines
+                results["matcher"].append(result)
+
+            names = sorted(set(file_names(cmd_line.import_files, magazines,
+                1.0, rng)))
+            result = bench_end_to_end(config_path, names)
+            result["magazines"] = magazines
+            results["end_to_end"].append(result)
+
+    results["peak_rss_kib"] = peak_rss_kib()
+    report = json.dumps(results, indent=2)
+    if cmd_line.output:
+        with open(cmd_line.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Startup budget check for the magazine importer.
+
+Most runs, from cron or triggered by a watcher, find an empty import
+directory, so that starting the program is most of their cost. This
+check runs the importer on an empty import directory, with
+`python -X importtime`, and fails when:
+
+* the median time of a run exceeds the time budget,
+* more modules are imported than the import budget allows,
+* any of the modules that are only needed to match and import files is
+  imported.
+
+The results are written as JSON. Run the check from the repository's
+root directory:
+
+    PYTHONPATH=. python benchmarks/startup.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from os.path import join
+
+
+CONFIG = """importdir = {import_dir}
+
+[Magazine]
+format = mag-{{Y:4d}}-{{M:2}}.pdf
+authors = Author
+languages = eng
+publisher = Publisher
+volume = Y - 2000
+index = M
+tags = Magazine
+title = Magazine {{month:s}} {{year}}
+"""
+
+RUN_IMPORTER = ("import sys; from closingbrace.calibre.cli import run; "
+        "sys.argv[0] = 'calibre-magazine-importer'; run()")
+
+# Modules that an empty run must not import.
+FORBIDDEN = ["parse", "sqlite3", "subprocess", "urllib.request",
+        "concurrent.futures", "closingbrace.calibre.importer",
+        "closingbrace.calibre.matcher", "closingbrace.calibre.backend",
+        "closingbrace.calibre.library"]
+
+
+def run_importer(config_path, env):
+    """Run the importer once with config_path. Returns the run's wall
+    time in seconds and the names of the modules it imported.
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c",
+        RUN_IMPORTER, "-c", config_path], env=env, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start
+    modules = [line.rsplit("|", 1)[1].strip()
+            for line in completed.stderr.splitlines()
+            if line.startswith("import time:") and "|" in line
+            and not line.rstrip().endswith("imported package")]
+    return seconds, modules
+
+
+def parse_command_line():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+            description="Check the startup budget of the magazine importer")
+    parser.add_argument("--runs", type=int, default=10,
+            help="number of timed runs (default: 10)")
+    parser.add_argument("--max-seconds", type=float, default=0.15,
+            help="budget for the median time of a run (default: 0.15)")
+    parser.add_argument("--max-modules", type=int, default=120,
+            help="budget for the number of imported modules "
+            "(default: 120)")
+    parser.add_argument("--output", help="file to write the JSON results "
+            "to (default: standard output)")
+    return parser.parse_args()
+
+
+def main():
+    """Check the startup budget."""
+    cmd_line = parse_command_line()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(),
+        env.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory() as directory:
+        import_dir = join(directory, "import")
+        os.mkdir(import_dir)
+        config_path = join(directory, "importer.ini")
+        with open(config_path, "w") as f:
+            f.write(CONFIG.format(import_dir=import_dir))
+
+        # The first run compiles and caches the configuration.
+        run_importer(config_path, env)
+        runs = [run_importer(config_path, env) for _ in range(cmd_line.runs)]
+
+    seconds = statistics.median(seconds for seconds, _ in runs)
+    modules = runs[-1][1]
+    forbidden = sorted(set(FORBIDDEN) & set(modules))
+    results = {"median_seconds": seconds, "max_seconds": cmd_line.max_seconds,
+            "modules": len(modules), "max_modules": cmd_line.max_modules,
+            "forbidden_modules": forbidden}
+    results["passed"] = (seconds <= cmd_line.max_seconds
+            and len(modules) <= cmd_line.max_modules and not forbidden)
+
+    text = json.dumps(results, indent=2)
+    if cmd_line.output:
+        with open(cmd_line.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if results["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# The ioctl request to clone a file on Linux (FICLONE).
+FICLONE = 0x40049409
+
+# The errors with which a link or clone fails because the file system
+# doesn't support it, or because source and target are on different
+# file systems.
+UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP,
+        errno.ENOTSUP, errno.EINVAL, errno.ENOTTY, errno.ENOSYS}
+
+
+def replace_target(create, source, target):
+    """Create target from source with the function create, which fails
+    when target already exists. An existing target is replaced.
+    """
+    try:
+        create(source, target)
+    except FileExistsError:
+        os.unlink(target)
+        create(source, target)
+
+
+def same_file(path, other_path):
+    """Check whether path and other_path are the same file, for example
+    because they are hard links to it. A path that doesn't exist isn't
+    the same as any other.
+    """
+    try:
+        return os.path.samefile(path, other_path)
+    except OSError:
+        return False
+
+
+def reflink(source_file, target_file):
+    """Let the target file share the data blocks of the source file,
+    without copying them. This only works on file systems that support
+    it (like Btrfs and XFS). An OSError is raised when it doesn't work.
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported")
+    fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+def copy_file_range(source_fd, target_fd, offset, count):
+    """Copy count bytes at offset from source_fd to target_fd with
+    copy_file_range, returning the number of bytes copied.
+    """
+    return os.copy_file_range(source_fd, target_fd, count, offset, offset)
+
+
+def send_file(source_fd, target_fd, offset, count):
+    """Copy count bytes at offset from source_fd to the end of target_fd
+    with sendfile, returning the number of bytes copied.
+    """
+    return os.sendfile(target_fd, source_fd, offset, count)
+
+
+def copy_in_kernel(source_file, target_file):
+    """Copy the source file's content to the target file without
+    passing it through user space, with copy_file_range or else
+    sendfile. Returns False when neither can be used.
+    """
+    source_fd = source_file.fileno()
+    target_fd = target_file.fileno()
+    size = os.fstat(source_fd).st_size
+    for copy_range, available in ((copy_file_range,
+                hasattr(os, "copy_file_range")),
+            (send_file, hasattr(os, "sendfile"))):
+        if not available:
+            continue
+        copied = 0
+        try:
+            while copied < size:
+                count = copy_range(source_fd, target_fd, copied,
+                        size - copied)
+                if count == 0:
+                    break
+                copied += count
+            return True
+        except OSError as os_error:
+            if os_error.errno not in UNSUPPORTED or copied > 0:
+                raise
+    return False
+
+
+def copy_file(source, target):
+    """Copy the file source to target, as cheap as the file systems
+    allow. Returns the method used: "reflinked" or "copied".
+    """
+    with open(source, "rb") as source_file, \
+            open(target, "wb") as target_file:
+        try:
+            reflink(source_file, target_file)
+            method = "reflinked"
+        except OSError:
+            method = "copied"
+            if not copy_in_kernel(source_file, target_file):
+                shutil.copyfileobj(source_file, target_file)
+    shutil.copymode(source, target)
+    return method
+
+
+def clone_file(source, target):
+    """Create target with the same content as source. A hard link is
+    used when possible, else the file is copied. Returns the method
+    used: "linked", "reflinked" or "copied".
+    """
+    try:
+        replace_target(os.link, source, target)
+        return "linked"
+    except OSError as os_error:
+        if os_error.errno not in UNSUPPORTED:
+            raise
+    return copy_file(source, target)
+
+
+class Archiver(object):
+    """Archives a file from the import directory in one or more archive
+    directories, copying the file's content as little as possible.
+
+    When the file has to be removed from the import directory after
+    archiving, the last archive is made by renaming the file. Other
+    archives are hard links to the file when possible. A file that
+    has been archived before is linked from that archive, so that it is
+    copied at most once. An archive that is the file already, because
+    it was archived there before, is kept as it is.
+    """
+
+    def __init__(self, file_path):
+        """Initialize the archiver for the file given by file_path."""
+        self._file_path = file_path
+        self._archived = []
+        self._moved = False
+
+
+    def archive(self, archived_file, move=False):
+        """Archive the file as archived_file. When move is True, the file
+        is moved instead if possible. Returns the method used: "moved",
+        "linked", "reflinked", "copied", or "kept" when archived_file is
+        the file already.
+        """
+        if (same_file(self._file_path, archived_file)
+                or any(same_file(earlier, archived_file)
+                    for earlier in self._archived)):
+            # Renaming the file onto a hard link to it would do nothing,
+            # so the file is removed by remove() instead. Only when the
+            # archive is the file itself, it stays where it is.
+            if (os.path.realpath(self._file_path)
+                    == os.path.realpath(archived_file)):
+                self._moved = True
+            return "kept"
+
+        if move:
+            try:
+                os.rename(self._file_path, archived_file)
+                self._moved = True
+                self._archived.append(archived_file)
+                return "moved"
+            except OSError as os_error:
+                if os_error.errno != errno.EXDEV:
+                    raise
+
+        for earlier in self._archived:
+            try:
+                replace_target(os.link, earlier, archived_file)
+                return "linked"
+            except OSError as os_error:
+                if os_error.errno not in UNSUPPORTED:
+                    raise
+
+        method = clone_file(self._file_path, archived_file)
+        self._archived.append(archived_file)
+        return method
+
+
+    def remove(self):
+        """Remove the file from the import directory, unless it has been
+        moved already.
+        """
+        if not self._moved:
+            os.unlink(self._file_path)
@@ -0,0 +1,402 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import re
+import subprocess
+
+from closingbrace.calibre.metrics import NO_METRICS
+from closingbrace.calibre.metrics import SET_METADATA
+from closingbrace.calibre.metrics import SUBPROCESS
+from os.path import dirname
+from os.path import join
+
+
+WORKER_SCRIPT = join(dirname(__file__), "calibre_worker.py")
+
+# The text with which calibredb reports books that it didn't add, as
+# they are in the library already.
+DUPLICATE = "already exist in the database"
+
+
+class ImportError(Exception):
+    """Exception raised when something went wrong during the import of
+    a magazine.
+    """
+
+    def __init__(self, stdout_text, stderr_text):
+        """Initialize the exception, using the text that was output to
+        stdout and stderr to create an error text.
+        """
+        self._stdout_text = stdout_text
+        self._stderr_text = stderr_text
+        self._error_text = (f"  stdout: {stdout_text}\n  stderr: {stderr_text}")
+
+
+    @property
+    def stdout_text(self):
+        """The text that was output to stdout."""
+        return self._stdout_text
+
+
+    @property
+    def stderr_text(self):
+        """The text that was output to stderr."""
+        return self._stderr_text
+
+
+    def get_text(self):
+        """Get the error text from the exception."""
+        return self._error_text
+
+
+class BookRejectedError(ImportError):
+    """Exception for a magazine that the library didn't take, although
+    it could be reached, for example because the book is in it already.
+    It doesn't count as a failure of the library.
+    """
+
+
+class LibraryUnavailableError(ImportError):
+    """Exception for a magazine that wasn't added, because adding the
+    previous magazines to its library failed too many times in a row.
+    """
+
+    def __init__(self, failures):
+        """Initialize the exception after failures consecutive failures."""
+        super().__init__("", f"not tried, as the library failed to add the "
+                f"last {failures} issues")
+
+
+class CalibredbBackend(object):
+    """A library backend that runs calibredb for every operation on the
+    Calibre library. calibredb add can't set the publisher, so every
+    added issue takes a calibredb set_metadata run too: this backend
+    starts as many processes as the importer did before there were
+    backends. The WorkerBackend is the one that saves process launches.
+    """
+
+    def __init__(self, executable, library_path, metrics=NO_METRICS):
+        """Initialize the backend. The executable is the calibredb
+        executable and library_path the location of the Calibre library.
+        The library_path can also be the URL of a Calibre content server
+        (for example http://localhost:8080#library_id). The time spent
+        in calibredb is recorded in metrics.
+        """
+        self._executable = executable
+        self._library_path = library_path
+        self._metrics = metrics
+
+
+    def _command(self, subcommand):
+        """Return the start of the calibredb command line for the
+        subcommand.
+        """
+        command = [self._executable, subcommand]
+        if self._library_path is not None:
+            command.extend(["--library-path", self._library_path])
+        return command
+
+
+    def _run(self, command):
+        """Run the calibredb command line, returning its completed
+        process.
+        """
+        with self._metrics.time(SUBPROCESS):
+            return subprocess.run(command, universal_newlines=True,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+    def add(self, file_path, magazine):
+        """Import a magazine into the Calibre library. The magazine's
+        file location is given by file_path, while metadata about the
+        magazine is given by magazine. calibredb add can't set the
+        publisher, so it is written right after the magazine has been
+        added; when that fails, the magazine is removed again.
+        The method returns the book id that the magazine got during
+        import.
+        When the import failed, a ImportError is raised.
+        """
+        command = self._command("add")
+        command.extend(["--authors", magazine.authors,
+            "--languages", magazine.languages,
+            "--series", magazine.series,
+            "--series-index", magazine.number,
+            "--tags", magazine.tags,
+            "--title", magazine.title,
+            file_path])
+
+        exec_result = self._run(command)
+        stdout_result = re.match('Added book ids: (\\d+)\\n$',
+                exec_result.stdout)
+
+        if not stdout_result or exec_result.stderr:
+            if DUPLICATE in exec_result.stdout + exec_result.stderr:
+                raise BookRejectedError(exec_result.stdout,
+                        exec_result.stderr)
+            raise ImportError(exec_result.stdout, exec_result.stderr)
+        book_id = stdout_result[1]
+        errors = self._write_metadata([(book_id,
+            {"publisher": magazine.publisher})])
+        if errors:
+            raise errors[book_id]
+        return book_id
+
+
+    def add_many(self, items):
+        """Import several issues of the same magazine into the Calibre
+        library in one calibredb run. The items are (file_path, magazine)
+        tuples. The metadata that differs between issues, and the
+        publisher, are written right after the issues have been added;
+        the issues whose metadata can't be written are removed again.
+        Because calibredb can't tell duplicates apart by the metadata
+        that is shared, duplicates are added too.
+        The method returns a list with, for every item, either the book
+        id that the magazine got or the ImportError for its failure.
+        When calibredb doesn't report a book id for every file, or
+        reports an error, the ids can't be matched to the files: the
+        books that it did add are removed again, and the issues are
+        added one at a time instead. When those books can't be removed,
+        all items fail, as adding them again would duplicate them.
+        """
+        if len(items) == 1:
+            return [add_or_error(self, *items[0])]
+
+        magazine = items[0][1]
+        command = self._command("add")
+        command.extend(["--duplicates",
+            "--authors", magazine.authors,
+            "--languages", magazine.languages,
+            "--series", magazine.series,
+            "--tags", magazine.tags])
+        command.extend(file_path for file_path, _ in items)
+
+        exec_result = self._run(command)
+        stdout_result = re.search('^Added book ids: ([\\d, ]+)$',
+                exec_result.stdout, re.MULTILINE)
+        book_ids = stdout_result[1].split(", ") if stdout_result else []
+
+        if len(book_ids) != len(items) or exec_result.stderr:
+            remove_error = self._remove(book_ids) if book_ids else None
+            if remove_error is not None:
+                import_error = ImportError(exec_result.stdout,
+                        f"{exec_result.stderr.rstrip()}\n  The books that "
+                        f"were added (ids {', '.join(book_ids)}) couldn't "
+                        f"be removed: {remove_error}")
+                return [import_error] * len(items)
+            return [add_or_error(self, *item) for item in items]
+        errors = self._write_metadata([(book_id, {"title": magazine.title,
+            "series_index": magazine.number, "publisher": magazine.publisher})
+            for (_, magazine), book_id in zip(items, book_ids)])
+        return [errors.get(book_id, book_id) for book_id in book_ids]
+
+
+    def set_metadata(self, book_ids, fields):
+        """Set the metadata fields, a dictionary from field name to
+        value, for the books given by book_ids. calibredb changes only
+        one book at a time.
+        When setting the metadata failed, a ImportError is raised.
+        """
+        for book_id in book_ids:
+            command = self._command("set_metadata")
+            command.extend([f"-f{field}:{value}"
+                for field, value in fields.items()])
+            command.append(book_id)
+
+            exec_result = self._run(command)
+
+            if exec_result.returncode != 0:
+                raise ImportError(exec_result.stdout, exec_result.stderr)
+
+
+    def _write_metadata(self, metadata):
+        """Write the metadata of books that have just been added, given
+        as (book_id, fields) tuples, with fields a dictionary from field
+        name to value. The books whose metadata can't be written are
+        removed from the library again, so that they are added again
+        when their files are retried. Returns a dictionary that maps the
+        book id of each of these books to its ImportError.
+        """
+        errors = {}
+        with self._metrics.time(SET_METADATA):
+            for book_id, fields in metadata:
+                try:
+                    self.set_metadata([book_id], fields)
+                except ImportError as import_error:
+                    errors[book_id] = import_error
+        if not errors:
+            return errors
+
+        remove_error = self._remove(list(errors))
+        if remove_error is None:
+            return errors
+        return {book_id: ImportError(import_error.stdout_text,
+            f"{import_error.stderr_text.rstrip()}\n  The book was added "
+            f"without its metadata and couldn't be removed: "
+            f"{remove_error}")
+            for book_id, import_error in errors.items()}
+
+
+    def _remove(self, book_ids):
+        """Remove the books given by book_ids from the library. Returns
+        None when they were removed, or else the error text of
+        calibredb.
+        """
+        command = self._command("remove")
+        command.append(",".join(book_ids))
+        exec_result = self._run(command)
+        if exec_result.returncode == 0:
+            return None
+        return exec_result.stderr
+
+
+    def close(self):
+        """Release the backend. There is nothing to release for
+        calibredb.
+        """
+
+
+class WorkerBackend(object):
+    """A library backend that keeps one worker process running for the
+    whole import run. The worker opens the Calibre library once and
+    takes its commands over a pipe, so that Calibre's startup cost is
+    paid only once.
+
+    The worker reads one JSON object per line from its stdin and writes
+    one JSON object per line to its stdout. Every request has a
+    "command" and its arguments. Every response either has the result
+    of the command, or an "error" with a description of what went
+    wrong. By default the worker is calibre_worker.py, run by
+    calibre-debug. Any other program that speaks the same protocol can
+    be used instead.
+    """
+
+    def __init__(self, command, library_path, metrics=NO_METRICS):
+        """Start the worker. The command is the command line that starts
+        the worker; the library_path is appended to it when it is set.
+        The time spent waiting for the worker is recorded in metrics.
+        """
+        if library_path is not None:
+            command = command + [library_path]
+        self._metrics = metrics
+        self._worker = subprocess.Popen(command, universal_newlines=True,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+
+    def _request(self, request):
+        """Send a request to the worker and return its response. When the
+        worker has stopped, a ImportError is raised. When it reports an
+        error, the library was open, and a BookRejectedError is raised.
+        """
+        try:
+            with self._metrics.time(SUBPROCESS):
+                self._worker.stdin.write(json.dumps(request) + "\n")
+                self._worker.stdin.flush()
+                response_line = self._worker.stdout.readline()
+        except OSError as os_error:
+            raise ImportError("", f"worker not available: {os_error}")
+
+        if not response_line:
+            raise ImportError("", "worker stopped unexpectedly with exit "
+                    f"code {self._worker.wait()}")
+        try:
+            response = json.loads(response_line)
+        except ValueError:
+            raise ImportError(response_line, "invalid response from worker")
+        if "error" in response:
+            raise BookRejectedError(response.get("output", ""),
+                    response["error"])
+        return response
+
+
+    def add(self, file_path, magazine):
+        """Import a magazine into the Calibre library. The magazine's
+        file location is given by file_path, while metadata about the
+        magazine, including its publisher, is given by magazine.
+        The method returns the book id that the magazine got during
+        import.
+        When the import failed, a ImportError is raised.
+        """
+        response = self._request({"command": "add", "file": file_path,
+            "metadata": worker_metadata(magazine)})
+        return str(response["book_id"])
+
+
+    def add_many(self, items):
+        """Import several magazines into the Calibre library with one
+        request. The items are (file_path, magazine) tuples.
+        The method returns a list with, for every item, either the book
+        id that the magazine got or the ImportError for its failure.
+        """
+        try:
+            response = self._request({"command": "add_many", "books": [
+                {"file": file_path, "metadata": worker_metadata(magazine)}
+                for file_path, magazine in items]})
+        except ImportError as import_error:
+            return [import_error] * len(items)
+        return [BookRejectedError("", result["error"]) if "error" in result
+                else str(result["book_id"])
+                for result in response["results"]]
+
+
+    def set_metadata(self, book_ids, fields):
+        """Set the metadata fields, a dictionary from field name to
+        value, for the books given by book_ids.
+        When setting the metadata failed, a ImportError is raised.
+        """
+        self._request({"command": "set_metadata",
+            "book_ids": [int(book_id) for book_id in book_ids],
+            "fields": fields})
+
+
+    def close(self):
+        """Stop the worker, giving it the chance to close the library."""
+        try:
+            self._worker.stdin.close()
+        except BrokenPipeError:
+            # The worker stopped before it read the last request.
+            pass
+        self._worker.wait()
+        self._worker.stdout.close()
+
+
+def worker_metadata(magazine):
+    """Return the metadata of the magazine in the form that the worker
+    expects it.
+    """
+    return {"authors": magazine.authors,
+            "languages": magazine.languages,
+            "series": magazine.series,
+            "series_index": magazine.number,
+            "tags": magazine.tags,
+            "title": magazine.title,
+            "publisher": magazine.publisher,
+            }
+
+
+def add_or_error(backend, file_path, magazine):
+    """Import a magazine with the backend, returning either the book id
+    that it got or the ImportError for its failure.
+    """
+    try:
+        return backend.add(file_path, magazine)
+    except ImportError as import_error:
+        return import_error
+
+
+def create_backend(importer_config, calibredb, library_path,
+        metrics=NO_METRICS):
+    """Create the backend selected in the configuration for the library
+    at library_path. The calibredb backend uses the calibredb
+    executable. The backend records its time in metrics.
+    """
+    if importer_config.backend == "worker":
+        return WorkerBackend([importer_config.calibre_debug, "-e",
+            WORKER_SCRIPT], library_path, metrics)
+    return CalibredbBackend(calibredb, library_path, metrics)
@@ -0,0 +1,123 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Worker that keeps a Calibre library open and executes the commands
+of the magazine importer on it. The worker must be run with Calibre's
+own Python interpreter:
+
+    calibre-debug -e calibre_worker.py [library_path]
+
+It reads one JSON request per line from stdin and writes one JSON
+response per line to stdout, until stdin is closed. See WorkerBackend
+in backend.py for the protocol.
+"""
+
+import json
+import os
+import sys
+import traceback
+
+
+def split_list(text):
+    """Split a comma separated list into its stripped, non-empty items."""
+    if not text:
+        return []
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def read_metadata(file_path, fields):
+    """Read the metadata from the file at file_path and override it with
+    the fields given by the importer, like calibredb add does.
+    """
+    from calibre.ebooks.metadata import string_to_authors
+    from calibre.ebooks.metadata.meta import get_metadata
+
+    fmt = os.path.splitext(file_path)[1][1:].lower()
+    with open(file_path, "rb") as stream:
+        mi = get_metadata(stream, stream_type=fmt, use_libprs_metadata=True)
+    mi.title = fields["title"]
+    mi.authors = string_to_authors(fields["authors"])
+    mi.series = fields["series"]
+    mi.series_index = float(fields["series_index"])
+    mi.tags = split_list(fields.get("tags"))
+    mi.languages = split_list(fields.get("languages"))
+    if fields.get("publisher"):
+        mi.publisher = fields["publisher"]
+    return mi, fmt
+
+
+def add(db, request):
+    """Add a single file to the library."""
+    mi, fmt = read_metadata(request["file"], request["metadata"])
+    ids, duplicates = db.add_books([(mi, {fmt: request["file"]})],
+            add_duplicates=False)
+    if duplicates or not ids:
+        return {"error": "book already exists in the library"}
+    return {"book_id": ids[0]}
+
+
+def add_many(db, request):
+    """Add several files to the library, reporting the result for every
+    file separately.
+    """
+    results = []
+    for book in request["books"]:
+        try:
+            results.append(add(db, book))
+        except Exception:
+            results.append({"error": traceback.format_exc()})
+    return {"results": results}
+
+
+def set_metadata(db, request):
+    """Set metadata fields on one or more books."""
+    for field, value in request["fields"].items():
+        db.set_field(field, {book_id: value
+            for book_id in request["book_ids"]})
+    return {}
+
+
+COMMANDS = {
+        "add": add,
+        "add_many": add_many,
+        "set_metadata": set_metadata,
+        }
+
+
+def serve(db, requests, responses):
+    """Execute the requests one by one, writing a response for each."""
+    for line in requests:
+        try:
+            request = json.loads(line)
+            response = COMMANDS[request["command"]](db, request)
+        except Exception:
+            response = {"error": traceback.format_exc()}
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+def main(args):
+    """Open the library and serve requests until stdin is closed."""
+    from calibre.library import db as open_library
+
+    # Calibre may print messages while it works. Keep them out of the
+    # responses.
+    responses = sys.stdout
+    sys.stdout = sys.stderr
+
+    library_path = args[0] if args else None
+    db = open_library(library_path).new_api
+    try:
+        serve(db, sys.stdin, responses)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import os
+import sys
+
+from closingbrace.calibre.configuration import ConfigurationError
+from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.formula import FormulaError
+from closingbrace.calibre.metrics import FORMATS
+from closingbrace.calibre.metrics import NO_METRICS
+from closingbrace.calibre.metrics import RunMetrics
+from closingbrace.calibre.metrics import SCAN
+from closingbrace.calibre.plan import FORMATS as PLAN_FORMATS
+from closingbrace.calibre.retry import RetryQueue
+from closingbrace.calibre.retry import print_status
+from os.path import expanduser
+from os.path import realpath
+
+
+def parse_command_line():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+            description="Import magazines into Calibre")
+    parser.add_argument("-c", "--config",
+            default=expanduser("~/.calibre-magazine-importer"),
+            help="configuration file for the importer (default: "
+            "$HOME/.calibre-magazine-importer)")
+    parser.add_argument("-v", "--verbose", help="be more verbose about "
+            "the magazines that are imported", action="store_true")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-w", "--watch", help="keep running and import "
+            "files as soon as they appear in the import directory",
+            action="store_true")
+    mode.add_argument("--plan", metavar="FILE", help="don't import "
+            "anything, but write the plan of what would be imported to "
+            "FILE")
+    mode.add_argument("--execute-plan", metavar="FILE", help="import the "
+            "files as planned in FILE, without matching them again")
+    mode.add_argument("--status", help="show the files that failed to "
+            "import and when they are tried again", action="store_true")
+    parser.add_argument("--plan-format", choices=PLAN_FORMATS,
+            default="json", help="format of the plan file (default: json)")
+    parser.add_argument("--settle-time", type=float, default=10,
+            help="seconds that a new file must be left unchanged before "
+            "it is imported in watch mode (default: 10)")
+    parser.add_argument("--metrics", metavar="FILE", help="write timings "
+            "of the import stages and counts of their outcomes to FILE")
+    parser.add_argument("--metrics-format", choices=FORMATS, default="json",
+            help="format of the metrics file: json lines or a prometheus "
+            "textfile (default: json)")
+    parser.add_argument("--max-runtime", type=float, metavar="SECONDS",
+            help="don't start importing new files after SECONDS")
+    parser.add_argument("--max-files", type=int, metavar="N",
+            help="don't start importing new files after N files")
+    cmd_line = parser.parse_args()
+    if cmd_line.watch and (cmd_line.max_runtime is not None
+            or cmd_line.max_files is not None):
+        parser.error("--max-runtime and --max-files can't be used with "
+                "--watch")
+    return cmd_line
+
+
+def is_empty(import_dir, excluded_dirs):
+    """Check whether the import directory contains nothing but the
+    excluded directories. Only the import directory itself is read. A
+    directory that can't be read isn't empty, so that the import reports
+    the problem.
+    """
+    try:
+        with os.scandir(import_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    return False
+                if realpath(entry.path) not in {realpath(excluded_dir)
+                        for excluded_dir in excluded_dirs}:
+                    return False
+    except OSError:
+        return False
+    return True
+
+
+def run():
+    """Run the importer application.
+
+    A plain run that finds the import directory empty, as most runs
+    from cron do, finishes after reading the directory once. The
+    modules that match and import files, and the libraries they use, are
+    only loaded when there may be files to import.
+    """
+    cmd_line = parse_command_line()
+    try:
+        importer_config = ImporterConfiguration(cmd_line.config)
+    except (ConfigurationError, FormulaError) as error:
+        sys.exit(f"Invalid configuration: {error}")
+    metrics = NO_METRICS
+    if cmd_line.metrics:
+        metrics = RunMetrics(cmd_line.metrics, cmd_line.metrics_format)
+
+    if cmd_line.status:
+        print_status(RetryQueue(importer_config.state_file("retry"),
+            importer_config.retry_delay, importer_config.max_retry_delay))
+        return
+
+    if cmd_line.verbose:
+        importer_config.print()
+        print(f"Processing files in directory {importer_config.import_dir}")
+        print()
+
+    if not (cmd_line.watch or cmd_line.plan or cmd_line.execute_plan):
+        with metrics.time(SCAN):
+            empty = is_empty(importer_config.import_dir,
+                    importer_config.excluded_dirs)
+        if empty:
+            try:
+                metrics.write()
+            except OSError as os_error:
+                print(f"Metrics NOT written. Error:\n  {os_error}")
+                print()
+            return
+
+    from closingbrace.calibre.importer import import_magazines
+    import_magazines(cmd_line, importer_config, metrics)
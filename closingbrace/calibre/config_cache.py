@@ -0,0 +1,159 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import os
+import pickle
+
+from importlib.util import MAGIC_NUMBER
+
+
+# Increased whenever the cached records change, so that a cache written
+# by another version of the importer isn't used.
+CACHE_VERSION = 9
+
+
+def content_digest(content):
+    """Return the SHA-256 hash of the text content as a hexadecimal
+    string.
+    """
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def section_digest(items, *fallbacks):
+    """Return the hash of a configuration section, given by items, a
+    list of (option, raw value) tuples, and the fallback values that
+    the section's records are built with.
+    """
+    return content_digest(repr((sorted(items), fallbacks)))
+
+
+def owned_by_user(stat):
+    """Check whether the file, given by the result of os.stat, is owned
+    by the user running the importer and can't be written by others.
+    """
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+        return False
+    return not stat.st_mode & 0o022
+
+
+class CachedConfiguration(object):
+    """A compiled configuration, as it is cached on disk. Besides the
+    compiled general settings and magazines, it holds the modification
+    time, size and hash of the configuration file it was compiled from,
+    and the hash of every magazine section.
+    """
+
+    __slots__ = ("_mtime", "_size", "_digest", "_general", "_magazines",
+            "_sections")
+
+    def __init__(self, stat, digest, general, magazines, sections):
+        """Initialize the cached configuration. The stat and digest are
+        the result of os.stat and content_digest of the configuration
+        file. The general settings are a dictionary, the magazines map
+        the magazine names to their MagazineConfiguration and the
+        sections map them to their section_digest.
+        """
+        self._mtime = stat.st_mtime_ns
+        self._size = stat.st_size
+        self._digest = digest
+        self._general = general
+        self._magazines = magazines
+        self._sections = sections
+
+
+    def __getstate__(self):
+        """Return the state to pickle."""
+        return (self._mtime, self._size, self._digest, self._general,
+                self._magazines, self._sections)
+
+
+    def __setstate__(self, state):
+        """Restore the state from a pickle."""
+        (self._mtime, self._size, self._digest, self._general,
+                self._magazines, self._sections) = state
+
+
+    @property
+    def digest(self):
+        """The hash of the configuration file's content."""
+        return self._digest
+
+
+    @property
+    def general(self):
+        """The general settings."""
+        return self._general
+
+
+    @property
+    def magazines(self):
+        """The magazine configurations by magazine name, in the order
+        of the configuration file.
+        """
+        return self._magazines
+
+
+    @property
+    def sections(self):
+        """The section_digest of every magazine by magazine name."""
+        return self._sections
+
+
+    def matches(self, stat):
+        """Check whether the configuration file, given by the result of
+        os.stat, is unchanged since it was compiled.
+        """
+        return self._mtime == stat.st_mtime_ns and self._size == stat.st_size
+
+
+    def magazine(self, name, digest):
+        """Return the compiled configuration of the magazine given by
+        name, when its section still has the given section_digest, or
+        None otherwise.
+        """
+        if self._sections.get(name) != digest:
+            return None
+        return self._magazines[name]
+
+
+def read_cache(cache_file):
+    """Read the cached configuration from cache_file. Returns None when
+    there is no usable cache. A cache is only used when it was written
+    by this version of the importer running on the same version of
+    Python, and when it is owned by the user and can't be written by
+    others, because unpickling it can run code.
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            if not owned_by_user(os.fstat(f.fileno())):
+                return None
+            version, magic, cached = pickle.load(f)
+    except Exception:
+        # A missing, unreadable or corrupt cache is simply not used.
+        return None
+    if version != CACHE_VERSION or magic != MAGIC_NUMBER:
+        return None
+    return cached
+
+
+def write_cache(cache_file, cached):
+    """Write the cached configuration to cache_file. The cache is an
+    optimization only, so failing to write it is ignored.
+    """
+    temporary_file = cache_file + ".new"
+    try:
+        descriptor = os.open(temporary_file,
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(descriptor, "wb") as f:
+            pickle.dump((CACHE_VERSION, MAGIC_NUMBER, cached), f,
+                    pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, cache_file)
+    except (OSError, pickle.PicklingError):
+        pass
@@ -7,21 +7,120 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import os
+
+from closingbrace.calibre.config_cache import CachedConfiguration
+from closingbrace.calibre.config_cache import content_digest
+from closingbrace.calibre.config_cache import read_cache
+from closingbrace.calibre.config_cache import section_digest
+from closingbrace.calibre.config_cache import write_cache
+from closingbrace.calibre.formula import Formula
+from closingbrace.calibre.formula import FormulaError
+from closingbrace.calibre.title import TitleTemplate
 from configparser import ConfigParser
 from os.path import expanduser
+from os.path import join
+
+
+# The directory in the import directory that holds the leases on the
+# files that are being imported.
+LEASE_DIR = ".calibre-magazine-importer.leases"
+
+# The keys that the files to import can be ordered by.
+ORDERS = ("priority", "newest", "smallest")
+
+
+class ConfigurationError(Exception):
+    """Exception raised when a setting in the configuration is invalid,
+    for other reasons than an invalid formula or title.
+    """
 
 
 class MagazineConfiguration(object):
-    """The configuration of a single magazine."""
+    """The configuration of a single magazine. All settings are read,
+    and the format, formulas and title are compiled, when the
+    configuration is created; after that it doesn't change.
+
+    The configuration can be pickled, except for the compiled format:
+    the parse module's parsers can't be pickled, so the format is
+    compiled again when it is first used after the configuration is
+    unpickled.
+    """
 
-    def __init__(self, magazine, config_section):
+    __slots__ = ("_name", "_format", "_authors", "_languages", "_publisher",
+            "_volume", "_index", "_year", "_month", "_tags", "_title",
+            "_archivedir", "_calibredb", "_library_path", "_priority",
+            "_volume_formula",
+            "_index_formula", "_year_formula", "_month_formula",
+            "_title_template", "_format_parser")
+
+    def __init__(self, magazine, config_section, importer_config):
         """Initialize the configuration for a single magazine, named by
         magazine, from the config_section. The config_section is a
         section of the ini-file that was read in by
-        ImporterConfiguration.
+        ImporterConfiguration importer_config, which provides the
+        defaults for the magazine's library. A FormulaError is raised
+        when one of the formulas or the title is invalid.
         """
         self._name = magazine
-        self._config = config_section
+        self._format = config_section["format"]
+        self._authors = config_section["authors"]
+        self._languages = config_section.get("languages", raw=True)
+        self._publisher = config_section["publisher"]
+        self._volume = config_section.get("volume", raw=True)
+        self._index = config_section.get("index", raw=True)
+        self._year = config_section.get("year", raw=True)
+        self._month = config_section.get("month", raw=True)
+        self._tags = config_section.get("tags", raw=True)
+        self._title = config_section["title"]
+        archivedir = config_section.get("archivedir", raw=True)
+        self._archivedir = expanduser(archivedir) if archivedir else None
+        self._calibredb = (config_section.get("calibredb", raw=True)
+                or importer_config.calibredb)
+        library_path = config_section.get("librarypath", raw=True)
+        self._library_path = (expanduser(library_path) if library_path
+                else importer_config.library_path)
+        self._priority = config_section.getint("priority", 0)
+
+        self._volume_formula = self._compile_formula("volume",
+                self._volume, "V")
+        self._index_formula = self._compile_formula("index", self._index, "I")
+        self._year_formula = self._compile_formula("year", self._year, "Y")
+        self._month_formula = self._compile_formula("month", self._month, "M")
+        try:
+            self._title_template = TitleTemplate(self._title)
+        except FormulaError as formula_error:
+            raise FormulaError(f"magazine \"{self._name}\", title "
+                    f"'{self._title}': {formula_error}")
+        self._format_parser = compile_format(self._format)
+
+
+    def __getstate__(self):
+        """Return the state to pickle, without the compiled format."""
+        return {slot: getattr(self, slot) for slot in self.__slots__
+                if slot != "_format_parser"}
+
+
+    def __setstate__(self, state):
+        """Restore the state from a pickle. The format is compiled when
+        it is first used.
+        """
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._format_parser = None
+
+
+    def _compile_formula(self, option, expression, default):
+        """Compile the formula expression of the given option. When the
+        option isn't set, the default formula is compiled instead. A
+        FormulaError is raised when the formula is invalid.
+        """
+        expression = expression or default
+        try:
+            return Formula(expression)
+        except FormulaError as formula_error:
+            raise FormulaError(f"magazine \"{self._name}\", {option} "
+                    f"'{expression}': {formula_error}")
 
 
     @property
@@ -33,69 +132,138 @@ class MagazineConfiguration(object):
     @property
     def format(self):
         """The format that the magazine's filename will match."""
-        return self._config["format"]
+        return self._format
 
 
     @property
     def authors(self):
         """The magazine's authors."""
-        return self._config["authors"]
+        return self._authors
 
 
     @property
     def languages(self):
         """The languages that the magazine is published in."""
-        return self._config.get("languages", raw=True)
+        return self._languages
 
 
     @property
     def publisher(self):
         """The magazine's publisher."""
-        return self._config["publisher"]
+        return self._publisher
 
 
     @property
     def volume(self):
         """The format for the magazine's volume."""
-        return self._config.get("volume", raw=True)
+        return self._volume
 
 
     @property
     def index(self):
         """The format for the magazine's index."""
-        return self._config.get("index", raw=True)
+        return self._index
 
 
     @property
     def year(self):
         """The format for the magazine's year."""
-        return self._config.get("year", raw=True)
+        return self._year
 
 
     @property
     def month(self):
         """The format for the magazine's month."""
-        return self._config.get("month", raw=True)
+        return self._month
+
+
+    @property
+    def volume_formula(self):
+        """The compiled formula for the magazine's volume."""
+        return self._volume_formula
+
+
+    @property
+    def index_formula(self):
+        """The compiled formula for the magazine's index."""
+        return self._index_formula
+
+
+    @property
+    def year_formula(self):
+        """The compiled formula for the magazine's year."""
+        return self._year_formula
+
+
+    @property
+    def month_formula(self):
+        """The compiled formula for the magazine's month."""
+        return self._month_formula
+
+
+    @property
+    def title_template(self):
+        """The compiled template for the magazine's title."""
+        return self._title_template
+
+
+    @property
+    def priority(self):
+        """The magazine's priority; files of magazines with a higher
+        priority are imported first when the files are ordered by
+        priority.
+        """
+        return self._priority
+
+
+    @property
+    def format_parser(self):
+        """The compiled parser for the magazine's format."""
+        if self._format_parser is None:
+            self._format_parser = compile_format(self._format)
+        return self._format_parser
 
 
     @property
     def tags(self):
         """The tags that the magazine will be associated with."""
-        return self._config.get("tags", raw=True)
+        return self._tags
 
 
     @property
     def title(self):
         """The format for the magazine's title."""
-        return self._config["title"]
+        return self._title
 
 
     @property
     def archivedir(self):
         """The archive directory to which the magazine is moved after
-        import.
+        import, or None when the magazine isn't archived.
         """
-        return expanduser(self._config.get("archivedir", raw=True))
+        return self._archivedir
+
+
+    @property
+    def calibredb(self):
+        """Path to the calibredb executable for the magazine's library."""
+        return self._calibredb
+
+
+    @property
+    def library_path(self):
+        """Path to the calibre library that the magazine is imported
+        into, or None to use the library stored in Calibre's settings.
+        """
+        return self._library_path
+
+
+    @property
+    def library(self):
+        """The library that the magazine is imported into, as a
+        (calibredb, library_path) tuple.
+        """
+        return (self._calibredb, self._library_path)
 
 
     def print(self):
@@ -112,55 +280,349 @@ class MagazineConfiguration(object):
         print(f"    tags       : {self.tags}")
         print(f"    title      : {self.title}")
         print(f"    archive dir: {self.archivedir}")
+        print(f"    calibre db : {self.calibredb}")
+        print(f"    library    : {self.library_path}")
+        print(f"    priority   : {self.priority}")
         print()
 
 
+def compile_format(magazine_format):
+    """Compile the format string of a magazine's filename into a
+    parser.
+    """
+    # The parse library is only loaded when a format is compiled, which
+    # a run that finds nothing to import, with a cached configuration,
+    # never does.
+    from parse import compile
+    return compile(magazine_format)
+
+
+def read_general(section):
+    """Read the general settings from the section of the ini-file before
+    the first magazine section. Returns them as a dictionary.
+    """
+    library_path = section.get("librarypath", raw=True)
+    order = [key.strip() for key in section.get("order", "", raw=True)
+            .split(",") if key.strip()]
+    for key in order:
+        if key not in ORDERS:
+            raise ConfigurationError(f"order '{key}' isn't one of "
+                    f"{', '.join(ORDERS)}")
+    return {"import_dir": expanduser(section["importdir"]),
+            "calibredb": section.get("calibredb", "calibredb", raw=True),
+            "backend": section.get("backend", "calibredb", raw=True),
+            "calibre_debug": section.get("calibredebug", "calibre-debug",
+                raw=True),
+            "batch_size": section.getint("batchsize", 1),
+            "workers": max(1, section.getint("workers", 4)),
+            "recursive": section.getboolean("recursive", False),
+            "min_size": section.getint("minsize", 0),
+            "min_age": section.getfloat("minage", 0),
+            "validate": section.getboolean("validate", True),
+            "check_stable": section.getboolean("checkstable", False),
+            "lease_timeout": section.getfloat("leasetimeout", 0),
+            "retry_delay": section.getfloat("retrydelay", 300),
+            "max_retry_delay": section.getfloat("maxretrydelay", 86400),
+            "failure_limit": section.getint("failurelimit", 3),
+            "order": order,
+            "library_path": expanduser(library_path) if library_path
+                else None,
+            }
+
+
 class ImporterConfiguration(object):
     """The application's configuration. The configuration is read from
     a ini-file. See the README.md for the ini-file's format.
+
+    The configuration is compiled when it is read: the settings are
+    read once and the formats, formulas and titles of the magazines are
+    compiled. The compiled configuration is cached next to the ini-file.
+    When the ini-file's modification time and size, or else its
+    content, haven't changed since the cache was written, the cached
+    configuration is used as is. Otherwise the ini-file is read and
+    only the magazine sections that changed are compiled again.
     """
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, previous=None):
         """Initialize a configuration object with data from the ini-file
-        given by config_file.
+        given by config_file. The formulas of all magazines are compiled
+        right away, so that a FormulaError is raised here when one of
+        them is invalid. A ConfigurationError is raised when another
+        setting is invalid. When the configuration is reloaded, previous
+        is the configuration that was read before; its magazines are
+        used instead of the cache's.
         """
+        self._config_file = config_file
+        cache_file = self.state_file("cache")
+        cached = previous._compiled if previous else read_cache(cache_file)
         with open(config_file) as f:
-            file_content = '[__general__]\n' + f.read()
+            stat = os.fstat(f.fileno())
+            if cached is None or not cached.matches(stat):
+                file_content = f.read()
+                digest = content_digest(file_content)
+                if cached is None or cached.digest != digest:
+                    cached = self._compile(file_content, stat, digest, cached)
+                else:
+                    cached = CachedConfiguration(stat, digest, cached.general,
+                            cached.magazines, cached.sections)
+                write_cache(cache_file, cached)
+
+        self._compiled = cached
+        self._general = cached.general
+        self._magazines = cached.magazines
+        self._check_backend()
+
+
+    def _check_backend(self):
+        """Check that the backend can access the libraries of all
+        magazines. The worker opens a library from its local directory,
+        so a ConfigurationError is raised when it is used with the URL of
+        a content server.
+        """
+        if self.backend != "worker":
+            return
+        for magazine in self._magazines.values():
+            if (magazine.library_path is not None
+                    and "://" in magazine.library_path):
+                raise ConfigurationError(f"magazine \"{magazine.name}\", "
+                        f"library '{magazine.library_path}': the worker "
+                        "backend can't access a content server")
+
+
+    def _compile(self, file_content, stat, digest, cached):
+        """Compile the configuration in file_content, the content of the
+        ini-file with the given stat and digest. The magazines whose
+        section is unchanged since the cached configuration, which may
+        be None, are taken from it. Returns the compiled configuration.
+        """
+        config = ConfigParser()
+        config.read_string('[__general__]\n' + file_content)
+        self._general = read_general(config["__general__"])
+
+        magazines = {}
+        sections = {}
+        for magazine in config.sections():
+            if magazine == "__general__":
+                continue
+            sections[magazine] = section_digest(
+                    config.items(magazine, raw=True),
+                    self.calibredb, self.library_path)
+            compiled = (cached.magazine(magazine, sections[magazine])
+                    if cached is not None else None)
+            magazines[magazine] = compiled or MagazineConfiguration(
+                    magazine, config[magazine], self)
+        return CachedConfiguration(stat, digest, self._general, magazines,
+                sections)
+
+
+    def is_current(self):
+        """Check whether the ini-file is unchanged since the
+        configuration was read.
+        """
+        try:
+            return self._compiled.matches(os.stat(self._config_file))
+        except OSError:
+            return True
+
+
+    def changed_magazines(self, previous):
+        """Return the names of the magazines that were added or changed
+        since the previous configuration, and those that were removed,
+        as a tuple of two lists.
+        """
+        sections = self._compiled.sections
+        previous_sections = previous._compiled.sections
+        changed = [magazine for magazine, digest in sections.items()
+                if previous_sections.get(magazine) != digest]
+        removed = [magazine for magazine in previous_sections
+                if magazine not in sections]
+        return changed, removed
+
+
+    @property
+    def config_file(self):
+        """Path to the ini-file that the configuration was read from."""
+        return self._config_file
 
-        self._config = ConfigParser()
-        self._config.read_string(file_content)
+
+    def state_file(self, name):
+        """Path to the file, named by name, in which the importer keeps
+        state between runs. State files are stored next to the
+        configuration file.
+        """
+        return f"{self._config_file}.{name}"
 
 
     @property
     def import_dir(self):
         """Directory from which to import files"""
-        return expanduser(self._config["__general__"]["importdir"])
+        return self._general["import_dir"]
 
 
     @property
     def calibredb(self):
         """Path to the calibredb executable"""
-        return self._config["__general__"].get("calibredb", "calibredb",
-                raw=True)
+        return self._general["calibredb"]
+
+
+    @property
+    def backend(self):
+        """The backend used to access the calibre library: calibredb or
+        worker.
+        """
+        return self._general["backend"]
+
+
+    @property
+    def calibre_debug(self):
+        """Path to the calibre-debug executable that runs the worker"""
+        return self._general["calibre_debug"]
+
+
+    @property
+    def batch_size(self):
+        """The maximum number of issues of one magazine that are added to
+        the calibre library at once
+        """
+        return self._general["batch_size"]
+
+
+    @property
+    def workers(self):
+        """The number of files that are matched, hashed and archived
+        concurrently
+        """
+        return self._general["workers"]
+
+
+    @property
+    def recursive(self):
+        """Whether files in subdirectories of the import directory are
+        imported too
+        """
+        return self._general["recursive"]
+
+
+    @property
+    def min_size(self):
+        """The minimum size in bytes of the files that are imported"""
+        return self._general["min_size"]
+
+
+    @property
+    def min_age(self):
+        """The number of seconds that must have passed since a file was
+        last modified before it is imported
+        """
+        return self._general["min_age"]
+
+
+    @property
+    def validate(self):
+        """Whether files are checked to be complete before they are
+        imported
+        """
+        return self._general["validate"]
+
+
+    @property
+    def check_stable(self):
+        """Whether files are only imported once their size and
+        modification time are unchanged since the previous run
+        """
+        return self._general["check_stable"]
+
+
+    @property
+    def lease_timeout(self):
+        """The number of seconds after which the lease on a file of an
+        importer that stopped expires, or 0 when the import directory
+        isn't shared with other importers
+        """
+        return self._general["lease_timeout"]
+
+
+    @property
+    def retry_delay(self):
+        """The number of seconds before a file that failed to import is
+        tried again, which doubles with every failure in a row
+        """
+        return self._general["retry_delay"]
+
+
+    @property
+    def max_retry_delay(self):
+        """The maximum number of seconds before a file that failed to
+        import is tried again
+        """
+        return self._general["max_retry_delay"]
+
+
+    @property
+    def failure_limit(self):
+        """The number of consecutive failures to add to a library after
+        which it isn't tried anymore during an import, or 0 to keep
+        trying
+        """
+        return self._general["failure_limit"]
+
+
+    @property
+    def order(self):
+        """The keys, of ORDERS, that the files in the import directory
+        are ordered by before they are imported; when there are none,
+        they are imported in the order that they are found in
+        """
+        return self._general["order"]
+
+
+    @property
+    def lease_dir(self):
+        """The directory in the import directory that holds the leases
+        on the files that are being imported
+        """
+        return join(self.import_dir, LEASE_DIR)
 
 
     @property
     def library_path(self):
-        """Path to the calibre library"""
-        return expanduser(self._config["__general__"].get("librarypath",
-            raw=True))
+        """Path to the calibre library, or None to use the library
+        stored in Calibre's settings
+        """
+        return self._general["library_path"]
+
+
+    @property
+    def formats(self):
+        """The formats of all magazines"""
+        return [magazine.format for magazine in self._magazines.values()]
+
+
+    @property
+    def archive_dirs(self):
+        """The archive directories of all magazines"""
+        return {magazine.archivedir for magazine in self._magazines.values()
+                if magazine.archivedir is not None}
+
+
+    @property
+    def excluded_dirs(self):
+        """The directories in the import directory whose files aren't
+        imported: the archive directories and the lease directory
+        """
+        return self.archive_dirs | {self.lease_dir}
 
 
     @property
     def magazines(self):
         """A list of all the magazines for which import rules have been
         defined."""
-        return [mag for mag in self._config.sections() if mag != "__general__"]
+        return list(self._magazines)
 
 
     def get_magazine(self, magazine):
         """Get the configuration of the magazine given as argument."""
-        return MagazineConfiguration(magazine, self._config[magazine])
+        return self._magazines[magazine]
 
 
     def print(self):
@@ -169,6 +631,19 @@ class ImporterConfiguration(object):
         print("  General settings:")
         print(f"    import dir  : {self.import_dir}")
         print(f"    calibre db  : {self.calibredb}")
+        print(f"    backend     : {self.backend}")
+        print(f"    batch size  : {self.batch_size}")
+        print(f"    workers     : {self.workers}")
+        print(f"    recursive   : {self.recursive}")
+        print(f"    min size    : {self.min_size}")
+        print(f"    min age     : {self.min_age}")
+        print(f"    validate    : {self.validate}")
+        print(f"    check stable: {self.check_stable}")
+        print(f"    lease time  : {self.lease_timeout}")
+        print(f"    retry delay : {self.retry_delay} - "
+                f"{self.max_retry_delay}")
+        print(f"    failures    : {self.failure_limit}")
+        print(f"    order       : {self.order}")
         print(f"    library path: {self.library_path}")
         print(f"    magazines   : {self.magazines}")
         print()
@@ -18,8 +18,37 @@ def to_year(number):
     return number
 
 
+# The names of the months, by their number; 0 is an unspecified month.
+MONTH_NAMES = ('',
+        'January', 'February', 'March', 'April',
+        'May', 'June', 'July', 'August',
+        'September', 'October', 'November', 'December'
+        )
+
+# The months by their string representations as numbers and by the
+# first three letters of their English names.
+MONTH_IDS = {
+        '1': 1, '01': 1, 'jan': 1,
+        '2': 2, '02': 2, 'feb': 2,
+        '3': 3, '03': 3, 'mar': 3,
+        '4': 4, '04': 4, 'apr': 4,
+        '5': 5, '05': 5, 'may': 5,
+        '6': 6, '06': 6, 'jun': 6,
+        '7': 7, '07': 7, 'jul': 7,
+        '8': 8, '08': 8, 'aug': 8,
+        '9': 9, '09': 9, 'sep': 9,
+        '10': 10, 'oct': 10,
+        '11': 11, 'nov': 11,
+        '12': 12, 'dec': 12
+        }
+
+
 class Month(object):
-    """A month of the year."""
+    """A month of the year. Months don't change once they are created,
+    so that the months 0 to 12 are shared; use Month.of to get them.
+    """
+
+    __slots__ = ("_month",)
 
     def __init__(self, number):
         """Create a month instance for the month given by number. The
@@ -39,12 +68,7 @@ class Month(object):
         specifier is given, the month is output as an integer.
         """
         if format_spec[-1:] == 's':
-            month_names = ['',
-                    'January', 'February', 'March', 'April',
-                    'May', 'June', 'July', 'August',
-                    'September', 'October', 'November', 'December'
-                    ]
-            return f"{month_names[self._month]:{format_spec}}"
+            return f"{MONTH_NAMES[self._month]:{format_spec}}"
         return f"{self._month:{format_spec}}"
 
 
@@ -55,10 +79,20 @@ class Month(object):
         returned is also unspecified.
         """
         if self._month == 0:
-            return Month(0)
+            return MONTHS[0]
         if self._month == 12:
-            return Month(1)
-        return Month(self._month + 1)
+            return MONTHS[1]
+        return Month.of(self._month + 1)
+
+
+    @staticmethod
+    def of(number):
+        """Return the month given by number, as Month(number) does. The
+        months 0 to 12 are shared instances.
+        """
+        if type(number) is int and 0 <= number <= 12:
+            return MONTHS[number]
+        return Month(number)
 
 
     @staticmethod
@@ -70,18 +104,7 @@ class Month(object):
         insensitive (abreviated) month name. The function is locale
         independent and only supports names in English.
         """
-        months = {
-                '1': 1, '01': 1, 'jan': 1,
-                '2': 2, '02': 2, 'feb': 2,
-                '3': 3, '03': 3, 'mar': 3,
-                '4': 4, '04': 4, 'apr': 4,
-                '5': 5, '05': 5, 'may': 5,
-                '6': 6, '06': 6, 'jun': 6,
-                '7': 7, '07': 7, 'jul': 7,
-                '8': 8, '08': 8, 'aug': 8,
-                '9': 9, '09': 9, 'sep': 9,
-                '10': 10, 'oct': 10,
-                '11': 11, 'nov': 11,
-                '12': 12, 'dec': 12
-                }
-        return months[month_id[:3].lower()]
+        return MONTH_IDS[month_id[:3].lower()]
+
+
+MONTHS = tuple(Month(number) for number in range(13))
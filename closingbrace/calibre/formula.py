@@ -0,0 +1,141 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import ast
+import marshal
+
+
+VARIABLES = ("V", "I", "Y", "M")
+
+OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.FloorDiv, ast.Mod, ast.UAdd,
+        ast.USub)
+
+# The symbols of the operators that aren't allowed, to report them.
+SYMBOLS = {ast.Div: "/", ast.Pow: "**", ast.LShift: "<<", ast.RShift: ">>",
+        ast.BitOr: "|", ast.BitXor: "^", ast.BitAnd: "&", ast.MatMult: "@",
+        ast.Invert: "~", ast.Not: "not"}
+
+# The globals that formulas are evaluated with: no builtins. Evaluating a
+# formula doesn't change them, so that they are shared.
+GLOBALS = {"__builtins__": {}}
+
+
+class FormulaError(Exception):
+    """Exception raised when a formula in the configuration is not a
+    valid formula.
+    """
+
+
+def check_node(node):
+    """Check that the node of a formula's syntax tree, and all nodes
+    below it, only do integer arithmetic on the variables V, I, Y and
+    M. When they do something else, a FormulaError is raised.
+    """
+    if isinstance(node, ast.Expression):
+        check_node(node.body)
+    elif isinstance(node, (ast.BinOp, ast.UnaryOp)):
+        if not isinstance(node.op, OPERATORS):
+            symbol = SYMBOLS.get(type(node.op), type(node.op).__name__)
+            hint = (", use '//' for integer division"
+                    if isinstance(node.op, ast.Div) else "")
+            raise FormulaError(f"operator '{symbol}' is not allowed in a "
+                    f"formula{hint}")
+        if isinstance(node, ast.BinOp):
+            check_node(node.left)
+            check_node(node.right)
+        else:
+            check_node(node.operand)
+    elif isinstance(node, ast.Name):
+        if node.id not in VARIABLES:
+            raise FormulaError(f"unknown field '{node.id}'")
+    elif isinstance(node, ast.Constant) and type(node.value) is int:
+        pass
+    else:
+        raise FormulaError(
+                f"{type(node).__name__} is not allowed in a formula")
+
+
+class Formula(object):
+    """A formula to calculate a volume, index, year or month from the
+    fields V, I, Y and M that were captured from a file name. The
+    formula is checked and compiled once, when it is created, and can
+    then be evaluated cheaply for every matching file.
+
+    Only integer constants, the variables V, I, Y and M, the operators
+    +, -, *, // and % and parentheses are allowed in a formula.
+
+    A formula can be pickled. Its compiled code is pickled with it, so
+    that it doesn't have to be checked and compiled again.
+    """
+
+    __slots__ = ("_expression", "_code", "_batch_code")
+
+    def __init__(self, expression):
+        """Compile the formula given by expression. When expression is
+        not a valid formula, a FormulaError is raised.
+        """
+        try:
+            tree = ast.parse(expression.strip(), mode="eval")
+        except SyntaxError as syntax_error:
+            raise FormulaError(f"syntax error: {syntax_error.msg}")
+        check_node(tree)
+
+        self._expression = expression
+        self._code = compile(tree, "<formula>", "eval")
+        self._batch_code = None
+
+
+    @property
+    def expression(self):
+        """The formula's expression as it was written."""
+        return self._expression
+
+
+    def __getstate__(self):
+        """Return the expression and the marshalled code to pickle."""
+        return (self._expression, marshal.dumps(self._code))
+
+
+    def __setstate__(self, state):
+        """Restore the expression and code from a pickle."""
+        self._expression = state[0]
+        self._code = marshal.loads(state[1])
+        self._batch_code = None
+
+
+    def _compile_batch(self):
+        """Compile the formula into a list comprehension that evaluates
+        it for a list of rows.
+        """
+        tree = ast.parse(self._expression.strip(), mode="eval")
+        check_node(tree)
+        variables = ast.Tuple(elts=[ast.Name(id=name, ctx=ast.Store())
+            for name in VARIABLES], ctx=ast.Store())
+        batch = ast.Expression(body=ast.ListComp(elt=tree.body,
+            generators=[ast.comprehension(target=variables,
+                iter=ast.Name(id="rows", ctx=ast.Load()), ifs=[],
+                is_async=0)]))
+        return compile(ast.fix_missing_locations(batch), "<formula>", "eval")
+
+
+    def evaluate(self, variables):
+        """Evaluate the formula with variables, a dictionary that maps
+        V, I, Y and M to their values.
+        """
+        return eval(self._code, GLOBALS, variables)
+
+
+    def evaluate_many(self, rows):
+        """Evaluate the formula for many matches at once. The rows are
+        (V, I, Y, M) tuples; a list with the value for every row is
+        returned.
+        """
+        if self._batch_code is None:
+            self._batch_code = self._compile_batch()
+        return eval(self._batch_code, GLOBALS, {"rows": rows})
@@ -0,0 +1,138 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(file_path):
+    """Return the SHA-256 hash of the file's content as a hexadecimal
+    string. The file is read in chunks, so that large files don't have
+    to fit in memory.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+class FileFingerprint(object):
+    """The size, modification time and content hash of a file. The hash
+    is only computed when it is needed.
+    """
+
+    def __init__(self, file_path, stat=None):
+        """Initialize the fingerprint of the file given by file_path.
+        When the file has been stat'ed already, the result of os.stat
+        can be passed in as stat. An OSError is raised when the file
+        can't be accessed.
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+        self._file_path = file_path
+        self._size = stat.st_size
+        self._mtime = stat.st_mtime_ns
+        self._hash = None
+
+
+    @property
+    def size(self):
+        """The file's size in bytes."""
+        return self._size
+
+
+    @property
+    def mtime(self):
+        """The file's modification time in nanoseconds."""
+        return self._mtime
+
+
+    @property
+    def hash(self):
+        """The hash of the file's content."""
+        self.compute_hash()
+        return self._hash
+
+
+    def compute_hash(self):
+        """Compute the hash of the file's content now, instead of when it
+        is first needed. An OSError is raised when the file can't be
+        read.
+        """
+        if self._hash is None:
+            self._hash = content_hash(self._file_path)
+
+
+class ImportIndex(object):
+    """A persistent index of the files that have been imported into the
+    calibre library. It maps a file's content hash and size, and the
+    magazine it was imported as, to the book id that it got.
+
+    The sizes of all indexed files are kept in memory, so that the hash
+    of a file is only computed when a file of the same size has been
+    imported before. The index can be used from several threads.
+    """
+
+    def __init__(self, database_path):
+        """Open the index in the SQLite database at database_path,
+        creating it when it doesn't exist yet.
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path,
+                check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS imported ("
+                "hash TEXT NOT NULL, size INTEGER NOT NULL, "
+                "series TEXT NOT NULL, book_id TEXT NOT NULL, "
+                "PRIMARY KEY (hash, size, series))")
+        self._connection.commit()
+        self._sizes = {size for (size,) in
+                self._connection.execute("SELECT DISTINCT size FROM imported")}
+
+
+    def lookup(self, fingerprint, series):
+        """Return the book id that the file with the given fingerprint
+        got when it was imported as a magazine of the series, or None
+        when it hasn't been imported as such.
+        """
+        if fingerprint.size not in self._sizes:
+            return None
+        content_hash = fingerprint.hash
+        with self._lock:
+            row = self._connection.execute("SELECT book_id FROM imported "
+                    "WHERE hash = ? AND size = ? AND series = ?",
+                    (content_hash, fingerprint.size, series)).fetchone()
+        return row[0] if row else None
+
+
+    def record(self, fingerprint, series, book_id):
+        """Record that the file with the given fingerprint was imported
+        as a magazine of the series and got book_id.
+        """
+        content_hash = fingerprint.hash
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO imported "
+                    "(hash, size, series, book_id) VALUES (?, ?, ?, ?)",
+                    (content_hash, fingerprint.size, series, book_id))
+            self._sizes.add(fingerprint.size)
+
+
+    def close(self):
+        """Close the index."""
+        self._connection.close()
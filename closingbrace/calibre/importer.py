@@ -7,153 +7,907 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import argparse
+import configparser
+import io
 import os
-import re
-import shutil
-import subprocess
+import sqlite3
+import sys
+import threading
+import time
 
+from closingbrace.calibre.archiver import Archiver
+from closingbrace.calibre.backend import BookRejectedError
+from closingbrace.calibre.backend import ImportError
+from closingbrace.calibre.backend import LibraryUnavailableError
+from closingbrace.calibre.configuration import ConfigurationError
 from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.formula import FormulaError
+from closingbrace.calibre.import_index import FileFingerprint
+from closingbrace.calibre.import_index import ImportIndex
+from closingbrace.calibre.journal import ADDED
+from closingbrace.calibre.journal import ADDING
+from closingbrace.calibre.journal import FAILED
+from closingbrace.calibre.journal import ImportJournal
+from closingbrace.calibre.journal import file_unchanged
+from closingbrace.calibre.lease import LeaseManager
+from closingbrace.calibre.lease import NO_LEASES
+from closingbrace.calibre.library import close_libraries
+from closingbrace.calibre.library import open_libraries
+from closingbrace.calibre.match_cache import NegativeMatchCache
 from closingbrace.calibre.matcher import MagazineMatcher
-from os.path import expanduser
+from closingbrace.calibre.matcher import MatchedMagazine
+from closingbrace.calibre.matcher import create_matched
+from closingbrace.calibre.metrics import ADD
+from closingbrace.calibre.metrics import ARCHIVE
+from closingbrace.calibre.metrics import MATCH
+from closingbrace.calibre.metrics import NO_METRICS
+from closingbrace.calibre.metrics import SCAN
+from closingbrace.calibre.metrics import SCHEDULE
+from closingbrace.calibre.metrics import UNLINK
+from closingbrace.calibre.metrics import VALIDATE
+from closingbrace.calibre.pipeline import OrderedOutput
+from closingbrace.calibre.pipeline import bounded_map
+from closingbrace.calibre.pipeline import fail_unfinished
+from closingbrace.calibre.pipeline import run_into
+from closingbrace.calibre.pipeline import when_all_done
+from closingbrace.calibre.plan import ImportPlan
+from closingbrace.calibre.plan import PlanError
+from closingbrace.calibre.retry import CircuitBreaker
+from closingbrace.calibre.retry import RetryQueue
+from closingbrace.calibre.scanner import scan_files
+from closingbrace.calibre.scheduler import ImportBudget
+from closingbrace.calibre.scheduler import order_files
+from closingbrace.calibre.stability import NO_SIZE_HISTORY
+from closingbrace.calibre.stability import SizeHistory
+from closingbrace.calibre.validator import InvalidFileError
+from closingbrace.calibre.validator import validate_file
+from closingbrace.calibre.watcher import DirectoryWatcher
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
 
 
-class ImportError(Exception):
-    """Exception raised when something went wrong during the import of
-    a magazine.
+# The number of files that are taken from the list of files to import
+# ahead of the import, for every worker.
+PREPARED_PER_WORKER = 4
+
+
+def import_magazines(cmd_line, importer_config, metrics):
+    """Import the magazines as the parsed command line cmd_line asks,
+    with the settings of importer_config, timing the import in metrics.
     """
+    verbose = cmd_line.verbose
+    budget = ImportBudget(cmd_line.max_runtime, cmd_line.max_files)
+    matcher = MagazineMatcher(
+            [importer_config.get_magazine(mag_name)
+                for mag_name in importer_config.magazines],
+            metrics)
+    if cmd_line.plan:
+        write_plan(importer_config, matcher, cmd_line.plan,
+                cmd_line.plan_format, verbose)
+        return
+    plan = None
+    if cmd_line.execute_plan:
+        try:
+            plan = ImportPlan.read(cmd_line.execute_plan, cmd_line.plan_format)
+            check_plan(plan, importer_config)
+        except PlanError as plan_error:
+            sys.exit(f"Cannot execute the plan: {plan_error}")
 
-    def __init__(self, stdout_text, stderr_text):
-        """Initialize the exception, using the text that was output to
-        stdout and stderr to create an error text.
-        """
-        self._error_text = (f"  stdout: {stdout_text}\n  stderr: {stderr_text}")
+    leases = NO_LEASES
+    if importer_config.lease_timeout > 0:
+        try:
+            leases = LeaseManager(importer_config.lease_dir,
+                    importer_config.lease_timeout)
+        except OSError as os_error:
+            sys.exit(f"Cannot create the lease directory: {os_error}")
 
+    try:
+        import_index = ImportIndex(importer_config.state_file("index"))
+    except sqlite3.Error as sqlite_error:
+        sys.exit(f"Cannot open the import index: {sqlite_error}")
+    try:
+        libraries = open_libraries(importer_config, metrics)
+    except OSError as os_error:
+        sys.exit(f"Cannot access the calibre library: {os_error}")
 
-    def get_text(self):
-        """Get the error text from the exception."""
-        return self._error_text
+    journal = ImportJournal(importer_config.state_file("journal"))
+    match_cache = NegativeMatchCache(importer_config.state_file("nomatch"),
+            importer_config.formats)
+    retry_queue = RetryQueue(importer_config.state_file("retry"),
+            importer_config.retry_delay, importer_config.max_retry_delay)
+    # In watch mode, the watcher waits for files to settle instead.
+    sizes = NO_SIZE_HISTORY
+    if importer_config.check_stable and not cmd_line.watch:
+        sizes = SizeHistory(importer_config.state_file("sizes"))
+    importer = MagazineImporter(importer_config, matcher, libraries,
+            import_index, journal, match_cache, retry_queue, verbose,
+            metrics, leases, sizes)
+    try:
+        if cmd_line.watch:
+            watch(importer, importer_config, cmd_line.settle_time,
+                    ConfigurationReloader(importer_config, importer))
+        elif plan is not None:
+            importer.import_plan(plan, budget)
+        else:
+            importer.import_directory(budget)
+    finally:
+        leases.close()
+        close_libraries(importer.libraries)
+        import_index.close()
+        journal.close()
 
 
-def parse_command_line():
-    """Parse command line arguments.
+def write_plan(importer_config, matcher, plan_file, plan_format, verbose):
+    """Match the files in the import directory with matcher and write
+    the plan of what would be imported to plan_file in plan_format.
     """
-    parser = argparse.ArgumentParser(
-            description="Import magazines into Calibre")
-    parser.add_argument("-c", "--config",
-            default=expanduser("~/.calibre-magazine-importer"),
-            help="configuration file for the importer (default: "
-            "$HOME/.calibre-magazine-importer)")
-    parser.add_argument("-v", "--verbose", help="be more verbose about "
-            "the magazines that are imported", action="store_true")
-    return parser.parse_args()
-
-
-def import_magazine(executable, library_path, file_path, magazine):
-    """Import a magazine into a Calibre library. The magazine's file
-    location is given by file_path, while metadata about the magazine is
-    given by magazine.
-    The location of the Calibre library is given by library_path, and
-    the executable used to import the magazine is given by executable.
-    The function returns the book id that the magazine got during
-    import.
-    When the import failed, a ImportError is raised.
+    plan = ImportPlan(importer_config.import_dir)
+    files = scan_files(importer_config.import_dir, importer_config.recursive,
+            importer_config.min_size, importer_config.min_age,
+            importer_config.excluded_dirs)
+    if importer_config.order:
+        files = order_files(files, importer_config.import_dir, matcher,
+                importer_config.order)
+    for chunk in matcher.match_many(files):
+        plan.extend(chunk)
+    try:
+        plan.write(plan_file, plan_format)
+    except OSError as os_error:
+        sys.exit(f"Cannot write the plan: {os_error}")
+
+    if verbose:
+        for file, issues in plan.files():
+            print(f"File '{file}'")
+            for series, number, title, archive in issues:
+                print(f"  - would be imported as '{title}' "
+                        f"({series} {number})")
+                if archive is not None:
+                    print(f"  - would be archived as '{archive}'")
+            print()
+    print(f"Planned {len(plan)} issues in '{plan_file}'")
+
+
+def check_plan(plan, importer_config):
+    """Check that the plan can be executed with importer_config. A
+    PlanError is raised when it can't.
     """
-    command = [executable, "add"]
-    if library_path is not None:
-        command.extend(["--library-path", library_path])
-    command.extend(["--authors", magazine.authors,
-        "--languages", magazine.languages,
-        "--series", magazine.series,
-        "--series-index", magazine.number,
-        "--tags", magazine.tags,
-        "--title", magazine.title,
-        file_path])
-
-    exec_result = subprocess.run(command, universal_newlines=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout_result = re.match('Added book ids: (\d+)\\n$', exec_result.stdout)
-
-    if not stdout_result or exec_result.stderr:
-        raise ImportError(exec_result.stdout, exec_result.stderr)
-    return stdout_result[1]
-
-
-def set_publisher(executable, library_path, book_id, publisher):
-    """Set the publisher for an imported book. The location of the
-    Calibre library is given by library_path, and the executable used to
-    import the magazine is given by executable.
-    When setting the publisher failed, a ImportError is raised.
+    if (plan.import_dir is not None
+            and plan.import_dir != importer_config.import_dir):
+        raise PlanError(f"the plan is for import directory "
+                f"'{plan.import_dir}'")
+    unknown = plan.series() - set(importer_config.magazines)
+    if unknown:
+        raise PlanError(f"magazines {', '.join(sorted(unknown))} are not "
+                "configured")
+
+
+def watch(importer, importer_config, settle_time, reloader):
+    """Import the files that are in the import directory, and keep
+    importing files as they appear in it, until interrupted. The files
+    that failed are imported again when their backoff has passed. The
+    configuration is reloaded by reloader, when it changed, before new
+    files are imported.
     """
-    command = [executable, "set_metadata"]
-    if library_path is not None:
-        command.extend(["--library-path", library_path])
-    command.extend([f"-fpublisher:{publisher}", book_id])
+    try:
+        watcher = DirectoryWatcher(importer_config.import_dir, settle_time,
+                importer_config.recursive, importer_config.min_size,
+                importer_config.excluded_dirs)
+    except OSError as os_error:
+        sys.exit(f"Cannot watch the import directory: {os_error}")
 
-    exec_result = subprocess.run(command, universal_newlines=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        retried = time.time()
+        importer.import_directory()
+        while True:
+            next_retry = importer.next_retry(retried)
+            files = watcher.wait_for_files(None if next_retry is None
+                    else max(0, next_retry - time.time()))
+            now = time.time()
+            files.extend(file for file in importer.retries(retried, now)
+                    if file not in files)
+            retried = now
+            if files:
+                reloader.reload()
+                importer.import_files(files)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
-    if exec_result.returncode != 0:
-        raise ImportError(exec_result.stdout, exec_result.stderr)
 
+class ConfigurationReloader(object):
+    """Reloads the configuration of a running importer when its ini-file
+    has changed. Only the magazines that were added or changed are
+    compiled again. When the changed configuration is invalid, it is
+    rejected and the importer keeps using the configuration it has.
+    """
 
-def run():
-    """Run the importer application."""
-    cmd_line = parse_command_line()
-    importer_config = ImporterConfiguration(cmd_line.config)
-    verbose = cmd_line.verbose
+    def __init__(self, importer_config, importer):
+        """Initialize the reloader for the importer, that was created
+        with importer_config.
+        """
+        self._config = importer_config
+        self._importer = importer
+        self._rejected = None
 
-    if verbose:
-        importer_config.print()
-        print(f"Processing files in directory {importer_config.import_dir}")
+
+    def reload(self):
+        """Reload the configuration when its ini-file has changed since
+        it was last read, reporting what changed.
+        """
+        if self._config.is_current():
+            return
+        try:
+            stat = os.stat(self._config.config_file)
+        except OSError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) == self._rejected:
+            return
+
+        try:
+            importer_config = ImporterConfiguration(self._config.config_file,
+                    self._config)
+            self._importer.reconfigure(importer_config)
+        except (configparser.Error, ConfigurationError, FormulaError,
+                KeyError, ValueError, OSError) as error:
+            self._rejected = (stat.st_mtime_ns, stat.st_size)
+            print("Configuration NOT reloaded, the previous configuration "
+                    "is kept. Error:")
+            print(f"  {error}")
+            print()
+            return
+
+        changed, removed = importer_config.changed_magazines(self._config)
+        self._config = importer_config
+        self._rejected = None
+        print(f"Configuration reloaded from '{importer_config.config_file}'")
+        if changed:
+            print(f"  - magazines added or changed: {', '.join(changed)}")
+        if removed:
+            print(f"  - magazines removed: {', '.join(removed)}")
         print()
 
-    matcher = MagazineMatcher(
-            [importer_config.get_magazine(mag_name)
-                for mag_name in importer_config.magazines]
-            )
-    files = next(os.walk(importer_config.import_dir))[2]
-    for file in files:
-        delete_file = True
-        file_path = join(importer_config.import_dir, file)
-        matched_magazines = matcher.match(file)
-        if not matched_magazines:
-            continue
-
-        print(f"File '{file}'")
+
+class MagazineImporter(object):
+    """Imports the files in the import directory that match one of the
+    configured magazines into the calibre library.
+
+    Files that have been imported before as the same magazine, as
+    recorded in the import index, are not imported again, but only
+    archived and removed. Issues that are already in their library, as
+    found in the library's index, are not imported and left in the
+    import directory. The progress of every file is recorded in the
+    journal, so that an interrupted run can be resumed. Files that
+    don't match any magazine are recorded in the match cache, so that
+    they aren't parsed again as long as they don't change. Files that
+    failed to import are recorded in the retry queue, and aren't tried
+    again until their backoff has passed. When adding to a library
+    fails too many times in a row, the library is taken to be
+    unavailable, and isn't tried anymore during the import.
+
+    The import is a pipeline: files are matched and hashed, and files
+    are archived, by a pool of workers. Every library has a single
+    writer that adds the issues to it, one batch at a time, so that
+    different libraries are written to at the same time. The output
+    for the files is printed in the order in which the files were
+    given.
+
+    The time spent in every stage, and the outcomes of the import, are
+    recorded in the run metrics and written after every import.
+
+    When sizes is a SizeHistory, the files that are found by scanning
+    the import directory are only imported once their size and
+    modification time are unchanged since the previous scan.
+
+    When the import directory is shared with importers on other hosts,
+    every file is claimed through the leases only when its first issue
+    is about to be added, or when it is processed if it has nothing to
+    add, and released once it has been processed. Files are matched
+    ahead of the import without claiming them, so that the importers
+    share the files.
+    """
+
+    def __init__(self, importer_config, matcher, libraries, import_index,
+            journal, match_cache, retry_queue, verbose, metrics=NO_METRICS,
+            leases=NO_LEASES, sizes=NO_SIZE_HISTORY):
+        """Initialize the importer. Files are matched with matcher, using
+        match_cache to skip files that didn't match before, checked to be
+        stable with sizes, claimed through leases, imported into
+        libraries and recorded in import_index and journal. Failed files
+        are recorded in retry_queue. The libraries map the library of
+        every magazine to its Library. The stages are timed in metrics.
+        """
+        self._import_dir = importer_config.import_dir
+        self._importer_config = importer_config
+        self._configure_scan(importer_config)
+        self._batch_size = importer_config.batch_size
+        self._workers = importer_config.workers
+        self._failure_limit = importer_config.failure_limit
+        self._matcher = matcher
+        self._libraries = libraries
+        self._import_index = import_index
+        self._journal = journal
+        self._match_cache = match_cache
+        self._retry_queue = retry_queue
+        self._sizes = sizes
+        self._breakers = {}
+        self._verbose = verbose
+        self._metrics = metrics
+        self._leases = leases
+        self._pending = {}
+        self._budget = ImportBudget()
+        self._started = {}
+        self._started_lock = threading.Lock()
+
+
+    @property
+    def libraries(self):
+        """The libraries that the importer imports into, as a dictionary
+        from the library of a magazine to its Library.
+        """
+        return self._libraries
+
+
+    def reconfigure(self, importer_config):
+        """Import the next files with the magazines and settings of the
+        changed importer_config. The libraries of added magazines are
+        opened; the import directory and the backend of the libraries
+        that are open already don't change. An OSError is raised, and
+        the importer is left unchanged, when a library can't be opened.
+        """
+        self._libraries = open_libraries(importer_config, self._metrics,
+                self._libraries)
+        self._importer_config = importer_config
+        self._configure_scan(importer_config)
+        self._batch_size = importer_config.batch_size
+        self._workers = importer_config.workers
+        self._failure_limit = importer_config.failure_limit
+        self._matcher.update([importer_config.get_magazine(magazine)
+            for magazine in importer_config.magazines])
+        self._match_cache.set_formats(importer_config.formats)
+
+
+    def _configure_scan(self, importer_config):
+        """Take the settings for scanning the import directory from
+        importer_config.
+        """
+        self._recursive = importer_config.recursive
+        self._min_size = importer_config.min_size
+        self._min_age = importer_config.min_age
+        self._validate = importer_config.validate
+        self._order = importer_config.order
+        self._excluded_dirs = importer_config.excluded_dirs
+
+
+    def import_directory(self, budget=None):
+        """Import all files in the import directory that match one of
+        the configured magazines, until the ImportBudget budget runs
+        out. Unless the files are ordered, the directory is read while
+        the files are imported.
+        """
+        self._match_cache.start_scan()
+        self._retry_queue.start_scan()
+        self._sizes.start_scan()
+        files = self._metrics.time_iteration(SCAN, scan_files(
+            self._import_dir, self._recursive, self._min_size,
+            self._min_age, self._excluded_dirs))
+        if self._order:
+            with self._metrics.time(SCHEDULE):
+                files = order_files(files, self._import_dir, self._matcher,
+                        self._order, self._match_cache)
+        self.import_files(files, budget)
+
+
+    def import_files(self, files, budget=None):
+        """Import the files, given by their paths relative to the import
+        directory, that match one of the configured magazines, until the
+        ImportBudget budget runs out. The files can be any iterable; its
+        items are only taken as the workers are ready for them.
+        """
+        self._import(files, self._prepare, budget)
+
+
+    def next_retry(self, since):
+        """Return the time, as given by time.time(), at which the first
+        file in the retry queue whose backoff ends after since is due,
+        or None when there is no such file.
+        """
+        return self._retry_queue.next_attempt(since)
+
+
+    def retries(self, since, until):
+        """Return the files in the retry queue, by their paths relative
+        to the import directory, whose backoff ended after since and at
+        or before until.
+        """
+        return self._retry_queue.due(since, until)
+
+
+    def import_plan(self, plan, budget=None):
+        """Import the files in the ImportPlan plan as it was planned,
+        without matching them, until the ImportBudget budget runs out.
+        All magazines in the plan must be configured.
+        """
+        self._import(plan.files(), self._prepare_planned, budget)
+
+
+    def _import(self, items, prepare, budget):
+        """Import the items, each of which is turned into a prepared
+        file by prepare, until the budget runs out. No budget is an
+        unlimited one. The budget is checked as the files are started;
+        files that were prepared ahead, but can't be started anymore,
+        are left for the next run.
+        """
+        if budget is None:
+            budget = ImportBudget()
+        self._budget = budget
+        output = OrderedOutput()
+        writers, self._breakers = self._writers()
+        try:
+            with ThreadPoolExecutor(self._workers) as pool:
+                for prepared in bounded_map(pool, prepare,
+                        budget.limit(items),
+                        PREPARED_PER_WORKER * self._workers):
+                    if prepared is not None:
+                        output.add(self._schedule(prepared, pool, writers))
+                    output.print_ready()
+                for batch in self._pending.values():
+                    writers[batch[0][1].library].submit(self._add_batch,
+                            batch)
+                self._pending = {}
+                output.print_all()
+        finally:
+            for writer in set(writers.values()):
+                writer.shutdown()
+        self._report_budget(budget)
+        if budget.reason is not None:
+            # The files after the ones that were imported weren't looked
+            # up, and must be kept.
+            self._match_cache.stop_scan()
+            self._retry_queue.stop_scan()
+            self._sizes.stop_scan()
+        self._journal.compact()
+        self._match_cache.write()
+        try:
+            self._retry_queue.write()
+        except OSError as os_error:
+            print(f"Retry queue NOT written. Error:\n  {os_error}")
+            print()
+        try:
+            self._sizes.write()
+        except OSError as os_error:
+            print(f"Size history NOT written. Error:\n  {os_error}")
+            print()
+        self._write_metrics()
+
+
+    def _writers(self):
+        """Create the writers and the circuit breakers of the libraries.
+        Returns two dictionaries that map the library of a magazine to
+        its writer and to its breaker. Libraries that are the same
+        library, given with another calibredb or another path, share a
+        writer and a breaker, so that only one process writes to every
+        library at a time.
+        """
+        shared = {}
+        writers = {}
+        breakers = {}
+        for key, library in self._libraries.items():
+            if library.resolved_path not in shared:
+                shared[library.resolved_path] = (ThreadPoolExecutor(1),
+                        CircuitBreaker(self._failure_limit))
+            writers[key], breakers[key] = shared[library.resolved_path]
+        return writers, breakers
+
+
+    def _prepare(self, file):
+        """Match the file and find the matched magazines that have been
+        imported before, or that are in the library already. Returns a
+        (file_path, fingerprint, matched_magazines, known) tuple, where
+        known maps the magazines that won't be added to their book id or
+        ImportError. Returns None when the file doesn't need importing.
+        """
+        name = os.path.basename(file)
+        with self._metrics.time(MATCH, (file,)):
+            candidates = self._matcher.candidates(name)
+            if not candidates:
+                return None
+            file_path = join(self._import_dir, file)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                # The file disappeared after the directory was read.
+                return None
+            if self._match_cache.contains(file, stat):
+                return None
+            if not self._sizes.is_stable(file, stat):
+                self._metrics.count("files", "unstable")
+                return None
+            if not self._is_due(file, stat):
+                return None
+            parsed = self._matcher.parse(name, candidates)
+            if not parsed:
+                self._match_cache.add(file, stat)
+                return None
+        # The formulas are only evaluated, and timed, when the issue's
+        # number or title is needed.
+        matched_magazines = [create_matched(match, self._metrics)
+                for match in parsed]
+        return self._prepare_matched(file_path, stat, matched_magazines)
+
+
+    def _prepare_planned(self, planned):
+        """Prepare a file of a plan, given as a (file, issues) tuple, for
+        importing as the planned issues. Returns the same as _prepare.
+        """
+        file, issues = planned
+        file_path = join(self._import_dir, file)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            # The file disappeared after the plan was made.
+            return None
+        if not self._is_due(file, stat):
+            return None
+        matched_magazines = [MatchedMagazine(
+            self._importer_config.get_magazine(series),
+            os.path.basename(file), None,
+            os.path.dirname(archive) if archive is not None else None,
+            (number, title))
+            for series, number, title, archive in issues]
+        return self._prepare_matched(file_path, stat, matched_magazines)
+
+
+    def _is_due(self, file, stat):
+        """Check whether the file, given by its path relative to the
+        import directory and the result of os.stat, may be tried now, as
+        it didn't fail before or its backoff has passed.
+        """
+        if self._retry_queue.is_due(file, stat.st_size, stat.st_mtime_ns):
+            return True
+        self._metrics.count("files", "backing_off")
+        return False
+
+
+    def _start(self, file_path, fingerprint):
+        """Start importing the file at file_path, with the given
+        fingerprint, by claiming it and counting it in the budget. A file
+        is started once, when its first issue is about to be added, or
+        when it is processed if it has nothing to add. Returns whether
+        the file was started; it isn't when the budget ran out or it
+        can't be claimed.
+        """
+        with self._started_lock:
+            started = self._started.get(file_path)
+            if started is None:
+                started = (not self._budget.is_exhausted()
+                        and self._claim(file_path, fingerprint))
+                if started:
+                    self._budget.start_file()
+                self._started[file_path] = started
+            return started
+
+
+    def _claim(self, file_path, fingerprint):
+        """Claim the file at file_path, with the given fingerprint.
+        Returns whether it was claimed; it isn't when another importer
+        claimed it, or when it changed or disappeared since it was
+        prepared.
+        """
+        if self._leases is NO_LEASES:
+            return True
+        file = os.path.relpath(file_path, self._import_dir)
+        if not self._leases.claim(file):
+            self._metrics.count("files", "claimed_elsewhere")
+            return False
+        # Another importer may have imported, and removed or replaced,
+        # the file just before it was claimed.
+        if file_unchanged(file_path, fingerprint.size, fingerprint.mtime):
+            return True
+        self._leases.release(file)
+        return False
+
+
+    def _finish(self, file_path):
+        """Release the claim on the file at file_path, if it was
+        claimed.
+        """
+        with self._started_lock:
+            started = self._started.pop(file_path, False)
+        if started:
+            self._leases.release(os.path.relpath(file_path, self._import_dir))
+
+
+    def _prepare_matched(self, file_path, stat, matched_magazines):
+        """Find the matched magazines of the file at file_path, with the
+        given result of os.stat, that have been imported before, or that
+        are in the library already. When any of them must still be
+        added, the file is validated first; the magazines of an invalid
+        file aren't added. The file's hash is computed here, so that the
+        writer only has to record it once the file has been added.
+        Returns the same as _prepare.
+        """
+        fingerprint = FileFingerprint(file_path, stat)
+
+        known = {}
         for match in matched_magazines:
+            book_id = self._journal.book_id(file_path, fingerprint,
+                    match.series)
+            if book_id is None:
+                book_id = self._import_index.lookup(fingerprint, match.series)
+            if book_id is not None:
+                known[match] = book_id
+            elif self._in_library(match):
+                known[match] = ImportError("", f"issue {match.number} of "
+                        f"'{match.series}' is already in the library")
+
+        if self._validate and len(known) < len(matched_magazines):
+            invalid = self._check_file(file_path)
+            if invalid is not None:
+                for match in matched_magazines:
+                    known.setdefault(match, invalid)
+        if len(known) < len(matched_magazines):
+            try:
+                fingerprint.compute_hash()
+            except OSError as os_error:
+                unreadable = ImportError("", f"file can't be read: {os_error}")
+                for match in matched_magazines:
+                    known.setdefault(match, unreadable)
+        return file_path, fingerprint, matched_magazines, known
+
+
+    def _check_file(self, file_path):
+        """Check that the file at file_path is complete. Returns an
+        ImportError for the file when it isn't, or None when it is.
+        """
+        with self._metrics.time(VALIDATE, (os.path.basename(file_path),)):
             try:
-                if verbose:
-                    match.print()
+                validate_file(file_path)
+                return None
+            except (InvalidFileError, OSError) as error:
+                self._metrics.count("files", "invalid")
+                return ImportError("", f"file is not valid: {error}")
+
+
+    def _in_library(self, match):
+        """Check whether the matched magazine is in its library."""
+        library_index = self._libraries[match.library].index
+        return (library_index is not None
+                and library_index.contains(match.series, match.number))
+
+
+    def _schedule(self, prepared, pool, writers):
+        """Schedule the matched magazines of a prepared file to be added
+        by the writers of their libraries, and the file to be archived by
+        the pool once all of them have been added. Returns a future for
+        the file's output.
+        """
+        file_path, fingerprint, matched_magazines, known = prepared
+        results = []
+        for match in matched_magazines:
+            result = Future()
+            if match in known:
+                result.set_result(known[match])
+            else:
+                self._queue_add(writers[match.library],
+                        (file_path, match, fingerprint, result))
+            results.append(result)
 
-                book_id = import_magazine(executable=importer_config.calibredb,
-                        library_path=importer_config.library_path,
-                        file_path=file_path,
-                        magazine=match)
+        output = Future()
+        when_all_done(results, lambda: pool.submit(run_into, output,
+            self._process_file, file_path, fingerprint,
+            matched_magazines, results, known))
+        return output
 
-                set_publisher(executable=importer_config.calibredb,
-                        library_path=importer_config.library_path,
-                        book_id=book_id, publisher=match.publisher)
+
+    def _queue_add(self, writer, item):
+        """Queue an issue to be added to the library. The issues of a
+        magazine are handed to the writer in batches.
+        """
+        batch = self._pending.setdefault(item[1].series, [])
+        batch.append(item)
+        if len(batch) >= self._batch_size:
+            writer.submit(self._add_batch, self._pending.pop(item[1].series))
+
+
+    def _add_batch(self, batch):
+        """Add a batch of issues of the same magazine, given as
+        (file_path, match, fingerprint, result) tuples, to the calibre
+        library. The book id or ImportError of every issue is stored in
+        its result future. The files of the issues are started right
+        before they are added; the result of an issue whose file can't
+        be started is None. The stages of the issues are recorded in the
+        journal before and after they are added.
+        """
+        library = self._libraries[batch[0][1].library]
+        breaker = self._breakers[batch[0][1].library]
+        if breaker.is_open:
+            for _, _, _, result in batch:
+                result.set_result(LibraryUnavailableError(breaker.failures))
+            return
+        started = []
+        for item in batch:
+            file_path, _, fingerprint, result = item
+            if self._start(file_path, fingerprint):
+                started.append(item)
+            else:
+                result.set_result(None)
+        if not started:
+            return
+        batch = started
+        try:
+            self._journal.record([(file_path, fingerprint, match.series,
+                ADDING, None) for file_path, match, fingerprint, _ in batch])
+            with self._metrics.time(ADD, [os.path.basename(file_path)
+                for file_path, _, _, _ in batch]):
+                book_ids = library.backend.add_many([(file_path, match)
+                    for file_path, match, _, _ in batch])
+            self._record_added(library, batch, book_ids)
+        except BaseException as exception:
+            fail_unfinished([result for _, _, _, result in batch], exception)
+            raise
+
+        for (_, _, _, result), book_id in zip(batch, book_ids):
+            # A book that the library rejected shows that the library
+            # itself works.
+            breaker.record(isinstance(book_id, ImportError)
+                    and not isinstance(book_id, BookRejectedError))
+            result.set_result(book_id)
+
+
+    def _record_added(self, library, batch, book_ids):
+        """Record the outcome of adding a batch of issues to library in
+        the journal, the import index and the library's index.
+        """
+        transitions = []
+        for (file_path, match, fingerprint, _), result in zip(batch, book_ids):
+            if isinstance(result, ImportError):
+                transitions.append((file_path, fingerprint, match.series,
+                    FAILED, None))
+            else:
+                transitions.append((file_path, fingerprint, match.series,
+                    ADDED, result))
+        self._journal.record(transitions)
+
+        for (_, match, fingerprint, _), result in zip(batch, book_ids):
+            if not isinstance(result, ImportError):
+                self._import_index.record(fingerprint, match.series, result)
+                if library.index is not None:
+                    library.index.add(match.series, match.number)
+
+
+    def _process_file(self, file_path, fingerprint, *results):
+        """Process the results for the file at file_path, with the given
+        fingerprint, as _process_results does, and release the claim on
+        the file. A file that can't be started, as another importer
+        claimed it, isn't processed. Returns the report, which is empty
+        for a file that isn't processed.
+        """
+        try:
+            if not self._start(file_path, fingerprint):
+                return ""
+            return self._process_results(file_path, fingerprint, *results)
+        finally:
+            self._finish(file_path)
+
+
+    def _process_results(self, file_path, fingerprint, matched_magazines,
+            results, known):
+        """Report the import results for a file and archive the file for
+        every magazine that it was imported as. When the file was
+        imported and archived successfully for all magazines, it is
+        removed. The results are futures with the book id or ImportError
+        for each of the matched magazines. Returns the report.
+        """
+        results = {match: result.result()
+                for match, result in zip(matched_magazines, results)}
+        imported = [match for match in matched_magazines
+                if not isinstance(results[match], ImportError)]
+        delete_file = len(imported) == len(matched_magazines)
+        archiver = Archiver(file_path)
+        out = io.StringIO()
+        file = os.path.relpath(file_path, self._import_dir)
+        self._record_retry(file, fingerprint, [results[match]
+            for match in matched_magazines if match not in known])
+
+        print(f"File '{file}'", file=out)
+        for match in matched_magazines:
+            if self._verbose:
+                match.print(file=out)
+
+            result = results[match]
+            self._count_result(match, result, known)
+            if isinstance(result, ImportError):
+                print(f" - NOT imported as '{match.title}'. Error:", file=out)
+                print(result.get_text(), file=out)
+                print(file=out)
+                continue
+            if match in known:
+                print(f"  - already imported into library as '{match.title}' "
+                        f"(book id {result})", file=out)
+            else:
                 print("  - successfullly imported into library as '{}'".format(
-                    match.title))
-
-                archived_file = join(match.archivedir, match.filename)
-                shutil.copy(file_path, archived_file)
-                print(f"  - successfullly archived as '{archived_file}'")
-            except ImportError as import_error:
-                print(f" - NOT imported as '{match.title}'. Error:")
-                print(import_error.get_text())
-                print()
-                delete_file = False
+                    match.title), file=out)
+
+            if match.archivedir is None:
+                continue
+            archived_file = join(match.archivedir, match.filename)
+            try:
+                with self._metrics.time(ARCHIVE, (file,)):
+                    archiver.archive(archived_file,
+                            move=delete_file and match is imported[-1])
+                self._metrics.count("archives", "archived")
+                print(f"  - successfullly archived as '{archived_file}'",
+                        file=out)
             except OSError as os_error:
-                print(f" - NOT archived as '{archived_file}'. Error:")
-                print(f"  {os_error}")
-                print()
+                self._metrics.count("archives", "failed")
+                print(f" - NOT archived as '{archived_file}'. Error:",
+                        file=out)
+                print(f"  {os_error}", file=out)
+                print(file=out)
                 delete_file = False
 
         if delete_file:
-            os.unlink(file_path)
-            print(f"  - successfullly removed from download directory")
+            with self._metrics.time(UNLINK, (file,)):
+                archiver.remove()
+            self._journal.finish(file_path, fingerprint)
+            print(f"  - successfullly removed from download directory",
+                    file=out)
+
+        print(file=out)
+        return out.getvalue()
+
 
+    def _record_retry(self, file, fingerprint, added):
+        """Record the file, given by its path relative to the import
+        directory, in the retry queue when adding any of its magazines
+        failed, with the results of the magazines that were added in
+        added. The file is dropped from the queue once one of its
+        magazines has been added. Magazines that weren't tried, because
+        their library was unavailable, don't count: a file none of whose
+        magazines were tried keeps its backoff.
+        """
+        failures = [result for result in added
+                if isinstance(result, ImportError)
+                and not isinstance(result, LibraryUnavailableError)]
+        if failures:
+            self._retry_queue.failed(file, fingerprint.size, fingerprint.mtime,
+                    failures[-1].get_text())
+        elif any(not isinstance(result, ImportError) for result in added):
+            self._retry_queue.succeeded(file)
+
+
+    def _count_result(self, match, result, known):
+        """Count the outcome of importing a matched magazine."""
+        if isinstance(result, LibraryUnavailableError):
+            self._metrics.count("issues", "not_tried")
+        elif isinstance(result, ImportError):
+            self._metrics.count("issues",
+                    "skipped" if match in known else "failed")
+        elif match in known:
+            self._metrics.count("issues", "already_imported")
+        else:
+            self._metrics.count("issues", "imported")
+
+
+    def _report_budget(self, budget):
+        """Report that the import stopped early, when the budget ran
+        out.
+        """
+        if budget.reason is None:
+            return
+        self._metrics.count("budget", budget.reason)
+        print(f"Import stopped after {budget.files} files, as the "
+                f"{budget.reason} budget ran out. The remaining files are "
+                "imported in the next run.")
         print()
+
+
+    def _write_metrics(self):
+        """Write the run metrics, reporting when they can't be written."""
+        try:
+            self._metrics.write()
+        except OSError as os_error:
+            print(f"Metrics NOT written. Error:\n  {os_error}")
+            print()
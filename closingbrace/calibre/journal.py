@@ -0,0 +1,155 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import threading
+
+
+# The stages that a file goes through for every magazine it matches.
+ADDING = "adding"
+ADDED = "added"
+FAILED = "failed"
+DONE = "done"
+
+
+def file_unchanged(file_path, size, mtime):
+    """Check whether the file at file_path still has the given size and
+    modification time.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    return stat.st_size == size and stat.st_mtime_ns == mtime
+
+
+class ImportJournal(object):
+    """An append-only journal of the progress of the import of every
+    file. Every stage transition is written and synced to disk before
+    the importer continues, so that a run that is interrupted can be
+    resumed where it stopped: a file that was added to the library, but
+    not yet archived and removed, is not added again.
+
+    Files are identified by their path, size and modification time, so
+    that a new file with the same name isn't mistaken for an old one.
+    Entries of files that are done, or that have disappeared, are
+    compacted away when the journal is opened and closed. The journal
+    can be used from several threads.
+    """
+
+    def __init__(self, journal_path):
+        """Open the journal at journal_path, creating it when it doesn't
+        exist yet.
+        """
+        self._journal_path = journal_path
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(journal_path) as f:
+                for line in f:
+                    self._replay(line)
+        except FileNotFoundError:
+            pass
+        self._compact()
+        self._journal = open(journal_path, "a")
+
+
+    def _replay(self, line):
+        """Apply a line of the journal to the entries."""
+        try:
+            self._apply(json.loads(line))
+        except (ValueError, KeyError):
+            # A partially written last line of an interrupted run.
+            pass
+
+
+    def _apply(self, entry):
+        """Apply a journal entry to the entries."""
+        file_key = (entry["file"], entry["size"], entry["mtime"])
+        if entry["stage"] == DONE:
+            self._entries.pop(file_key, None)
+        elif entry["stage"] == FAILED:
+            self._entries.get(file_key, {}).pop(entry["series"], None)
+        else:
+            self._entries.setdefault(file_key, {})[entry["series"]] = entry
+
+
+    def _compact(self):
+        """Rewrite the journal with only the entries of files that are
+        not done yet and that are still in the import directory.
+        """
+        self._entries = {file_key: series_entries
+                for file_key, series_entries in self._entries.items()
+                if series_entries and file_unchanged(*file_key)}
+        temporary_path = self._journal_path + ".new"
+        with open(temporary_path, "w") as f:
+            for series_entries in self._entries.values():
+                for entry in series_entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self._journal_path)
+
+
+    def _append(self, entries):
+        """Append the entries to the journal and sync it to disk."""
+        with self._lock:
+            for entry in entries:
+                self._journal.write(json.dumps(entry) + "\n")
+                self._apply(entry)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+
+    def book_id(self, file_path, fingerprint, series):
+        """Return the book id that the file got when it was added as a
+        magazine of the series in an earlier, unfinished run, or None
+        when it hasn't been added.
+        """
+        with self._lock:
+            entry = self._entries.get(
+                    (file_path, fingerprint.size, fingerprint.mtime),
+                    {}).get(series)
+        if entry is None or entry["stage"] != ADDED:
+            return None
+        return entry["book_id"]
+
+
+    def record(self, transitions):
+        """Record stage transitions. The transitions are (file_path,
+        fingerprint, series, stage, book_id) tuples; book_id is only
+        used for the stage ADDED.
+        """
+        self._append([{"file": file_path, "size": fingerprint.size,
+            "mtime": fingerprint.mtime, "series": series, "stage": stage,
+            "book_id": book_id}
+            for file_path, fingerprint, series, stage, book_id in transitions])
+
+
+    def finish(self, file_path, fingerprint):
+        """Record that the file is done: it has been imported, archived
+        and removed.
+        """
+        self._append([{"file": file_path, "size": fingerprint.size,
+            "mtime": fingerprint.mtime, "series": None, "stage": DONE}])
+
+
+    def compact(self):
+        """Compact the journal while it is open."""
+        with self._lock:
+            self._journal.close()
+            self._compact()
+            self._journal = open(self._journal_path, "a")
+
+
+    def close(self):
+        """Close the journal, compacting it."""
+        self._journal.close()
+        self._compact()
@@ -0,0 +1,166 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+from os.path import join
+
+
+class LeaseManager(object):
+    """Claims files in a shared import directory, so that of several
+    importers, on the same or on different hosts, exactly one imports
+    each file.
+
+    A file is claimed by creating its lease file exclusively in the
+    lease directory, which is atomic on local file systems and NFS
+    alike. The lease file is removed when the file has been processed.
+    While a file is being imported, its lease is renewed by touching it
+    regularly. A lease that hasn't been renewed for the lease timeout
+    belongs to an importer that died, and is reclaimed by the next
+    importer that wants the file.
+    """
+
+    def __init__(self, lease_dir, timeout):
+        """Initialize the manager for the leases in lease_dir, which
+        expire after timeout seconds. An OSError is raised when the
+        lease directory can't be created.
+        """
+        os.makedirs(lease_dir, exist_ok=True)
+        self._lease_dir = lease_dir
+        self._timeout = timeout
+        self._owner = f"{socket.gethostname()}.{os.getpid()}"
+        self._lock = threading.Lock()
+        self._held = {}
+        self._stopped = threading.Event()
+        self._renewer = threading.Thread(target=self._renew, daemon=True)
+        self._renewer.start()
+
+
+    def claim(self, file):
+        """Claim the file, given by its path relative to the import
+        directory. Returns whether the file was claimed; it wasn't when
+        another importer holds a lease on it that hasn't expired.
+        """
+        lease_file = self._lease_file(file)
+        for attempt in range(2):
+            try:
+                fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                        0o644)
+            except FileExistsError:
+                if attempt > 0 or not self._reclaim(lease_file):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps({"file": file, "owner": self._owner})
+                        + "\n")
+            with self._lock:
+                self._held[file] = lease_file
+            return True
+        return False
+
+
+    def release(self, file):
+        """Release the claim on the file, if it is held."""
+        with self._lock:
+            lease_file = self._held.pop(file, None)
+        if lease_file is not None:
+            try:
+                os.unlink(lease_file)
+            except OSError:
+                pass
+
+
+    def close(self):
+        """Stop renewing the leases and release all of them."""
+        self._stopped.set()
+        self._renewer.join()
+        with self._lock:
+            files = list(self._held)
+        for file in files:
+            self.release(file)
+
+
+    def _lease_file(self, file):
+        """Return the path of the lease file of the file."""
+        return join(self._lease_dir,
+                hashlib.sha256(file.encode()).hexdigest() + ".lease")
+
+
+    def _reclaim(self, lease_file):
+        """Remove the lease_file when it has expired. Returns whether the
+        lease may be claimed again.
+
+        The expired lease is renamed before it is removed, so that of the
+        importers that try to reclaim it at the same time, only one
+        succeeds. When the renamed lease turns out to have been claimed
+        or renewed in the meantime, it is put back.
+        """
+        try:
+            expired = os.stat(lease_file)
+        except FileNotFoundError:
+            return True
+        if time.time() - expired.st_mtime < self._timeout:
+            return False
+
+        stale_file = f"{lease_file}.{self._owner}.stale"
+        try:
+            os.rename(lease_file, stale_file)
+        except FileNotFoundError:
+            # Another importer reclaimed it first.
+            return True
+        try:
+            renamed = os.stat(stale_file)
+            if (renamed.st_ino, renamed.st_mtime_ns) != (expired.st_ino,
+                    expired.st_mtime_ns):
+                try:
+                    os.link(stale_file, lease_file)
+                except OSError:
+                    pass
+                return False
+            return True
+        finally:
+            os.unlink(stale_file)
+
+
+    def _renew(self):
+        """Touch the held leases regularly until the manager is closed."""
+        while not self._stopped.wait(self._timeout / 3):
+            with self._lock:
+                lease_files = list(self._held.values())
+            for lease_file in lease_files:
+                try:
+                    os.utime(lease_file)
+                except OSError:
+                    pass
+
+
+class NoLeases(object):
+    """Leases for an importer that has the import directory to itself.
+    Every file can be claimed.
+    """
+
+    def claim(self, file):
+        """Claim the file."""
+        return True
+
+
+    def release(self, file):
+        """Release nothing."""
+
+
+    def close(self):
+        """Close nothing."""
+
+
+NO_LEASES = NoLeases()
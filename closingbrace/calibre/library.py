@@ -0,0 +1,121 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from closingbrace.calibre.backend import create_backend
+from closingbrace.calibre.library_index import LibraryIndex
+from closingbrace.calibre.library_index import default_library_path
+from closingbrace.calibre.metrics import NO_METRICS
+from os.path import realpath
+
+
+def resolve_library_path(library_path):
+    """Return the path that identifies the library at library_path,
+    whichever way it is given: None for the default library is replaced
+    by the library stored in Calibre's settings, and a local directory
+    by its real path. The URL of a content server is returned as is.
+    Returns None when the default library can't be determined.
+    """
+    if library_path is None:
+        library_path = default_library_path()
+    if library_path is None or "://" in library_path:
+        return library_path
+    return realpath(library_path)
+
+
+class Library(object):
+    """A calibre library that magazines are imported into. It combines
+    the backend that writes to the library with the index of the issues
+    that are in it.
+    """
+
+    def __init__(self, importer_config, calibredb, library_path,
+            metrics=NO_METRICS, index=None):
+        """Open the library at library_path, accessed with the calibredb
+        executable. The backend records its time in metrics. When the
+        library has been opened already, with another calibredb or
+        path, the index of that Library is given as index and shared.
+        An OSError is raised when the library's backend can't be
+        started.
+        """
+        self._library_path = library_path
+        self._resolved_path = resolve_library_path(library_path)
+        self._backend = create_backend(importer_config, calibredb,
+                library_path, metrics)
+        self._index = (index if index is not None
+                else LibraryIndex.open(library_path))
+
+
+    @property
+    def library_path(self):
+        """Path to the library, or None for the library stored in
+        Calibre's settings.
+        """
+        return self._library_path
+
+
+    @property
+    def resolved_path(self):
+        """The path that identifies the library, as returned by
+        resolve_library_path. Libraries with the same resolved path are
+        the same library.
+        """
+        return self._resolved_path
+
+
+    @property
+    def backend(self):
+        """The backend that writes to the library."""
+        return self._backend
+
+
+    @property
+    def index(self):
+        """The index of the issues in the library, or None when the
+        library's metadata.db can't be read.
+        """
+        return self._index
+
+
+    def close(self):
+        """Close the library's backend."""
+        self._backend.close()
+
+
+def open_libraries(importer_config, metrics=NO_METRICS, opened=None):
+    """Open all libraries that the configured magazines are imported
+    into. Returns a dictionary that maps the library of a magazine, as
+    given by MagazineConfiguration.library, to its Library. The
+    libraries in opened, a dictionary like the one returned, are
+    included without opening them again. The backends record their
+    time in metrics. An OSError is raised when one of the libraries
+    can't be opened; the libraries that were opened are closed again.
+    """
+    libraries = dict(opened or {})
+    new_libraries = {}
+    try:
+        for magazine in importer_config.magazines:
+            library = importer_config.get_magazine(magazine).library
+            if library not in libraries:
+                resolved_path = resolve_library_path(library[1])
+                index = next((opened_library.index
+                    for opened_library in libraries.values()
+                    if opened_library.resolved_path == resolved_path), None)
+                libraries[library] = Library(importer_config, *library,
+                        metrics, index)
+                new_libraries[library] = libraries[library]
+    except OSError:
+        close_libraries(new_libraries)
+        raise
+    return libraries
+
+
+def close_libraries(libraries):
+    """Close all libraries in the dictionary libraries."""
+    for library in libraries.values():
+        library.close()
@@ -0,0 +1,105 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import sqlite3
+
+from os.path import expanduser
+from os.path import isfile
+from os.path import join
+from urllib.request import pathname2url
+
+
+CALIBRE_PREFERENCES = "~/.config/calibre/global.py.json"
+
+SERIES_QUERY = """
+SELECT series.name, books.series_index
+FROM books
+JOIN books_series_link ON books_series_link.book = books.id
+JOIN series ON series.id = books_series_link.series
+"""
+
+
+def default_library_path():
+    """Return the path to the library that is stored in Calibre's
+    settings, or None when it can't be determined.
+    """
+    try:
+        with open(expanduser(CALIBRE_PREFERENCES)) as f:
+            return json.load(f).get("library_path")
+    except (OSError, ValueError):
+        return None
+
+
+def issue_key(series, number):
+    """Return the key under which an issue is stored in the index.
+    Calibre compares series names case insensitively. Returns None for
+    an issue whose number isn't a series index that calibre could store,
+    as such an issue can't be in the library.
+    """
+    try:
+        return (series.lower(), float(number))
+    except (TypeError, ValueError):
+        return None
+
+
+class LibraryIndex(object):
+    """The issues, series and series index, that are in the calibre
+    library. The issues are read once from the library's metadata.db,
+    so that checking whether an issue is in the library is cheap.
+    """
+
+    def __init__(self, issues):
+        """Initialize the index with issues, an iterable of (series,
+        series index) tuples.
+        """
+        self._issues = {issue_key(series, number)
+                for series, number in issues if series is not None}
+        self._issues.discard(None)
+
+
+    @staticmethod
+    def open(library_path):
+        """Read the index from the metadata.db of the library at
+        library_path. Returns None when the library isn't a local
+        library or its metadata.db can't be read.
+        """
+        if library_path is None:
+            library_path = default_library_path()
+        if library_path is None or "://" in library_path:
+            return None
+
+        database = join(library_path, "metadata.db")
+        if not isfile(database):
+            return None
+        try:
+            connection = sqlite3.connect(
+                    f"file:{pathname2url(os.path.abspath(database))}?mode=ro",
+                    uri=True)
+            try:
+                return LibraryIndex(connection.execute(SERIES_QUERY))
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return None
+
+
+    def contains(self, series, number):
+        """Check whether the issue with the given series and number is in
+        the library.
+        """
+        return issue_key(series, number) in self._issues
+
+
+    def add(self, series, number):
+        """Add an issue that has been imported into the library."""
+        key = issue_key(series, number)
+        if key is not None:
+            self._issues.add(key)
@@ -0,0 +1,104 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+
+from closingbrace.calibre.state import ScannedState
+
+
+def formats_fingerprint(formats):
+    """Return a fingerprint of the set of format strings. It changes
+    whenever a format is added, changed or removed.
+    """
+    return hashlib.sha256("\n".join(sorted(set(formats))).encode()) \
+            .hexdigest()
+
+
+class NegativeMatchCache(ScannedState):
+    """A persistent cache of the files that don't match any magazine,
+    so that files that stay in the import directory aren't parsed
+    against the formats again on every run.
+
+    Files are identified by their path, size and modification time, so
+    that a file that is replaced or changed is parsed again. The cache
+    is tagged with the fingerprint of the formats that the files were
+    parsed against, and is emptied when the formats change. After a
+    scan of the whole import directory, the files that weren't seen
+    anymore are dropped. The cache can be used from several threads.
+    """
+
+    def __init__(self, cache_file, formats):
+        """Read the cache from cache_file for the given formats. A cache
+        that is missing, unreadable or for other formats starts empty.
+        """
+        super().__init__(cache_file)
+        self._fingerprint = formats_fingerprint(formats)
+        try:
+            with open(cache_file) as f:
+                if json.loads(f.readline()) == self._fingerprint:
+                    self._entries = dict.fromkeys(tuple(json.loads(line))
+                            for line in f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+
+    def set_formats(self, formats):
+        """Use the cache for the given formats. When they differ from the
+        formats the cache was for, the cache is emptied.
+        """
+        fingerprint = formats_fingerprint(formats)
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                self._fingerprint = fingerprint
+                self._entries = {}
+                self._changed = True
+
+
+    def contains(self, file, stat):
+        """Check whether the file, given by its path relative to the
+        import directory and the result of os.stat, is known not to
+        match any magazine.
+        """
+        key = (file, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._see(key)
+            return True
+
+
+    def add(self, file, stat):
+        """Record that the file, given by its path relative to the
+        import directory and the result of os.stat, doesn't match any
+        magazine.
+        """
+        key = (file, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            self._entries[key] = None
+            self._see(key)
+            self._changed = True
+
+
+    def _lines(self):
+        """Return the lines to write the cache."""
+        yield json.dumps(self._fingerprint)
+        for entry in self._entries:
+            yield json.dumps(entry)
+
+
+    def write(self):
+        """Write the cache when it changed, dropping the files that
+        weren't seen when a scan was started. Failing to write the cache
+        is ignored, as it is an optimization only.
+        """
+        try:
+            super().write()
+        except OSError:
+            pass
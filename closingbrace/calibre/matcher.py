@@ -9,49 +9,89 @@
 
 from closingbrace.calibre.date_util import Month
 from closingbrace.calibre.date_util import to_year
-from parse import parse
+from closingbrace.calibre.metrics import FORMULA
+from closingbrace.calibre.metrics import NO_METRICS
+from closingbrace.calibre.plan import ImportPlan
+from os.path import basename
+from os.path import join
+
+
+# The number of files that match_many matches before it evaluates the
+# formulas of their magazines.
+PLAN_CHUNK_SIZE = 1000
+
+
+def match_variables(match_result):
+    """Return the (V, I, Y, M) tuple of the fields that were captured
+    from a file name by match_result. Fields that weren't captured are
+    0.
+    """
+    return (match_result['V'] if 'V' in match_result else 0,
+            match_result['I'] if 'I' in match_result else 0,
+            to_year(match_result['Y']) if 'Y' in match_result else 0,
+            Month.to_month(match_result['M']) if 'M' in match_result else 0)
+
+
+def issue_number(volume, index):
+    """Return the number of the issue with the given volume and index,
+    as it is used for the series index.
+    """
+    return f"{volume}.{index:02d}"
+
+
+def evaluate_issue(magazine_config, variables, metrics=NO_METRICS, files=()):
+    """Evaluate the formulas and the title of the magazine for the
+    (V, I, Y, M) tuple of variables captured from a file name. Returns
+    the issue's (number, title) tuple. The evaluation is timed in
+    metrics as the formula stage of the files.
+    """
+    with metrics.time(FORMULA, files):
+        variables = dict(zip("VIYM", variables))
+        volume = magazine_config.volume_formula.evaluate(variables)
+        index = magazine_config.index_formula.evaluate(variables)
+        year = magazine_config.year_formula.evaluate(variables)
+        month = Month.of(magazine_config.month_formula.evaluate(variables))
+        return (issue_number(volume, index),
+                magazine_config.title_template.format(volume, index, year,
+                    month))
 
 
 class MatchedMagazine(object):
-    """A magazine that matches a given file."""
-
-    def __init__(self, magazine_config, filename, match_result):
-        """Initialize the matched magazine for the given file.
-        """
-        V = match_result['V'] if 'V' in match_result else 0
-        I = match_result['I'] if 'I' in match_result else 0
-        Y = to_year(match_result['Y']) if 'Y' in match_result else 0
-        M = Month.to_month(match_result['M']) if 'M' in match_result else 0
-
-        eval_globals = {'V': V, 'I': I, 'Y': Y, 'M': M, '__builtins__': {}}
-
-        volume = eval(
-                magazine_config.volume, eval_globals
-                ) if magazine_config.volume else V
-        index = eval(
-                magazine_config.index, eval_globals
-                ) if magazine_config.index else I
-        year = eval(
-                magazine_config.year, eval_globals
-                ) if magazine_config.year else Y
-        month = Month(
-                eval(
-                    magazine_config.month, eval_globals
-                    ) if magazine_config.month else M
-                )
+    """A magazine that matches a given file.
+
+    The issue's number and title are only evaluated when they are first
+    needed, as many matched files are skipped before that. The other
+    settings are taken from the magazine's configuration.
+    """
 
+    __slots__ = ("_magazine", "_filename", "_variables", "_issue",
+            "_archivedir", "_metrics")
+
+    def __init__(self, magazine_config, filename, variables, archivedir,
+            issue=None, metrics=NO_METRICS):
+        """Initialize the matched magazine for the given file, with
+        variables the (V, I, Y, M) tuple captured from its name. The
+        file is archived in archivedir, unless it is None. When the
+        issue's (number, title) tuple is known already, for example from
+        a plan, it is given as issue, and variables may be None. The
+        evaluation of the issue is timed in metrics.
+        """
+        self._magazine = magazine_config
         self._filename = filename
-        self._series = magazine_config.name
-        self._number = f"{volume}.{index:02d}"
-        self._authors = magazine_config.authors
-        self._languages = magazine_config.languages
-        self._publisher = magazine_config.publisher
-        self._tags = magazine_config.tags
-        self._archivedir = magazine_config.archivedir
+        self._variables = variables
+        self._issue = issue
+        self._archivedir = archivedir
+        self._metrics = metrics
+
 
-        self._title = magazine_config.title.format(
-                volume=volume, index=index, year=year,
-                month=month, next_month=month.next())
+    def _evaluated(self):
+        """Return the issue's (number, title) tuple, evaluating it when
+        it isn't known yet.
+        """
+        if self._issue is None:
+            self._issue = evaluate_issue(self._magazine, self._variables,
+                    self._metrics, (self._filename,))
+        return self._issue
 
 
     @property
@@ -63,13 +103,13 @@ class MatchedMagazine(object):
     @property
     def title(self):
         """The issue's title, including (volume) number and date."""
-        return self._title
+        return self._evaluated()[1]
 
 
     @property
     def series(self):
         """The series the magazine belongs to."""
-        return self._series
+        return self._magazine.name
 
 
     @property
@@ -77,19 +117,19 @@ class MatchedMagazine(object):
         """The magazine's (volume) number, including its index within
         the volume.
         """
-        return self._number
+        return self._evaluated()[0]
 
 
     @property
     def authors(self):
         """The magazine's authors."""
-        return self._authors
+        return self._magazine.authors
 
 
     @property
     def publisher(self):
         """The magazine's publisher."""
-        return self._publisher
+        return self._magazine.publisher
 
 
     @property
@@ -97,13 +137,13 @@ class MatchedMagazine(object):
         """The optional tags associated with the magazine. When there
         are no tags associated with the magazine, this returns None.
         """
-        return self._tags
+        return self._magazine.tags
 
 
     @property
     def languages(self):
         """The languages the magazine is written in."""
-        return self._languages
+        return self._magazine.languages
 
 
     @property
@@ -114,47 +154,240 @@ class MatchedMagazine(object):
         return self._archivedir
 
 
-    def print(self):
-        """Print the matched magazine."""
-        print(f"Match for {self._filename}:")
-        print(f"  title            : {self._title}")
-        print(f"  series           : {self._series}")
-        print(f"  number           : {self._number}")
-        print(f"  authors          : {self._authors}")
-        print(f"  publisher        : {self._publisher}")
-        print(f"  tags             : {self._tags}")
-        print(f"  languages        : {self._languages}")
-        print(f"  archive directory: {self._archivedir}")
-        print()
+    @property
+    def library(self):
+        """The library that the magazine is to be imported into, as a
+        (calibredb, library_path) tuple.
+        """
+        return self._magazine.library
 
 
-def create_matched(match_tuple):
+    def print(self, file=None):
+        """Print the matched magazine to file, which defaults to
+        stdout.
+        """
+        print(f"Match for {self.filename}:", file=file)
+        print(f"  title            : {self.title}", file=file)
+        print(f"  series           : {self.series}", file=file)
+        print(f"  number           : {self.number}", file=file)
+        print(f"  authors          : {self.authors}", file=file)
+        print(f"  publisher        : {self.publisher}", file=file)
+        print(f"  tags             : {self.tags}", file=file)
+        print(f"  languages        : {self.languages}", file=file)
+        print(f"  archive directory: {self.archivedir}", file=file)
+        print(f"  library          : {self.library[1]}", file=file)
+        print(file=file)
+
+
+def create_matched(match_tuple, metrics=NO_METRICS):
     """Create a matched magazine for the given match tuple. The tuple
     contains three elements:
     1. The magazine's configuration.
     2. The file name.
     3. The result of parsing the file name against the magazine's format
        string.
+    The evaluation of the issue, when it is needed, is timed in metrics.
     """
-    return MatchedMagazine(match_tuple[0], match_tuple[1], match_tuple[2])
+    magazine_config, filename, match_result = match_tuple
+    return MatchedMagazine(magazine_config, filename,
+            match_variables(match_result), magazine_config.archivedir,
+            metrics=metrics)
+
+
+def is_ascii(text):
+    """Check whether the text consists of ASCII characters only."""
+    try:
+        text.encode("ascii")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def literal_prefix(format):
+    """Return the literal text at the start of a format string, up to
+    the first brace. Every file name matching the format starts with
+    this text (ignoring case).
+    """
+    end = len(format)
+    for brace in "{}":
+        position = format.find(brace)
+        if position >= 0:
+            end = min(end, position)
+    return format[:end]
+
+
+def literal_suffix(format):
+    """Return the literal text at the end of a format string, after the
+    last brace. Every file name matching the format ends with this text
+    (ignoring case).
+    """
+    start = max(format.rfind("{"), format.rfind("}")) + 1
+    return format[start:]
+
+
+class CompiledFormat(object):
+    """A magazine's compiled format string, with its literal prefix and
+    suffix, so that it can be matched against many file names.
+    """
+
+    def __init__(self, position, magazine):
+        """Index the format of the magazine. The position is the
+        magazine's position in the list of configured magazines and is
+        used to report matches in configuration order.
+        """
+        self.position = position
+        self.magazine = magazine
+        self.parser = magazine.format_parser
+        self.prefix = literal_prefix(magazine.format).lower()
+        self.suffix = literal_suffix(magazine.format).lower()
+
+
+    def parse(self, file):
+        """Parse the file name against the format, returning the parse
+        result or None when the file name doesn't match.
+        """
+        return self.parser.parse(file)
 
 
 class MagazineMatcher(object):
-    """A class to match items against configured magazines."""
+    """A class to match items against configured magazines.
+
+    The format strings are compiled once, with the configuration.
+    They are indexed by their literal prefix, so that a file name is
+    parsed only against the formats that start with the same text.
+    Formats can only be indexed when their prefix is plain ASCII,
+    because only then a case insensitive comparison is exactly what the
+    parse module does. The other formats are tried for every file.
+    """
 
-    def __init__(self, magazines):
+    def __init__(self, magazines, metrics=NO_METRICS):
         """Initialize the matcher, giving it the list of magazines to
-        match against.
+        match against. The evaluation of the formulas of matched files
+        is timed in metrics.
         """
-        self._magazines = magazines
+        self._metrics = metrics
+        self.update(magazines)
+
+
+    def update(self, magazines):
+        """Replace the list of magazines to match against. The new index
+        is built next to the current one and then swapped in, so that
+        files that are being matched while the matcher is updated are
+        matched against either the old or the new magazines.
+        """
+        formats = [CompiledFormat(position, magazine)
+                for position, magazine in enumerate(magazines)]
+        by_prefix = {}
+        unindexed = []
+        for compiled in formats:
+            if compiled.prefix and is_ascii(compiled.prefix):
+                by_prefix.setdefault(len(compiled.prefix), {}) \
+                        .setdefault(compiled.prefix, []).append(compiled)
+            else:
+                unindexed.append(compiled)
+        self._index = (formats, by_prefix, unindexed)
+
+
+    def candidates(self, file):
+        """Return the compiled formats that the file name could match, in
+        configuration order.
+        """
+        formats, by_prefix, unindexed = self._index
+        if not is_ascii(file):
+            return formats
+
+        folded = file.lower()
+        candidates = list(unindexed)
+        for length, prefixed in by_prefix.items():
+            candidates.extend(prefixed.get(folded[:length], ()))
+        candidates.sort(key=lambda compiled: compiled.position)
+
+        # The parse module anchors its match with '$', which also
+        # matches in front of a trailing newline.
+        if folded.endswith("\n"):
+            return candidates
+        return [compiled for compiled in candidates
+                if folded.endswith(compiled.suffix)]
+
+
+    def parse(self, file, candidates=None):
+        """Parse a file name against the list of magazines, returning a
+        match tuple, as taken by create_matched, for every magazine that
+        it matches. When the candidates for the file have been looked
+        up already, they can be passed in.
+        """
+        if candidates is None:
+            candidates = self.candidates(file)
+        return [match for match in
+                ((compiled.magazine, file, compiled.parse(file))
+                    for compiled in candidates)
+                if match[2]
+                ]
 
 
     def match(self, file):
         """Match a file name against the list of magazines, returning
         the matching magazines.
         """
-        return [create_matched(match) for match in
-                ((mag, file, parse(mag.format, file)) for mag in
-                    self._magazines)
-                if match[2]
-                ]
+        return [create_matched(match, self._metrics)
+                for match in self.parse(file)]
+
+
+    def match_many(self, files, chunk_size=PLAN_CHUNK_SIZE):
+        """Match many files, given by their paths relative to the import
+        directory, against the list of magazines. The files are taken
+        from the iterable chunk_size at a time. For every chunk, an
+        ImportPlan with the issues that its files match is yielded. The
+        formulas and titles are evaluated for all matches of a magazine
+        in a chunk at once.
+        """
+        chunk = []
+        for file in files:
+            chunk.append(file)
+            if len(chunk) >= chunk_size:
+                yield self._plan(chunk)
+                chunk = []
+        if chunk:
+            yield self._plan(chunk)
+
+
+    def _plan(self, files):
+        """Return the ImportPlan for the files. The issues are planned in
+        the order of the files, and of the magazines in the
+        configuration.
+        """
+        hits = {}
+        for file_number, file in enumerate(files):
+            name = basename(file)
+            for compiled in self.candidates(name):
+                result = compiled.parse(name)
+                if result:
+                    hits.setdefault(compiled.position,
+                            (compiled.magazine, []))[1].append(
+                                    ((file_number, compiled.position), file,
+                                        name, match_variables(result)))
+
+        rows = []
+        for magazine, matches in hits.values():
+            variables = [match[3] for match in matches]
+            with self._metrics.time(FORMULA, [match[1] for match in matches]):
+                columns = list(zip(
+                    magazine.volume_formula.evaluate_many(variables),
+                    magazine.index_formula.evaluate_many(variables),
+                    magazine.year_formula.evaluate_many(variables),
+                    magazine.month_formula.evaluate_many(variables)))
+                titles = [magazine.title_template.format(volume, index,
+                    year, Month.of(month))
+                    for volume, index, year, month in columns]
+            for (key, file, name, _), (volume, index, _, _), title in zip(
+                    matches, columns, titles):
+                rows.append((key, file, magazine.name,
+                    issue_number(volume, index), title,
+                    join(magazine.archivedir, name) if magazine.archivedir
+                    else None))
+        rows.sort(key=lambda row: row[0])
+
+        plan = ImportPlan()
+        for row in rows:
+            plan.append(*row[1:])
+        return plan
@@ -0,0 +1,217 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+# The stages of the import that are timed.
+SCAN = "scan"
+MATCH = "match"
+FORMULA = "formula"
+ADD = "add"
+SET_METADATA = "set_metadata"
+ARCHIVE = "archive"
+UNLINK = "unlink"
+SCHEDULE = "schedule"
+VALIDATE = "validate"
+SUBPROCESS = "subprocess"
+
+FORMATS = ["json", "prometheus"]
+
+PROMETHEUS_PREFIX = "magazine_importer"
+
+NOT_TIMED = contextlib.nullcontext()
+
+
+class StageTimer(object):
+    """A context manager that times a stage and records its duration in
+    the run metrics when it exits.
+    """
+
+    def __init__(self, metrics, stage, files):
+        """Initialize the timer for stage of the files."""
+        self._metrics = metrics
+        self._stage = stage
+        self._files = files
+        self._start = None
+
+
+    def __enter__(self):
+        """Start timing the stage."""
+        self._start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Record the duration of the stage."""
+        self._metrics.observe(self._stage, time.perf_counter() - self._start,
+                self._files)
+        return False
+
+
+class RunMetrics(object):
+    """Timings of the stages of the import and counts of its outcomes,
+    that are written to a metrics file after every import run.
+
+    In the json format, every timed stage is appended to the file as a
+    JSON object on a line of its own, followed by a summary of the run.
+    In the prometheus format, the file is replaced with the totals since
+    the importer started, in the text format of Prometheus' textfile
+    collector. The metrics can be updated from several threads.
+    """
+
+    def __init__(self, metrics_file, metrics_format):
+        """Initialize the metrics, that are written to metrics_file in
+        metrics_format, one of FORMATS.
+        """
+        self._metrics_file = metrics_file
+        self._metrics_format = metrics_format
+        self._lock = threading.Lock()
+        self._events = []
+        self._stages = {}
+        self._counters = {}
+
+
+    def time(self, stage, files=()):
+        """Return a context manager that times stage for files, the names
+        of the files that the stage works on.
+        """
+        return StageTimer(self, stage, files)
+
+
+    def time_iteration(self, stage, iterable):
+        """Yield the items of iterable, timing the time that it takes to
+        produce them as stage.
+        """
+        seconds = 0.0
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+        self.observe(stage, seconds)
+
+
+    def observe(self, stage, seconds, files=()):
+        """Record that stage took seconds for files."""
+        with self._lock:
+            self._events.append({"stage": stage, "seconds": seconds,
+                "files": list(files)})
+            totals = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+
+    def count(self, counter, result, amount=1):
+        """Count amount outcomes result of counter."""
+        with self._lock:
+            key = (counter, result)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+
+    def write(self):
+        """Write the metrics to the metrics file. An OSError is raised
+        when the file can't be written.
+        """
+        with self._lock:
+            if self._metrics_format == "prometheus":
+                self._write_prometheus()
+            else:
+                self._write_json()
+            self._events = []
+
+
+    def _write_json(self):
+        """Append the stages timed since the last write, and a summary of
+        the totals, to the metrics file.
+        """
+        counters = {}
+        for (counter, result), value in self._counters.items():
+            counters.setdefault(counter, {})[result] = value
+        summary = {"summary": True, "timestamp": time.time(),
+                "stages": {stage: {"count": count, "seconds": seconds,
+                    "max_seconds": maximum}
+                    for stage, (count, seconds, maximum)
+                    in self._stages.items()},
+                "counters": counters}
+        with open(self._metrics_file, "a") as f:
+            for event in self._events:
+                f.write(json.dumps(event) + "\n")
+            f.write(json.dumps(summary) + "\n")
+
+
+    def _write_prometheus(self):
+        """Replace the metrics file with the totals in Prometheus' text
+        format. The file is written under another name first, so that
+        the collector never reads a partial file.
+        """
+        lines = [f"# HELP {PROMETHEUS_PREFIX}_stage_seconds Time spent in "
+                "each stage of the import.",
+                f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds summary"]
+        for stage, (count, seconds, _) in sorted(self._stages.items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum'
+                    f'{{stage="{stage}"}} {seconds}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count'
+                    f'{{stage="{stage}"}} {count}')
+        for counter in sorted({counter for counter, _ in self._counters}):
+            name = f"{PROMETHEUS_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            for (other, result), value in sorted(self._counters.items()):
+                if other == counter:
+                    lines.append(f'{name}{{result="{result}"}} {value}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds "
+                "gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds "
+                f"{time.time()}")
+
+        temporary_file = self._metrics_file + ".new"
+        with open(temporary_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temporary_file, self._metrics_file)
+
+
+class DisabledMetrics(object):
+    """Run metrics that record nothing, for when no metrics file is
+    given. Its methods do as little as possible, so that timing the
+    stages costs next to nothing.
+    """
+
+    def time(self, stage, files=()):
+        """Return a context manager that doesn't time anything."""
+        return NOT_TIMED
+
+
+    def time_iteration(self, stage, iterable):
+        """Return the iterable as it is."""
+        return iterable
+
+
+    def observe(self, stage, seconds, files=()):
+        """Record nothing."""
+
+
+    def count(self, counter, result, amount=1):
+        """Count nothing."""
+
+
+    def write(self):
+        """Write nothing."""
+
+
+NO_METRICS = DisabledMetrics()
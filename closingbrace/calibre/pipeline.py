@@ -0,0 +1,108 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import threading
+
+
+def run_into(future, function, *args):
+    """Run function with args, storing its result, or the exception it
+    raised, in future.
+    """
+    try:
+        future.set_result(function(*args))
+    except BaseException as exception:
+        future.set_exception(exception)
+
+
+def fail_unfinished(futures, exception):
+    """Store the exception in all futures that don't have a result
+    yet.
+    """
+    for future in futures:
+        if not future.done():
+            future.set_exception(exception)
+
+
+def when_all_done(futures, callback):
+    """Call callback, without arguments, as soon as all futures are
+    done. The callback is called in the thread that finishes the last
+    future, or right away when all futures are done already.
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def future_done(_):
+        with lock:
+            remaining[0] -= 1
+            all_done = remaining[0] == 0
+        if all_done:
+            callback()
+
+    if not futures:
+        callback()
+    for future in futures:
+        future.add_done_callback(future_done)
+
+
+def bounded_map(pool, function, iterable, limit):
+    """Like pool.map, but take items from iterable only as they are
+    needed to keep at most limit calls running or waiting, so that a
+    long iterable is never held in memory as a whole. The results are
+    yielded in the order of the items.
+    """
+    running = collections.deque()
+    for item in iterable:
+        running.append(pool.submit(function, item))
+        if len(running) >= limit:
+            yield running.popleft().result()
+    while running:
+        yield running.popleft().result()
+
+
+class OrderedOutput(object):
+    """Prints the output of files that are processed concurrently, in
+    the order in which the files were submitted. The output of each
+    file is the result of a future.
+    """
+
+    def __init__(self):
+        """Initialize the output without any files."""
+        self._outputs = []
+        self._printed = 0
+
+
+    def add(self, future):
+        """Add the future for the output of the next file."""
+        self._outputs.append(future)
+
+
+    def print_ready(self):
+        """Print the output of the files that are done, up to the first
+        file that isn't done yet.
+        """
+        while (self._printed < len(self._outputs)
+                and self._outputs[self._printed].done()):
+            self._print_next()
+
+
+    def print_all(self):
+        """Print the output of all files, waiting for them as needed."""
+        while self._printed < len(self._outputs):
+            self._print_next()
+
+
+    def _print_next(self):
+        """Print the output of the next file, waiting for it as needed.
+        An exception raised while processing the file is raised again.
+        """
+        future = self._outputs[self._printed]
+        self._outputs[self._printed] = None
+        self._printed += 1
+        print(future.result(), end="")
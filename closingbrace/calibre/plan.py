@@ -0,0 +1,172 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import csv
+import json
+import os
+
+
+COLUMNS = ("file", "series", "number", "title", "archive")
+
+# The first field of the row of a CSV plan with the import directory.
+IMPORT_DIR = "importdir"
+
+FORMATS = ["json", "csv"]
+
+
+class PlanError(Exception):
+    """Exception raised when an import plan can't be read or doesn't fit
+    the configuration.
+    """
+
+
+class ImportPlan(object):
+    """A plan of what to import: for every issue that a file in the
+    import directory was matched as, the file's path relative to the
+    import directory, the issue's series, number and title, and the
+    path that the file is archived at, or None.
+
+    The plan is stored by column, with one list per column, so that it
+    stays compact for directories with many files. The issues of a file
+    are next to each other. A plan can be written to, and read from, a
+    JSON or a CSV file. A CSV file starts with a row with the import
+    directory, before the header.
+    """
+
+    def __init__(self, import_dir=None):
+        """Initialize an empty plan for the files in import_dir, which is
+        None when it isn't known.
+        """
+        self._import_dir = import_dir
+        self._columns = tuple([] for _ in COLUMNS)
+
+
+    def __len__(self):
+        """Return the number of issues in the plan."""
+        return len(self._columns[0])
+
+
+    @property
+    def import_dir(self):
+        """The directory that the files in the plan are in, or None when
+        it isn't known.
+        """
+        return self._import_dir
+
+
+    def append(self, file, series, number, title, archive):
+        """Add the issue of a file to the plan."""
+        for column, value in zip(self._columns,
+                (file, series, number, title, archive)):
+            column.append(value)
+
+
+    def extend(self, plan):
+        """Add the issues of another plan to this plan."""
+        for column, other in zip(self._columns, plan._columns):
+            column.extend(other)
+
+
+    def rows(self):
+        """Return an iterator over the (file, series, number, title,
+        archive) tuples of the issues in the plan.
+        """
+        return zip(*self._columns)
+
+
+    def files(self):
+        """Yield a (file, issues) tuple for every file in the plan, where
+        issues is a list of (series, number, title, archive) tuples.
+        """
+        file = None
+        issues = []
+        for row in self.rows():
+            if row[0] != file and issues:
+                yield file, issues
+                issues = []
+            file = row[0]
+            issues.append(row[1:])
+        if issues:
+            yield file, issues
+
+
+    def series(self):
+        """Return the set of series that issues are planned for."""
+        return set(self._columns[1])
+
+
+    def write(self, plan_file, plan_format):
+        """Write the plan to plan_file in plan_format, one of FORMATS. The
+        file is written under another name first, so that an existing
+        plan is only replaced by a complete one. An OSError is raised
+        when the plan can't be written.
+        """
+        temporary_file = plan_file + ".new"
+        with open(temporary_file, "w", newline="") as f:
+            if plan_format == "csv":
+                writer = csv.writer(f)
+                writer.writerow((IMPORT_DIR, self._import_dir or ""))
+                writer.writerow(COLUMNS)
+                writer.writerows(row[:4] + (row[4] or "",)
+                        for row in self.rows())
+            else:
+                json.dump({"importdir": self._import_dir,
+                    "columns": dict(zip(COLUMNS, self._columns))}, f)
+                f.write("\n")
+        os.replace(temporary_file, plan_file)
+
+
+    @staticmethod
+    def read(plan_file, plan_format):
+        """Read a plan from plan_file in plan_format, one of FORMATS. A
+        PlanError is raised when the plan can't be read.
+        """
+        try:
+            with open(plan_file, newline="") as f:
+                if plan_format == "csv":
+                    return read_csv(f)
+                return read_json(f)
+        except (OSError, ValueError, KeyError, TypeError, csv.Error) as error:
+            raise PlanError(f"cannot read plan '{plan_file}': {error}")
+
+
+def read_json(f):
+    """Read a plan from the open JSON file f."""
+    content = json.load(f)
+    plan = ImportPlan(content["importdir"])
+    columns = [content["columns"][column] for column in COLUMNS]
+    if len({len(column) for column in columns}) > 1:
+        raise ValueError("columns of different lengths")
+    for row in zip(*columns):
+        plan.append(*row)
+    return plan
+
+
+def read_csv(f):
+    """Read a plan from the open CSV file f. The row with the import
+    directory may be left out, when the import directory isn't known.
+    """
+    reader = csv.reader(f)
+    header = next(reader, [])
+    import_dir = None
+    if header[:1] == [IMPORT_DIR]:
+        if len(header) != 2:
+            raise ValueError(f"line {reader.line_num} must be "
+                    f"{IMPORT_DIR},<directory>")
+        import_dir = header[1] or None
+        header = next(reader, [])
+    if tuple(header) != COLUMNS:
+        raise ValueError(f"the header must be {','.join(COLUMNS)}")
+    plan = ImportPlan(import_dir)
+    for row in reader:
+        if len(row) != len(COLUMNS):
+            raise ValueError(f"line {reader.line_num} has {len(row)} "
+                    f"instead of {len(COLUMNS)} fields")
+        plan.append(*row[:4], row[4] or None)
+    return plan
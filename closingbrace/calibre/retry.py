@@ -0,0 +1,197 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import time
+
+from closingbrace.calibre.state import ScannedState
+
+
+class RetryEntry(object):
+    """A file that failed to import, with the number of times it failed
+    in a row, the time before which it isn't tried again, and the error
+    of its last failure.
+    """
+
+    __slots__ = ("file", "size", "mtime", "failures", "next_attempt",
+            "error")
+
+    def __init__(self, file, size, mtime, failures, next_attempt, error):
+        """Initialize the entry for the file, given by its path relative
+        to the import directory, with size and mtime the size and
+        modification time in nanoseconds that it failed with.
+        """
+        self.file = file
+        self.size = size
+        self.mtime = mtime
+        self.failures = failures
+        self.next_attempt = next_attempt
+        self.error = error
+
+
+class RetryQueue(ScannedState):
+    """A persistent queue of the files that failed to import, so that
+    they are tried again with an exponential backoff: after the n-th
+    failure in a row, a file isn't tried again for delay * 2^(n - 1)
+    seconds, up to the maximum delay.
+
+    Files are identified by their path, size and modification time, so
+    that a file that is replaced or changed is tried again right away.
+    After a scan of the whole import directory, the files that weren't
+    seen anymore are dropped. The queue can be used from several
+    threads.
+    """
+
+    def __init__(self, queue_file, delay, max_delay):
+        """Read the queue from queue_file. A queue that is missing or
+        unreadable starts empty.
+        """
+        super().__init__(queue_file)
+        self._delay = delay
+        self._max_delay = max_delay
+        try:
+            with open(queue_file) as f:
+                for line in f:
+                    entry = RetryEntry(*json.loads(line))
+                    self._entries[entry.file] = entry
+        except (OSError, ValueError, TypeError):
+            self._entries = {}
+
+
+    def entries(self):
+        """Return the entries of the queue, ordered by their next
+        attempt.
+        """
+        with self._lock:
+            return sorted(self._entries.values(),
+                    key=lambda entry: entry.next_attempt)
+
+
+    def next_attempt(self, since):
+        """Return the first time after since, as given by time.time(), at
+        which a file may be tried again, or None when there is none.
+        """
+        with self._lock:
+            return min((entry.next_attempt
+                for entry in self._entries.values()
+                if entry.next_attempt > since), default=None)
+
+
+    def due(self, since, until):
+        """Return the files, given by their paths relative to the import
+        directory, that may be tried again from a time after since and at
+        or before until, ordered by that time.
+        """
+        with self._lock:
+            return [entry.file for entry in sorted(self._entries.values(),
+                key=lambda entry: entry.next_attempt)
+                if since < entry.next_attempt <= until]
+
+
+    def is_due(self, file, size, mtime):
+        """Check whether the file, given by its path relative to the
+        import directory, size and modification time in nanoseconds, may
+        be tried now.
+        """
+        with self._lock:
+            entry = self._entries.get(file)
+            if entry is None:
+                return True
+            if (entry.size, entry.mtime) != (size, mtime):
+                del self._entries[file]
+                self._changed = True
+                return True
+            self._see(file)
+            return time.time() >= entry.next_attempt
+
+
+    def failed(self, file, size, mtime, error):
+        """Record that the file, given by its path relative to the import
+        directory, size and modification time in nanoseconds, failed to
+        import with the error text error.
+        """
+        with self._lock:
+            entry = self._entries.get(file)
+            failures = 1
+            if entry is not None and (entry.size, entry.mtime) == (size,
+                    mtime):
+                failures = entry.failures + 1
+            delay = min(self._max_delay, self._delay * 2 ** (failures - 1))
+            self._entries[file] = RetryEntry(file, size, mtime, failures,
+                    time.time() + delay, error)
+            self._see(file)
+            self._changed = True
+
+
+    def succeeded(self, file):
+        """Record that the file, given by its path relative to the import
+        directory, doesn't need to be tried again.
+        """
+        with self._lock:
+            if self._entries.pop(file, None) is not None:
+                self._changed = True
+
+
+    def _lines(self):
+        """Return the lines to write the queue."""
+        return (json.dumps([getattr(entry, slot)
+            for slot in RetryEntry.__slots__])
+            for entry in self._entries.values())
+
+
+class CircuitBreaker(object):
+    """Counts the consecutive failures to add issues to a library, and
+    opens once there are too many: the library is then taken to be
+    unavailable, for example because it is locked by the Calibre GUI,
+    and isn't tried anymore.
+    """
+
+    def __init__(self, limit):
+        """Initialize the breaker, that opens after limit consecutive
+        failures, or never when limit is 0.
+        """
+        self._limit = limit
+        self._failures = 0
+
+
+    @property
+    def is_open(self):
+        """Whether the library is taken to be unavailable."""
+        return self._limit > 0 and self._failures >= self._limit
+
+
+    @property
+    def failures(self):
+        """The number of consecutive failures."""
+        return self._failures
+
+
+    def record(self, failed):
+        """Record the outcome of adding an issue, that failed or not."""
+        self._failures = self._failures + 1 if failed else 0
+
+
+def print_status(retry_queue):
+    """Print the files in the retry_queue."""
+    entries = retry_queue.entries()
+    if not entries:
+        print("No files are waiting to be retried.")
+        return
+    now = time.time()
+    for entry in entries:
+        next_attempt = time.strftime("%Y-%m-%d %H:%M:%S",
+                time.localtime(entry.next_attempt))
+        due = " (due)" if entry.next_attempt <= now else ""
+        print(f"File '{entry.file}'")
+        print(f"  - failed {entry.failures} time(s), next attempt at "
+                f"{next_attempt}{due}")
+        print("  - last error:")
+        for line in entry.error.splitlines():
+            print(f"  {line}")
+        print()
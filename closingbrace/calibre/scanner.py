@@ -0,0 +1,63 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+
+from os.path import join
+from os.path import realpath
+
+
+def scan_files(directory, recursive=False, min_size=0, min_age=0,
+        exclude=()):
+    """Yield the paths, relative to directory, of the files in it. The
+    directory is read entry by entry, so that a huge directory never
+    has to be held in memory as a whole. When recursive is set, the
+    files in its subdirectories are yielded too, except for those in
+    the directories in exclude, such as archive directories.
+
+    Files smaller than min_size bytes, or modified less than min_age
+    seconds ago, are skipped: they are probably still being written.
+    Their size and modification time are taken from the directory
+    entries, which only need an extra system call when a minimum size
+    or age is given.
+    """
+    newest = time.time() - min_age if min_age > 0 else None
+    excluded = {realpath(excluded_dir) for excluded_dir in exclude}
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        try:
+            entries = os.scandir(join(directory, relative_dir))
+        except OSError:
+            # A subdirectory that disappeared or can't be read.
+            if not relative_dir:
+                raise
+            continue
+
+        with entries:
+            for entry in entries:
+                relative_path = join(relative_dir, entry.name)
+                try:
+                    if recursive and entry.is_dir(follow_symlinks=False):
+                        if realpath(entry.path) not in excluded:
+                            pending.append(relative_path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if min_size > 0 or newest is not None:
+                        stat = entry.stat()
+                        if stat.st_size < min_size:
+                            continue
+                        if newest is not None and stat.st_mtime > newest:
+                            continue
+                except OSError:
+                    # The file disappeared while the directory was read.
+                    continue
+                yield relative_path
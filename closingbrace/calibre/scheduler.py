@@ -0,0 +1,139 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import threading
+import time
+
+from closingbrace.calibre.matcher import match_variables
+from os.path import basename
+from os.path import join
+
+
+class ImportBudget(object):
+    """A limit on the time that an import may take and on the number of
+    files that it may import. Once the budget runs out, no new files are
+    started; the files that are being imported are finished. Files are
+    started by the library writers, right before their first issue is
+    added, so the budget can be used from several threads.
+    """
+
+    def __init__(self, max_runtime=None, max_files=None):
+        """Initialize the budget, that runs out max_runtime seconds from
+        now, or when max_files files have been started. A limit that is
+        None doesn't apply.
+        """
+        self._deadline = (time.monotonic() + max_runtime
+                if max_runtime is not None else None)
+        self._max_files = max_files
+        self._files = 0
+        self._reason = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def reason(self):
+        """The limit that ran out, "files" or "runtime", or None when the
+        budget didn't run out.
+        """
+        return self._reason
+
+
+    @property
+    def files(self):
+        """The number of files that were started."""
+        return self._files
+
+
+    def is_exhausted(self):
+        """Check whether the budget ran out."""
+        with self._lock:
+            if self._reason is None:
+                if (self._max_files is not None
+                        and self._files >= self._max_files):
+                    self._reason = "files"
+                elif (self._deadline is not None
+                        and time.monotonic() >= self._deadline):
+                    self._reason = "runtime"
+            return self._reason is not None
+
+
+    def start_file(self):
+        """Count a file that is started."""
+        with self._lock:
+            self._files += 1
+
+
+    def limit(self, items):
+        """Yield the items until the budget runs out."""
+        for item in items:
+            if self.is_exhausted():
+                return
+            yield item
+
+
+def order_files(files, import_dir, matcher, order, match_cache=None):
+    """Return the files, given by their paths relative to import_dir, in
+    the order given by order, a list of these keys:
+
+    * priority: files of the magazines with the highest priority first,
+    * newest: the issues with the latest year and month first,
+    * smallest: the smallest files first.
+
+    Later keys order the files that earlier keys don't tell apart, and
+    files that are still equal are ordered by their path, so that files
+    that are left over are ordered the same in the next run. The files
+    are matched with matcher to find their magazines and dates; files
+    that don't match any magazine are left out. When a NegativeMatchCache
+    is given as match_cache, the files that it knows not to match aren't
+    parsed, and the files that are found not to match are added to it.
+    """
+    keyed = []
+    for file in files:
+        name = basename(file)
+        candidates = matcher.candidates(name)
+        if not candidates:
+            continue
+        stat = None
+        if match_cache is not None or "smallest" in order:
+            try:
+                stat = os.stat(join(import_dir, file))
+            except OSError:
+                # The file disappeared after the directory was read.
+                continue
+        if match_cache is not None and match_cache.contains(file, stat):
+            continue
+        matches = matcher.parse(name, candidates)
+        if not matches:
+            if match_cache is not None:
+                match_cache.add(file, stat)
+            continue
+        key = []
+        for order_key in order:
+            if order_key == "smallest":
+                key.append(stat.st_size)
+            elif order_key == "priority":
+                key.append(-max(magazine.priority
+                    for magazine, _, _ in matches))
+            else:
+                key.append(-max(issue_date(magazine, result)
+                    for magazine, _, result in matches))
+        key.append(file)
+        keyed.append(key)
+    keyed.sort()
+    return [key[-1] for key in keyed]
+
+
+def issue_date(magazine_config, match_result):
+    """Return the year and month of the issue of the magazine that was
+    matched with match_result, as a number that sorts by date.
+    """
+    variables = dict(zip("VIYM", match_variables(match_result)))
+    return (magazine_config.year_formula.evaluate(variables) * 12
+            + magazine_config.month_formula.evaluate(variables))
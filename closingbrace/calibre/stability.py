@@ -0,0 +1,86 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+
+from closingbrace.calibre.state import ScannedState
+
+
+class SizeHistory(ScannedState):
+    """The size and modification time that the files in the import
+    directory had when they were last scanned, so that a file is only
+    imported once it has stopped changing: a file is stable when it
+    still has the size and modification time of the previous scan. A
+    file that is still being downloaded is left for a later run, even
+    when it looks complete.
+
+    After a scan of the whole import directory, the files that weren't
+    seen anymore are dropped. The history can be used from several
+    threads.
+    """
+
+    def __init__(self, history_file):
+        """Read the history from history_file. A history that is missing
+        or unreadable starts empty.
+        """
+        super().__init__(history_file)
+        try:
+            with open(history_file) as f:
+                for line in f:
+                    file, size, mtime = json.loads(line)
+                    self._entries[file] = (size, mtime)
+        except (OSError, ValueError, TypeError):
+            self._entries = {}
+
+
+    def is_stable(self, file, stat):
+        """Check whether the file, given by its path relative to the
+        import directory and the result of os.stat, is unchanged since
+        the previous scan. Its current size and modification time are
+        recorded for the next scan.
+        """
+        current = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            previous = self._entries.get(file)
+            if previous != current:
+                self._entries[file] = current
+                self._changed = True
+            self._see(file)
+            return previous == current
+
+
+    def _lines(self):
+        """Return the lines to write the history."""
+        return (json.dumps([file, *entry])
+                for file, entry in self._entries.items())
+
+
+class NoSizeHistory(object):
+    """Size history for an importer that doesn't check that files have
+    stopped changing. Every file is stable.
+    """
+
+    def is_stable(self, file, stat):
+        """Check nothing."""
+        return True
+
+
+    def start_scan(self):
+        """Start nothing."""
+
+
+    def stop_scan(self):
+        """Stop nothing."""
+
+
+    def write(self):
+        """Write nothing."""
+
+
+NO_SIZE_HISTORY = NoSizeHistory()
@@ -0,0 +1,85 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import threading
+
+
+class ScannedState(object):
+    """State about the files in the import directory that is kept in a
+    file between runs. The state is a dictionary of entries; after a
+    scan of the whole import directory, the entries that weren't seen
+    during the scan are dropped when the state is written. The state
+    can be used from several threads.
+
+    Subclasses hold the lock while they use the entries, call _see for
+    every entry that is looked up, set _changed when they change the
+    entries, and return the lines to write from _lines.
+    """
+
+    def __init__(self, state_file):
+        """Initialize the state, without entries, that is written to
+        state_file.
+        """
+        self._state_file = state_file
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._seen = None
+        self._changed = False
+
+
+    def start_scan(self):
+        """Start a scan of the whole import directory. The files that
+        aren't looked up until the next write are dropped then.
+        """
+        with self._lock:
+            self._seen = set()
+
+
+    def stop_scan(self):
+        """Stop the scan of the import directory before all files were
+        looked up. No files are dropped at the next write.
+        """
+        with self._lock:
+            self._seen = None
+
+
+    def _see(self, key):
+        """Record that the entry with key was looked up during a scan."""
+        if self._seen is not None:
+            self._seen.add(key)
+
+
+    def _lines(self):
+        """Return the lines, without line ends, to write the state."""
+        raise NotImplementedError
+
+
+    def write(self):
+        """Write the state when it changed, dropping the entries that
+        weren't seen when a scan was started. The state is written under
+        another name first and then renamed, so that an interrupted write
+        doesn't corrupt it. An OSError is raised when it can't be
+        written.
+        """
+        with self._lock:
+            if self._seen is not None:
+                seen = {key: entry for key, entry in self._entries.items()
+                        if key in self._seen}
+                self._changed |= len(seen) != len(self._entries)
+                self._entries = seen
+                self._seen = None
+            if not self._changed:
+                return
+            temporary_file = self._state_file + ".new"
+            with open(temporary_file, "w") as f:
+                for line in self._lines():
+                    f.write(line + "\n")
+            os.replace(temporary_file, self._state_file)
+            self._changed = False
@@ -0,0 +1,133 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import ast
+import marshal
+import re
+
+from closingbrace.calibre.formula import FormulaError
+from closingbrace.calibre.formula import GLOBALS
+from string import Formatter
+
+
+FIELDS = ("volume", "index", "year", "month", "next_month")
+
+FIELD_NAME = re.compile(r"[^.\[]*")
+
+# A field of a title that is a name, optionally followed by attributes.
+ATTRIBUTE_PATH = re.compile(r"[A-Za-z_]\w*(\.[A-Za-z_]\w*)*")
+
+# The conversions of a field, as they are stored in a formatted value.
+CONVERSIONS = {None: -1, "s": ord("s"), "r": ord("r"), "a": ord("a")}
+
+
+def compile_template(parsed):
+    """Compile the parsed template, the result of Formatter.parse, into
+    the code of a lambda that takes the title fields and returns an
+    f-string with the same fields and literal text. Returns None when
+    the template uses what f-strings can't express: item access, or
+    fields in a format specification.
+    """
+    values = []
+    for literal, field, format_spec, conversion in parsed:
+        if literal:
+            values.append(ast.Constant(value=literal))
+        if field is None:
+            continue
+        if (not ATTRIBUTE_PATH.fullmatch(field) or "{" in format_spec
+                or conversion not in CONVERSIONS):
+            return None
+        name, *attributes = field.split(".")
+        value = ast.Name(id=name, ctx=ast.Load())
+        for attribute in attributes:
+            value = ast.Attribute(value=value, attr=attribute,
+                    ctx=ast.Load())
+        values.append(ast.FormattedValue(value=value,
+            conversion=CONVERSIONS[conversion],
+            format_spec=ast.JoinedStr(values=[ast.Constant(
+                value=format_spec)]) if format_spec else None))
+    arguments = ast.arguments(posonlyargs=[],
+            args=[ast.arg(arg=field) for field in FIELDS], vararg=None,
+            kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[])
+    tree = ast.Expression(body=ast.Lambda(args=arguments,
+        body=ast.JoinedStr(values=values)))
+    return compile(ast.fix_missing_locations(tree), "<title>", "eval")
+
+
+class TitleTemplate(object):
+    """A magazine's title template, a format string with the fields
+    volume, index, year, month and next_month. The template is parsed
+    and compiled once, when it is created, into a function that returns
+    an f-string, so that formatting a title doesn't parse the template
+    again. It remembers whether it uses next_month, so that the next
+    month is only calculated when it is needed.
+
+    A template can be pickled. Its compiled code is pickled with it, so
+    that it doesn't have to be parsed and compiled again.
+    """
+
+    __slots__ = ("_template", "_code", "_format", "_next_month")
+
+    def __init__(self, template):
+        """Parse and compile the template. When it isn't a valid format
+        string, or uses other fields than the five title fields, a
+        FormulaError is raised.
+        """
+        try:
+            parsed = list(Formatter().parse(template))
+        except ValueError as value_error:
+            raise FormulaError(str(value_error))
+        fields = {FIELD_NAME.match(field)[0] for _, field, _, _ in parsed
+                if field is not None}
+        for field in fields:
+            if field not in FIELDS:
+                raise FormulaError(f"unknown field '{field}'")
+
+        self._template = template
+        self._code = compile_template(parsed)
+        self._format = self._function()
+        self._next_month = "next_month" in fields
+
+
+    def __getstate__(self):
+        """Return the template and the marshalled code to pickle."""
+        return (self._template, marshal.dumps(self._code),
+                self._next_month)
+
+
+    def __setstate__(self, state):
+        """Restore the template and code from a pickle."""
+        self._template = state[0]
+        self._code = marshal.loads(state[1])
+        self._format = self._function()
+        self._next_month = state[2]
+
+
+    def _function(self):
+        """Return the function that formats a title, or the template's
+        own format method when the template couldn't be compiled.
+        """
+        if self._code is None:
+            return self._template.format
+        return eval(self._code, GLOBALS)
+
+
+    @property
+    def template(self):
+        """The template as it was written."""
+        return self._template
+
+
+    def format(self, volume, index, year, month):
+        """Return the title for the issue with the given volume, index,
+        year and month, a Month.
+        """
+        return self._format(volume=volume, index=index, year=year,
+                month=month,
+                next_month=month.next() if self._next_month else None)
@@ -0,0 +1,90 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import struct
+
+
+# The PDF header must be in the first, and the end-of-file marker in the
+# last kilobyte of a PDF file.
+PDF_HEADER = b"%PDF-"
+PDF_TRAILER = b"%%EOF"
+PDF_MARGIN = 1024
+
+# The end of central directory record of a zip file is at its end,
+# followed by a comment of at most 64 kB.
+ZIP_END_SIGNATURE = b"PK\x05\x06"
+ZIP_END_FORMAT = "<4s4H2LH"
+ZIP_END_SIZE = struct.calcsize(ZIP_END_FORMAT)
+ZIP_CENTRAL_SIGNATURE = b"PK\x01\x02"
+ZIP_MAX_COMMENT = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+
+
+class InvalidFileError(Exception):
+    """Exception raised when a file is incomplete or damaged."""
+
+
+def check_pdf(f, size):
+    """Check that the open file f, of size bytes, has a PDF header and
+    end-of-file marker.
+    """
+    if PDF_HEADER not in f.read(PDF_MARGIN):
+        raise InvalidFileError("it has no PDF header")
+    f.seek(max(0, size - PDF_MARGIN))
+    if PDF_TRAILER not in f.read(PDF_MARGIN):
+        raise InvalidFileError("it has no PDF end-of-file marker, it is "
+                "probably truncated")
+
+
+def check_zip(f, size):
+    """Check that the open file f, of size bytes, ends with the central
+    directory of a zip file, as EPUB and CBZ files do.
+    """
+    tail_size = min(size, ZIP_END_SIZE + ZIP_MAX_COMMENT)
+    f.seek(size - tail_size)
+    tail = f.read(tail_size)
+    end = tail.rfind(ZIP_END_SIGNATURE)
+    if end < 0 or len(tail) - end < ZIP_END_SIZE:
+        raise InvalidFileError("it has no zip central directory, it is "
+                "probably truncated")
+    (_, _, _, _, entries, directory_size, directory_offset,
+            _) = struct.unpack(ZIP_END_FORMAT, tail[end:end + ZIP_END_SIZE])
+    if directory_offset == ZIP64_MARKER or entries == 0:
+        # The central directory of a zip64 file is found through another
+        # record, and an empty zip file has none; don't look further.
+        return
+    if directory_offset + directory_size > size - tail_size + end:
+        raise InvalidFileError("its zip central directory is out of "
+                "bounds, it is probably damaged")
+    f.seek(directory_offset)
+    if f.read(len(ZIP_CENTRAL_SIGNATURE)) != ZIP_CENTRAL_SIGNATURE:
+        raise InvalidFileError("its zip central directory is damaged")
+
+
+CHECKS = {
+    ".pdf": check_pdf,
+    ".epub": check_zip,
+    ".cbz": check_zip,
+    }
+
+
+def validate_file(file_path):
+    """Check that the file at file_path is complete, before spending an
+    import on it. PDF files must have a PDF header and end-of-file
+    marker, and EPUB and CBZ files must end with a zip central
+    directory. Only the start and the end of a file are read. Files of
+    other types aren't checked. An InvalidFileError is raised when the
+    file isn't valid, and an OSError when it can't be read.
+    """
+    check = CHECKS.get(os.path.splitext(file_path)[1].lower())
+    if check is None:
+        return
+    with open(file_path, "rb") as f:
+        check(f, os.fstat(f.fileno()).st_size)
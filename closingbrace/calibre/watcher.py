@@ -0,0 +1,225 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from closingbrace.calibre.scanner import scan_files
+from os.path import join
+from os.path import realpath
+from stat import S_ISREG
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO \
+        | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def inotify_error():
+    """Return an OSError for the error of the last inotify call."""
+    error = ctypes.get_errno()
+    return OSError(error, f"inotify: {os.strerror(error)}")
+
+
+class DirectoryWatcher(object):
+    """Watches a directory for files that are written into it or moved
+    into it, using Linux' inotify.
+
+    A file is only reported after it has settled: no changes have been
+    seen for settle_time seconds after it was closed or moved in. This
+    keeps files that are still being downloaded from being imported.
+    Files smaller than min_size bytes are not reported.
+
+    When recursive is set, the subdirectories of the directory, except
+    for those in exclude, are watched too, including the ones that are
+    created while watching. Files are reported by their path relative
+    to the directory.
+    """
+
+    def __init__(self, directory, settle_time, recursive=False, min_size=0,
+            exclude=()):
+        """Start watching directory. An OSError is raised when inotify
+        isn't available.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError):
+            raise OSError("inotify is not available on this system")
+
+        self._directory = directory
+        self._settle_time = settle_time
+        self._recursive = recursive
+        self._min_size = min_size
+        self._exclude = exclude
+        self._excluded = {realpath(excluded_dir) for excluded_dir in exclude}
+        self._inotify_add_watch = inotify_add_watch
+        self._watches = {}
+        self._pending = {}
+        self._fd = inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise inotify_error()
+        try:
+            self._add_watch("")
+        except OSError:
+            os.close(self._fd)
+            raise
+
+
+    def _add_watch(self, relative_dir):
+        """Watch the directory at relative_dir and, when watching
+        recursively, its subdirectories. An OSError is raised when the
+        directory can't be watched.
+        """
+        mask = WATCH_MASK | IN_CREATE if self._recursive else WATCH_MASK
+        watch = self._inotify_add_watch(self._fd,
+                os.fsencode(join(self._directory, relative_dir)), mask)
+        if watch < 0:
+            raise inotify_error()
+        self._watches[watch] = relative_dir
+        if not self._recursive:
+            return
+
+        for entry in os.scandir(join(self._directory, relative_dir)):
+            if (entry.is_dir(follow_symlinks=False)
+                    and realpath(entry.path) not in self._excluded):
+                self._add_watch(join(relative_dir, entry.name))
+
+
+    def _add_new_directory(self, relative_dir, now):
+        """Watch a directory that was created or moved in, and consider
+        the files that are in it already changed.
+        """
+        try:
+            self._add_watch(relative_dir)
+            for file in scan_files(join(self._directory, relative_dir),
+                    recursive=True, exclude=self._exclude):
+                self._pending[join(relative_dir, file)] = now
+        except OSError:
+            # The directory disappeared again.
+            pass
+
+
+    def _handle_event(self, watch, mask, name, now):
+        """Update the pending files for a single inotify event."""
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost; consider every file changed.
+            for file in scan_files(self._directory, self._recursive,
+                    exclude=self._exclude):
+                self._pending[file] = now
+        elif mask & IN_IGNORED:
+            self._watches.pop(watch, None)
+        elif watch not in self._watches or not name:
+            pass
+        elif mask & IN_ISDIR:
+            path = join(self._watches[watch], name)
+            if (self._recursive and mask & (IN_CREATE | IN_MOVED_TO)
+                    and realpath(join(self._directory, path))
+                    not in self._excluded):
+                self._add_new_directory(path, now)
+        else:
+            self._handle_file_event(mask, join(self._watches[watch], name),
+                    now)
+
+
+    def _handle_file_event(self, mask, path, now):
+        """Update the pending files for an inotify event for the file at
+        path.
+        """
+        if mask & (IN_MOVED_FROM | IN_DELETE):
+            self._pending.pop(path, None)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._pending[path] = now
+        elif path in self._pending:
+            # Modified again after it was closed: start settling anew.
+            self._pending[path] = now
+
+
+    def _read_events(self):
+        """Read the available events and update the pending files."""
+        now = time.monotonic()
+        buffer = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(buffer):
+            watch, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            self._handle_event(watch, mask, name, now)
+
+
+    def _take_settled(self):
+        """Remove the settled files from the pending files and return the
+        names of those that still exist and are large enough.
+        """
+        deadline = time.monotonic() - self._settle_time
+        settled = sorted(name for name, changed in self._pending.items()
+                if changed <= deadline)
+        for name in settled:
+            del self._pending[name]
+        return [name for name in settled if self._acceptable(name)]
+
+
+    def _acceptable(self, name):
+        """Check whether the file with the given name is a file of at
+        least the minimum size.
+        """
+        try:
+            stat = os.stat(join(self._directory, name))
+        except OSError:
+            return False
+        return S_ISREG(stat.st_mode) and stat.st_size >= self._min_size
+
+
+    def wait_for_files(self, timeout=None):
+        """Wait until one or more files have settled and return their
+        names. When timeout is given, an empty list is returned when no
+        file has settled after timeout seconds.
+        """
+        deadline = (time.monotonic() + timeout if timeout is not None
+                else None)
+        while True:
+            settled = self._take_settled()
+            if settled:
+                return settled
+
+            wait = None
+            if self._pending:
+                oldest = min(self._pending.values())
+                wait = max(0, oldest + self._settle_time - time.monotonic())
+            if deadline is not None:
+                left = max(0, deadline - time.monotonic())
+                if wait is None or left < wait:
+                    wait = left
+            readable, _, _ = select.select([self._fd], [], [], wait)
+            if readable:
+                self._read_events()
+            elif deadline is not None and time.monotonic() >= deadline:
+                return self._take_settled()
+
+
+    def close(self):
+        """Stop watching the directory."""
+        os.close(self._fd)
@@ -34,11 +34,11 @@ setup(
         "Topic :: Utilities",
     ],
     packages=['closingbrace.calibre'],
-    python_requires='~=3.3',
+    python_requires='~=3.8',
     install_requires=['parse==1.12.0'],
     entry_points={
         'console_scripts': [
-            'calibre-magazine-importer=closingbrace.calibre.importer:run',
+            'calibre-magazine-importer=closingbrace.calibre.cli:run',
         ],
     },
     zip_safe=False,
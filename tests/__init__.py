@@ -0,0 +1,76 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+
+
+# The magazine that most tests import. The magazine sections given to
+# TemporaryDirectoryTest.write_config are format strings, with the
+# temporary directory as the field directory.
+MAGAZINE = """
+[Magazine]
+format = mag-{{Y:4d}}-{{M:2}}.pdf
+authors = Author
+languages = eng
+publisher = Publisher
+tags = Magazine
+title = Magazine {{month:s}} {{year}}
+"""
+
+RUN_IMPORTER = ("import sys; from closingbrace.calibre.cli import run; "
+        "sys.argv[0] = 'calibre-magazine-importer'; run()")
+
+
+def start_importer(config_file, *arguments):
+    """Start the importer in a process of its own, with config_file, the
+    command line arguments in arguments and its output discarded.
+    Returns the subprocess.Popen of the process.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None,
+        [dirname(dirname(abspath(__file__))), env.get("PYTHONPATH")]))
+    return subprocess.Popen([sys.executable, "-c", RUN_IMPORTER, "-c",
+        config_file, *arguments], env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+
+
+class TemporaryDirectoryTest(unittest.TestCase):
+    """A test case that runs every test in a new temporary directory,
+    self.directory, that is removed again after the test. The
+    configuration file of the test is self.config_file in that
+    directory.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.config_file = join(self.directory, "importer.ini")
+
+
+    def write_config(self, magazines=MAGAZINE, **settings):
+        """Write the configuration file with the magazine sections in
+        magazines and the importer settings in settings. Both importdir
+        and librarypath are the temporary directory, unless given in
+        settings.
+        """
+        settings = {"importdir": self.directory,
+                "librarypath": self.directory, **settings}
+        with open(self.config_file, "w") as f:
+            for name, value in settings.items():
+                f.write(f"{name} = {value}\n")
+            f.write(magazines.format(directory=self.directory))
@@ -0,0 +1,79 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import tempfile
+import unittest
+
+from closingbrace.calibre.archiver import Archiver
+from os.path import exists
+from os.path import join
+
+
+class ArchiverTest(unittest.TestCase):
+    """Tests of Archiver."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.file_path = join(self.directory, "magazine.pdf")
+        with open(self.file_path, "wb") as f:
+            f.write(b"content")
+        os.mkdir(join(self.directory, "archive"))
+        os.mkdir(join(self.directory, "other"))
+
+
+    def assert_archived(self, archived_file):
+        """Assert that archived_file has the content of the file."""
+        with open(archived_file, "rb") as f:
+            self.assertEqual(f.read(), b"content")
+
+
+    def test_archive_in_two_directories(self):
+        archiver = Archiver(self.file_path)
+        first = join(self.directory, "archive", "magazine.pdf")
+        second = join(self.directory, "other", "magazine.pdf")
+        self.assertEqual(archiver.archive(first), "linked")
+        self.assertEqual(archiver.archive(second, move=True), "moved")
+        archiver.remove()
+        self.assertFalse(exists(self.file_path))
+        self.assert_archived(first)
+        self.assert_archived(second)
+
+
+    def test_archive_twice_in_same_directory(self):
+        archiver = Archiver(self.file_path)
+        archived_file = join(self.directory, "archive", "magazine.pdf")
+        self.assertEqual(archiver.archive(archived_file), "linked")
+        self.assertEqual(archiver.archive(archived_file, move=True), "kept")
+        archiver.remove()
+        self.assertFalse(exists(self.file_path))
+        self.assert_archived(archived_file)
+
+
+    def test_archive_onto_earlier_link(self):
+        archived_file = join(self.directory, "archive", "magazine.pdf")
+        os.link(self.file_path, archived_file)
+        archiver = Archiver(self.file_path)
+        self.assertEqual(archiver.archive(archived_file, move=True), "kept")
+        archiver.remove()
+        self.assertFalse(exists(self.file_path))
+        self.assert_archived(archived_file)
+
+
+    def test_archive_in_import_directory(self):
+        archiver = Archiver(self.file_path)
+        self.assertEqual(archiver.archive(self.file_path, move=True), "kept")
+        archiver.remove()
+        self.assert_archived(self.file_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from closingbrace.calibre.backend import BookRejectedError
+from closingbrace.calibre.backend import CalibredbBackend
+from closingbrace.calibre.backend import ImportError
+from closingbrace.calibre.backend import WorkerBackend
+from os.path import join
+from types import SimpleNamespace
+
+
+# A worker that speaks the protocol of WorkerBackend without Calibre. It
+# logs every request to the file given as its library path. Books
+# titled "fail" can't be added, and the worker stops when it is asked
+# to add a book titled "stop".
+FAKE_WORKER = """
+import json
+import sys
+
+book_id = 0
+with open(sys.argv[1], "a") as log:
+    for line in sys.stdin:
+        request = json.loads(line)
+        log.write(line)
+        log.flush()
+        books = ([request] if request["command"] == "add"
+                else request.get("books", []))
+        results = []
+        for book in books:
+            if book["metadata"]["title"] == "stop":
+                sys.exit(3)
+            if book["metadata"]["title"] == "fail":
+                results.append({"error": "cannot add " + book["file"]})
+            else:
+                book_id += 1
+                results.append({"book_id": book_id})
+        if request["command"] == "add":
+            response = results[0]
+        elif request["command"] == "add_many":
+            response = {"results": results}
+        else:
+            response = {}
+        print(json.dumps(response), flush=True)
+"""
+
+
+# A calibredb that logs its command lines to the file given as its
+# library path and gives added books the ids from 1 on. Files named
+# bad.pdf can't be added, and files named dup.pdf are in the library
+# already. Setting the metadata fails when FAIL_METADATA
+# is set, and removing books fails when FAIL_REMOVE is set.
+FAKE_CALIBREDB = """#!{executable}
+import json
+import os
+import sys
+
+def added_files(command):
+    return [arg for arg in command if arg.endswith(".pdf")
+            and not arg.endswith(("bad.pdf", "dup.pdf"))]
+
+log_file = sys.argv[sys.argv.index("--library-path") + 1]
+with open(log_file, "a") as log:
+    log.write(json.dumps(sys.argv[1:]) + "\\n")
+if sys.argv[1] == "add":
+    with open(log_file) as log:
+        added = sum(len(added_files(command))
+                for command in map(json.loads, log) if command[0] == "add")
+    files = len(added_files(sys.argv))
+    if files:
+        print("Added book ids: " + ", ".join(str(book_id) for book_id
+            in range(added - files + 1, added + 1)))
+    if any(arg.endswith("dup.pdf") for arg in sys.argv):
+        print("The following books were not added as they already exist "
+                "in the database (see --duplicates option):")
+    if any(arg.endswith("bad.pdf") for arg in sys.argv):
+        print("cannot read bad.pdf", file=sys.stderr)
+        sys.exit(1)
+elif sys.argv[1] == "set_metadata" and os.environ.get("FAIL_METADATA"):
+    print("cannot set metadata", file=sys.stderr)
+    sys.exit(1)
+elif sys.argv[1] == "remove" and os.environ.get("FAIL_REMOVE"):
+    print("cannot remove", file=sys.stderr)
+    sys.exit(1)
+"""
+
+
+def magazine(title):
+    """Return the metadata of an issue titled title."""
+    return SimpleNamespace(authors="Author", languages="eng",
+            series="Magazine", number="3", tags="Magazine", title=title,
+            publisher="Publisher")
+
+
+class CalibredbBackendTest(unittest.TestCase):
+    """Tests of CalibredbBackend against a fake calibredb."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_file = join(directory.name, "commands.log")
+        calibredb = join(directory.name, "calibredb")
+        with open(calibredb, "w") as f:
+            f.write(FAKE_CALIBREDB.format(executable=sys.executable))
+        os.chmod(calibredb, 0o755)
+        self.backend = CalibredbBackend(calibredb, self.log_file)
+        self.addCleanup(os.environ.pop, "FAIL_METADATA", None)
+        self.addCleanup(os.environ.pop, "FAIL_REMOVE", None)
+
+
+    def commands(self):
+        """Return the subcommands and their last argument of the calibredb
+        command lines that were run.
+        """
+        with open(self.log_file) as f:
+            return [(command[0], command[-1])
+                    for command in map(json.loads, f)]
+
+
+    def test_add_writes_publisher(self):
+        self.assertEqual(self.backend.add("/import/a.pdf", magazine("A")), "1")
+        self.assertEqual(self.commands(), [("add", "/import/a.pdf"),
+            ("set_metadata", "1")])
+
+
+    def test_add_removes_book_without_publisher(self):
+        os.environ["FAIL_METADATA"] = "1"
+        with self.assertRaises(ImportError) as raised:
+            self.backend.add("/import/a.pdf", magazine("A"))
+        self.assertIn("cannot set metadata", raised.exception.get_text())
+        self.assertEqual(self.commands(), [("add", "/import/a.pdf"),
+            ("set_metadata", "1"), ("remove", "1")])
+
+
+    def test_add_reports_book_that_is_not_removed(self):
+        os.environ["FAIL_METADATA"] = "1"
+        os.environ["FAIL_REMOVE"] = "1"
+        with self.assertRaises(ImportError) as raised:
+            self.backend.add("/import/a.pdf", magazine("A"))
+        self.assertIn("couldn't be removed: cannot remove",
+                raised.exception.get_text())
+
+
+    def test_add_rejects_duplicate(self):
+        with self.assertRaises(BookRejectedError):
+            self.backend.add("/import/dup.pdf", magazine("A"))
+        with self.assertRaises(ImportError) as raised:
+            self.backend.add("/import/bad.pdf", magazine("A"))
+        self.assertNotIsInstance(raised.exception, BookRejectedError)
+
+
+    def test_add_many_writes_metadata(self):
+        results = self.backend.add_many([("/import/a.pdf", magazine("A")),
+            ("/import/b.pdf", magazine("B"))])
+        self.assertEqual(results, ["1", "2"])
+        self.assertEqual(self.commands(), [("add", "/import/b.pdf"),
+            ("set_metadata", "1"), ("set_metadata", "2")])
+
+
+    def test_add_many_removes_books_without_metadata(self):
+        os.environ["FAIL_METADATA"] = "1"
+        results = self.backend.add_many([("/import/a.pdf", magazine("A")),
+            ("/import/b.pdf", magazine("B"))])
+        self.assertIsInstance(results[0], ImportError)
+        self.assertIsInstance(results[1], ImportError)
+        self.assertEqual(self.commands()[-1], ("remove", "1,2"))
+
+
+    def test_add_many_adds_one_at_a_time_after_partial_add(self):
+        results = self.backend.add_many([("/import/a.pdf", magazine("A")),
+            ("/import/bad.pdf", magazine("Bad")),
+            ("/import/c.pdf", magazine("C"))])
+        self.assertEqual(results[0], "3")
+        self.assertIsInstance(results[1], ImportError)
+        self.assertIn("cannot read bad.pdf", results[1].get_text())
+        self.assertEqual(results[2], "4")
+        self.assertEqual(self.commands(), [("add", "/import/c.pdf"),
+            ("remove", "1,2"),
+            ("add", "/import/a.pdf"), ("set_metadata", "3"),
+            ("add", "/import/bad.pdf"),
+            ("add", "/import/c.pdf"), ("set_metadata", "4")])
+
+
+    def test_add_many_fails_when_partial_add_is_not_removed(self):
+        os.environ["FAIL_REMOVE"] = "1"
+        results = self.backend.add_many([("/import/a.pdf", magazine("A")),
+            ("/import/bad.pdf", magazine("Bad"))])
+        self.assertIsInstance(results[0], ImportError)
+        self.assertIs(results[0], results[1])
+        self.assertIn("The books that were added (ids 1) couldn't be "
+                "removed: cannot remove", results[0].get_text())
+        self.assertEqual(self.commands(), [("add", "/import/bad.pdf"),
+            ("remove", "1")])
+
+
+class WorkerBackendTest(unittest.TestCase):
+    """Tests of WorkerBackend against a fake worker."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_file = join(directory.name, "requests.log")
+        self.backend = WorkerBackend([sys.executable, "-c", FAKE_WORKER],
+                self.log_file)
+        self.addCleanup(self.backend.close)
+
+
+    def requests(self):
+        """Return the requests that the worker received."""
+        with open(self.log_file) as f:
+            return [json.loads(line) for line in f]
+
+
+    def test_add(self):
+        self.assertEqual(self.backend.add("/import/a.pdf", magazine("A")), "1")
+        self.assertEqual(self.backend.add("/import/b.pdf", magazine("B")), "2")
+        request = self.requests()[0]
+        self.assertEqual(request["command"], "add")
+        self.assertEqual(request["file"], "/import/a.pdf")
+        self.assertEqual(request["metadata"], {"authors": "Author",
+            "languages": "eng", "series": "Magazine", "series_index": "3",
+            "tags": "Magazine", "title": "A", "publisher": "Publisher"})
+
+
+    def test_add_error(self):
+        with self.assertRaises(BookRejectedError) as raised:
+            self.backend.add("/import/a.pdf", magazine("fail"))
+        self.assertIn("cannot add /import/a.pdf", raised.exception.get_text())
+
+
+    def test_add_many(self):
+        results = self.backend.add_many([("/import/a.pdf", magazine("A")),
+            ("/import/b.pdf", magazine("fail")),
+            ("/import/c.pdf", magazine("C"))])
+        self.assertEqual(results[0], "1")
+        self.assertIsInstance(results[1], ImportError)
+        self.assertEqual(results[2], "2")
+        self.assertEqual([request["command"] for request in self.requests()],
+                ["add_many"])
+
+
+    def test_set_metadata(self):
+        self.backend.set_metadata(["1", "2"], {"publisher": "Other"})
+        self.assertEqual(self.requests(), [{"command": "set_metadata",
+            "book_ids": [1, 2], "fields": {"publisher": "Other"}}])
+
+
+    def test_worker_stops(self):
+        with self.assertRaises(ImportError) as raised:
+            self.backend.add("/import/a.pdf", magazine("stop"))
+        self.assertIn("exit code 3", raised.exception.get_text())
+        self.assertNotIsInstance(raised.exception, BookRejectedError)
+        results = self.backend.add_many([("/import/b.pdf", magazine("B"))])
+        self.assertIsInstance(results[0], ImportError)
+
+
+if __name__ == "__main__":
+    unittest.main()
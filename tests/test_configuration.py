@@ -0,0 +1,51 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+
+from closingbrace.calibre.configuration import ConfigurationError
+from closingbrace.calibre.configuration import ImporterConfiguration
+from os.path import join
+from tests import TemporaryDirectoryTest
+
+
+class ImporterConfigurationTest(TemporaryDirectoryTest):
+    """Tests of ImporterConfiguration."""
+
+    def test_content_server_with_calibredb(self):
+        self.write_config(backend="calibredb",
+                librarypath="http://localhost:8080#library")
+        importer_config = ImporterConfiguration(self.config_file)
+        self.assertEqual(importer_config.library_path,
+                "http://localhost:8080#library")
+
+
+    def test_content_server_with_worker(self):
+        self.write_config(backend="worker",
+                librarypath="http://localhost:8080#library")
+        with self.assertRaises(ConfigurationError):
+            ImporterConfiguration(self.config_file)
+
+
+    def test_local_library_with_worker(self):
+        self.write_config(backend="worker",
+                librarypath=join(self.directory, "library"))
+        importer_config = ImporterConfiguration(self.config_file)
+        self.assertEqual(importer_config.backend, "worker")
+
+
+    def test_invalid_order(self):
+        self.write_config(order="newest, biggest")
+        with self.assertRaises(ConfigurationError) as context:
+            ImporterConfiguration(self.config_file)
+        self.assertIn("order 'biggest'", str(context.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
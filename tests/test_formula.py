@@ -0,0 +1,83 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pickle
+import unittest
+
+from closingbrace.calibre.formula import Formula
+from closingbrace.calibre.formula import FormulaError
+
+
+VARIABLES = {"V": 7, "I": 3, "Y": 2019, "M": 11}
+
+
+class FormulaTest(unittest.TestCase):
+    """Tests of Formula and the operators that it allows."""
+
+    def test_allowed(self):
+        for expression, value in [("Y - 2010", 9), ("(V + 1) * 12", 96),
+                ("M // 2", 5), ("M % 4", 3), ("-I", -3), ("+I", 3),
+                (" 42 ", 42)]:
+            with self.subTest(expression=expression):
+                self.assertEqual(Formula(expression).evaluate(VARIABLES),
+                        value)
+
+
+    def test_evaluate_many(self):
+        formula = Formula("Y * 12 + M")
+        self.assertEqual(formula.evaluate_many([(0, 0, 2019, 1),
+            (0, 0, 2020, 12)]), [24229, 24252])
+
+
+    def test_pickle(self):
+        formula = pickle.loads(pickle.dumps(Formula("V * 100 + I")))
+        self.assertEqual(formula.expression, "V * 100 + I")
+        self.assertEqual(formula.evaluate(VARIABLES), 703)
+        self.assertEqual(formula.evaluate_many([(1, 2, 0, 0)]), [102])
+
+
+    def assertRejected(self, expression, message):
+        """Assert that expression isn't a valid formula, with an error
+        that contains message.
+        """
+        with self.assertRaises(FormulaError) as context:
+            Formula(expression)
+        self.assertIn(message, str(context.exception))
+
+
+    def test_division_rejected(self):
+        self.assertRejected("Y / 2", "operator '/' is not allowed")
+        self.assertRejected("Y / 2", "'//'")
+
+
+    def test_operators_named(self):
+        for expression, symbol in [("I ** 2", "**"), ("I << 1", "<<"),
+                ("I & 1", "&"), ("~I", "~"), ("not I", "not")]:
+            with self.subTest(expression=expression):
+                self.assertRejected(expression, f"operator '{symbol}'")
+
+
+    def test_unknown_field(self):
+        self.assertRejected("X + 1", "unknown field 'X'")
+
+
+    def test_other_nodes_rejected(self):
+        for expression in ["__import__('os')", "I.real", "[I]", "1.5",
+                "'a'", "I if V else M", "I < V", "I and V", "lambda: I"]:
+            with self.subTest(expression=expression):
+                with self.assertRaises(FormulaError):
+                    Formula(expression)
+
+
+    def test_syntax_error(self):
+        self.assertRejected("V +", "syntax error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import unittest
+
+from closingbrace.calibre.import_index import FileFingerprint
+from closingbrace.calibre.import_index import ImportIndex
+from os.path import join
+from tests import TemporaryDirectoryTest
+
+
+class ImportIndexTest(TemporaryDirectoryTest):
+    """Tests of ImportIndex and FileFingerprint."""
+
+    def setUp(self):
+        super().setUp()
+        self.file_path = join(self.directory, "mag-2019-01.pdf")
+        with open(self.file_path, "wb") as f:
+            f.write(b"%PDF-1.4 magazine")
+        self.index = ImportIndex(join(self.directory, "imported"))
+        self.addCleanup(self.index.close)
+
+
+    def test_lookup_recorded(self):
+        fingerprint = FileFingerprint(self.file_path)
+        self.assertIsNone(self.index.lookup(fingerprint, "Magazine"))
+        self.index.record(fingerprint, "Magazine", "7")
+        copy = join(self.directory, "copy.pdf")
+        os.link(self.file_path, copy)
+        self.assertEqual(self.index.lookup(FileFingerprint(copy),
+            "Magazine"), "7")
+        self.assertIsNone(self.index.lookup(fingerprint, "Other"))
+
+
+    def test_record_uses_computed_hash(self):
+        fingerprint = FileFingerprint(self.file_path)
+        fingerprint.compute_hash()
+        os.remove(self.file_path)
+        self.index.record(fingerprint, "Magazine", "7")
+        self.assertEqual(self.index.lookup(fingerprint, "Magazine"), "7")
+
+
+    def test_compute_hash_of_missing_file(self):
+        fingerprint = FileFingerprint(self.file_path)
+        os.remove(self.file_path)
+        with self.assertRaises(OSError):
+            fingerprint.compute_hash()
+
+
+if __name__ == "__main__":
+    unittest.main()
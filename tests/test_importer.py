@@ -0,0 +1,128 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import contextlib
+import io
+import unittest
+
+from closingbrace.calibre.backend import ImportError
+from closingbrace.calibre.backend import LibraryUnavailableError
+from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.importer import ConfigurationReloader
+from closingbrace.calibre.importer import MagazineImporter
+from closingbrace.calibre.retry import RetryQueue
+from os.path import join
+from tests import TemporaryDirectoryTest
+from types import SimpleNamespace
+
+
+OTHER_MAGAZINE = """
+[Other]
+format = other-{V:d}.pdf
+authors = Author
+publisher = Publisher
+title = Other {volume}
+"""
+
+
+class RecordingImporter(object):
+    """An importer that records the configurations it is given."""
+
+    def __init__(self):
+        """Initialize the importer without any configurations."""
+        self.configurations = []
+
+
+    def reconfigure(self, importer_config):
+        """Record the importer_config."""
+        self.configurations.append(importer_config)
+
+
+class ConfigurationReloaderTest(TemporaryDirectoryTest):
+    """Tests of ConfigurationReloader, as used in watch mode."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_config()
+        self.importer = RecordingImporter()
+        self.reloader = ConfigurationReloader(
+                ImporterConfiguration(self.config_file), self.importer)
+
+
+    def reload(self):
+        """Reload the configuration. Returns what the reloader printed."""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.reloader.reload()
+        return output.getvalue()
+
+
+    def test_unchanged(self):
+        self.assertEqual(self.reload(), "")
+        self.assertEqual(self.importer.configurations, [])
+
+
+    def test_magazine_added(self):
+        with open(self.config_file, "a") as f:
+            f.write(OTHER_MAGAZINE)
+        output = self.reload()
+        self.assertIn("magazines added or changed: Other", output)
+        [importer_config] = self.importer.configurations
+        self.assertEqual(importer_config.magazines, ["Magazine", "Other"])
+        self.assertEqual(self.reload(), "")
+
+
+    def test_invalid_configuration(self):
+        with open(self.config_file, "a") as f:
+            f.write(OTHER_MAGAZINE + "volume = V +\n")
+        self.assertIn("Configuration NOT reloaded", self.reload())
+        self.assertEqual(self.importer.configurations, [])
+        self.assertEqual(self.reload(), "")
+
+
+class RecordRetryTest(TemporaryDirectoryTest):
+    """Tests of how MagazineImporter records the results of a file in the
+    retry queue.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.queue = RetryQueue(join(self.directory, "retry"), 60, 3600)
+        self.queue.failed("a.pdf", 1, 2, "error")
+        self.importer = SimpleNamespace(_retry_queue=self.queue)
+        self.fingerprint = SimpleNamespace(size=1, mtime=2)
+
+
+    def record(self, *added):
+        """Record the results added for a.pdf and return the files in the
+        retry queue.
+        """
+        MagazineImporter._record_retry(self.importer, "a.pdf",
+                self.fingerprint, list(added))
+        return [(entry.file, entry.failures)
+                for entry in self.queue.entries()]
+
+
+    def test_unavailable_library_keeps_backoff(self):
+        self.assertEqual(self.record(LibraryUnavailableError(3)),
+                [("a.pdf", 1)])
+
+
+    def test_failure_counts(self):
+        self.assertEqual(self.record("1", ImportError("failed", "")),
+                [("a.pdf", 2)])
+
+
+    def test_added_drops_file(self):
+        self.assertEqual(self.record("1",
+            LibraryUnavailableError(3)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import sys
+import unittest
+
+from closingbrace.calibre.import_index import FileFingerprint
+from closingbrace.calibre.journal import ADDED
+from closingbrace.calibre.journal import ADDING
+from closingbrace.calibre.journal import FAILED
+from closingbrace.calibre.journal import ImportJournal
+from os.path import join
+from tests import TemporaryDirectoryTest
+from tests import start_importer
+from tests.test_backend import FAKE_CALIBREDB
+
+
+class ImportJournalTest(TemporaryDirectoryTest):
+    """Tests of ImportJournal."""
+
+    def setUp(self):
+        super().setUp()
+        self.journal_path = join(self.directory, "journal")
+        self.files = {}
+        for name in ["a.pdf", "b.pdf", "c.pdf"]:
+            file_path = join(self.directory, name)
+            with open(file_path, "w") as f:
+                f.write(name)
+            self.files[name] = (file_path, FileFingerprint(file_path))
+
+
+    def record(self, journal, name, series, stage, book_id=None):
+        """Record the stage of the file named name in journal."""
+        journal.record([(*self.files[name], series, stage, book_id)])
+
+
+    def reopen(self, journal):
+        """Close the journal, as an interrupted run leaves it, and open
+        it again.
+        """
+        journal._journal.close()
+        journal = ImportJournal(self.journal_path)
+        self.addCleanup(journal.close)
+        return journal
+
+
+    def journaled(self):
+        """Return the files and series in the journal file."""
+        with open(self.journal_path) as f:
+            return sorted((os.path.basename(entry["file"]), entry["series"])
+                    for entry in map(json.loads, f))
+
+
+    def test_resume_added(self):
+        journal = ImportJournal(self.journal_path)
+        self.record(journal, "a.pdf", "Magazine", ADDING)
+        self.record(journal, "a.pdf", "Magazine", ADDED, "7")
+        self.record(journal, "a.pdf", "Other", ADDING)
+        self.record(journal, "b.pdf", "Magazine", ADDING)
+        self.record(journal, "b.pdf", "Magazine", FAILED)
+        journal = self.reopen(journal)
+        self.assertEqual(journal.book_id(*self.files["a.pdf"], "Magazine"),
+                "7")
+        self.assertIsNone(journal.book_id(*self.files["a.pdf"], "Other"))
+        self.assertIsNone(journal.book_id(*self.files["b.pdf"], "Magazine"))
+
+
+    def test_changed_file_is_not_resumed(self):
+        journal = ImportJournal(self.journal_path)
+        self.record(journal, "a.pdf", "Magazine", ADDED, "7")
+        journal._journal.close()
+        file_path = self.files["a.pdf"][0]
+        with open(file_path, "a") as f:
+            f.write("changed")
+        journal = ImportJournal(self.journal_path)
+        self.addCleanup(journal.close)
+        self.assertIsNone(journal.book_id(file_path,
+            FileFingerprint(file_path), "Magazine"))
+        self.assertEqual(self.journaled(), [])
+
+
+    def test_compacts_done_and_vanished(self):
+        journal = ImportJournal(self.journal_path)
+        for name in self.files:
+            self.record(journal, name, "Magazine", ADDED, name)
+        journal.finish(*self.files["a.pdf"])
+        os.remove(self.files["b.pdf"][0])
+        journal = self.reopen(journal)
+        self.assertEqual(self.journaled(), [("c.pdf", "Magazine")])
+        self.assertIsNone(journal.book_id(*self.files["a.pdf"], "Magazine"))
+        self.assertEqual(journal.book_id(*self.files["c.pdf"], "Magazine"),
+                "c.pdf")
+
+
+    def test_partial_last_line_is_ignored(self):
+        journal = ImportJournal(self.journal_path)
+        self.record(journal, "a.pdf", "Magazine", ADDED, "7")
+        journal._journal.write('{"file": "')
+        journal = self.reopen(journal)
+        self.assertEqual(journal.book_id(*self.files["a.pdf"], "Magazine"),
+                "7")
+        self.assertEqual(self.journaled(), [("a.pdf", "Magazine")])
+
+
+class ResumeTest(TemporaryDirectoryTest):
+    """Tests of an importer that resumes the run of an importer that was
+    interrupted.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.import_dir = join(self.directory, "import")
+        os.mkdir(self.import_dir)
+        self.file_path = join(self.import_dir, "mag-2019-01.pdf")
+        with open(self.file_path, "wb") as f:
+            f.write(b"%PDF-1.4\nmagazine\n%%EOF\n")
+        calibredb = join(self.directory, "calibredb")
+        with open(calibredb, "w") as f:
+            f.write(FAKE_CALIBREDB.format(executable=sys.executable))
+        os.chmod(calibredb, 0o755)
+        self.log_file = join(self.directory, "commands.log")
+        self.write_config(importdir=self.import_dir, calibredb=calibredb,
+                librarypath=self.log_file)
+
+
+    def test_added_file_is_only_removed(self):
+        journal = ImportJournal(self.config_file + ".journal")
+        journal.record([(self.file_path, FileFingerprint(self.file_path),
+            "Magazine", ADDED, "7")])
+        journal._journal.close()
+
+        self.assertEqual(start_importer(self.config_file).wait(), 0)
+        self.assertFalse(os.path.exists(self.log_file))
+        self.assertEqual(os.listdir(self.import_dir), [])
+        with open(self.config_file + ".journal") as f:
+            self.assertEqual(f.read(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
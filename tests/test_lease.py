@@ -0,0 +1,142 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import shutil
+import sys
+import time
+import unittest
+
+from closingbrace.calibre.lease import LeaseManager
+from os.path import join
+from tests import TemporaryDirectoryTest
+from tests import start_importer
+from tests.test_backend import FAKE_CALIBREDB
+from unittest import mock
+
+
+IMPORTERS = 3
+
+FILES = [f"mag-{year}-{month:02d}.pdf" for year in range(2000, 2003)
+        for month in range(1, 13)]
+
+
+class LeaseManagerTest(TemporaryDirectoryTest):
+    """Tests of LeaseManager."""
+
+    def setUp(self):
+        super().setUp()
+        self.leases = LeaseManager(join(self.directory, "leases"), 60)
+        self.addCleanup(self.leases.close)
+        self.other = LeaseManager(join(self.directory, "leases"), 60)
+        self.addCleanup(self.other.close)
+
+
+    def expire(self, file):
+        """Let the lease on file expire."""
+        lease_file = self.leases._lease_file(file)
+        old = time.time() - 120
+        os.utime(lease_file, (old, old))
+
+
+    def owner(self, file):
+        """Return the owner of the lease on file."""
+        with open(self.leases._lease_file(file)) as f:
+            return json.load(f)["owner"]
+
+
+    def test_claimed_once(self):
+        self.assertTrue(self.other.claim("a.pdf"))
+        self.assertFalse(self.leases.claim("a.pdf"))
+        self.other.release("a.pdf")
+        self.assertTrue(self.leases.claim("a.pdf"))
+
+
+    def test_expired_lease_is_reclaimed(self):
+        self.assertTrue(self.other.claim("a.pdf"))
+        self.expire("a.pdf")
+        self.assertTrue(self.leases.claim("a.pdf"))
+        self.assertEqual(self.owner("a.pdf"), self.leases._owner)
+        self.assertEqual([name for name in os.listdir(join(self.directory,
+            "leases")) if name.endswith(".stale")], [])
+
+
+    def test_renewed_lease_is_put_back(self):
+        self.assertTrue(self.other.claim("a.pdf"))
+        self.expire("a.pdf")
+        lease_file = self.leases._lease_file("a.pdf")
+        rename = os.rename
+
+        def renew_and_rename(source, destination):
+            # The owner renews the lease between the check and the
+            # rename of the reclaiming importer.
+            os.utime(lease_file)
+            rename(source, destination)
+
+        with mock.patch("closingbrace.calibre.lease.os.rename",
+                renew_and_rename):
+            self.assertFalse(self.leases.claim("a.pdf"))
+        self.assertEqual(self.owner("a.pdf"), self.other._owner)
+        self.assertEqual(os.listdir(join(self.directory, "leases")),
+                [os.path.basename(lease_file)])
+
+
+    def test_lease_reclaimed_by_another(self):
+        self.assertTrue(self.other.claim("a.pdf"))
+        self.expire("a.pdf")
+        lease_file = self.leases._lease_file("a.pdf")
+
+        def reclaimed_first(source, destination):
+            os.unlink(source)
+            raise FileNotFoundError(source)
+
+        with mock.patch("closingbrace.calibre.lease.os.rename",
+                reclaimed_first):
+            self.assertTrue(self.leases._reclaim(lease_file))
+
+
+class SharedImportDirectoryTest(TemporaryDirectoryTest):
+    """Tests of several importers that share an import directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.import_dir = join(self.directory, "import")
+        os.mkdir(self.import_dir)
+        for name in FILES:
+            with open(join(self.import_dir, name), "wb") as f:
+                f.write(b"%PDF-1.4\n" + name.encode() + b"\n%%EOF\n")
+        calibredb = join(self.directory, "calibredb")
+        with open(calibredb, "w") as f:
+            f.write(FAKE_CALIBREDB.format(executable=sys.executable))
+        os.chmod(calibredb, 0o755)
+        self.log_file = join(self.directory, "commands.log")
+        self.write_config(importdir=self.import_dir, calibredb=calibredb,
+                librarypath=self.log_file, batchsize=1, leasetimeout=60)
+
+
+    def test_every_file_added_once(self):
+        importers = []
+        for number in range(IMPORTERS):
+            config_file = join(self.directory, f"importer{number}.ini")
+            shutil.copy(self.config_file, config_file)
+            importers.append(start_importer(config_file))
+        for importer in importers:
+            self.assertEqual(importer.wait(), 0)
+
+        with open(self.log_file) as f:
+            added = [os.path.basename(command[-1])
+                    for command in map(json.loads, f) if command[0] == "add"]
+        self.assertEqual(sorted(added), sorted(FILES))
+        self.assertEqual(sorted(os.listdir(self.import_dir)),
+                [".calibre-magazine-importer.leases"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import sqlite3
+import unittest
+
+from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.importer import MagazineImporter
+from closingbrace.calibre.library import close_libraries
+from closingbrace.calibre.library import open_libraries
+from closingbrace.calibre.library import resolve_library_path
+from os.path import join
+from tests import MAGAZINE
+from tests import TemporaryDirectoryTest
+from tests.test_library_index import SCHEMA
+
+
+MAGAZINES = MAGAZINE + """
+[Other Magazine]
+format = other-{{Y:4d}}-{{M:2}}.pdf
+authors = Author
+publisher = Publisher
+title = Other Magazine {{month:s}} {{year}}
+calibredb = /opt/calibre/calibredb
+librarypath = {directory}/link
+
+[Third Magazine]
+format = third-{{Y:4d}}-{{M:2}}.pdf
+authors = Author
+publisher = Publisher
+title = Third Magazine {{month:s}} {{year}}
+librarypath = {directory}/third
+"""
+
+
+class LibraryTest(TemporaryDirectoryTest):
+    """Tests of the libraries that magazines are imported into, when the
+    same library is given in different ways.
+    """
+
+    def setUp(self):
+        super().setUp()
+        os.mkdir(join(self.directory, "library"))
+        os.mkdir(join(self.directory, "third"))
+        connection = sqlite3.connect(join(self.directory, "library",
+            "metadata.db"))
+        connection.executescript(SCHEMA)
+        connection.close()
+        os.symlink(join(self.directory, "library"),
+                join(self.directory, "link"))
+        self.write_config(MAGAZINES,
+                librarypath=join(self.directory, "library"))
+        self.importer_config = ImporterConfiguration(self.config_file)
+        self.libraries = open_libraries(self.importer_config)
+        self.addCleanup(close_libraries, self.libraries)
+
+
+    def library(self, magazine):
+        """Return the Library of the magazine."""
+        return self.libraries[self.importer_config.get_magazine(magazine)
+                .library]
+
+
+    def test_resolve_library_path(self):
+        self.assertEqual(resolve_library_path(join(self.directory, "link")),
+                os.path.realpath(join(self.directory, "library")))
+        self.assertEqual(resolve_library_path("http://localhost:8080#lib"),
+                "http://localhost:8080#lib")
+
+
+    def test_same_library_shares_index(self):
+        self.assertEqual(len(self.libraries), 3)
+        self.assertEqual(self.library("Magazine").resolved_path,
+                self.library("Other Magazine").resolved_path)
+        self.assertIsNotNone(self.library("Magazine").index)
+        self.assertIs(self.library("Magazine").index,
+                self.library("Other Magazine").index)
+
+
+    def test_same_library_shares_writer(self):
+        importer = MagazineImporter(self.importer_config, None,
+                self.libraries, None, None, None, None, False)
+        writers, breakers = importer._writers()
+        try:
+            keys = [self.importer_config.get_magazine(magazine).library
+                    for magazine in ["Magazine", "Other Magazine",
+                        "Third Magazine"]]
+            self.assertIs(writers[keys[0]], writers[keys[1]])
+            self.assertIs(breakers[keys[0]], breakers[keys[1]])
+            self.assertIsNot(writers[keys[0]], writers[keys[2]])
+            self.assertIsNot(breakers[keys[0]], breakers[keys[2]])
+        finally:
+            for writer in set(writers.values()):
+                writer.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import sqlite3
+import tempfile
+import unittest
+
+from closingbrace.calibre.library_index import LibraryIndex
+from os.path import join
+
+
+# The tables of calibre's metadata.db that the index reads, as calibre
+# creates them.
+SCHEMA = """
+CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL DEFAULT 'Unknown' COLLATE NOCASE,
+    sort TEXT COLLATE NOCASE,
+    series_index REAL NOT NULL DEFAULT 1.0,
+    path TEXT NOT NULL DEFAULT '');
+CREATE TABLE series (id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    sort TEXT COLLATE NOCASE,
+    UNIQUE (name));
+CREATE TABLE books_series_link (id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    series INTEGER NOT NULL,
+    UNIQUE(book));
+"""
+
+
+class LibraryIndexTest(unittest.TestCase):
+    """Tests of LibraryIndex against a small metadata.db."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.library_path = directory.name
+        connection = sqlite3.connect(join(self.library_path, "metadata.db"))
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute("INSERT INTO series VALUES (1, 'Great "
+                    "Magazine', 'Great Magazine')")
+            for book, series_index in [(1, 9.01), (2, 9.02), (3, 1.0)]:
+                connection.execute("INSERT INTO books (id, title, "
+                        "series_index) VALUES (?, ?, ?)",
+                        (book, f"Book {book}", series_index))
+            connection.executemany("INSERT INTO books_series_link (book, "
+                    "series) VALUES (?, 1)", [(1,), (2,)])
+        connection.close()
+
+
+    def test_contains(self):
+        index = LibraryIndex.open(self.library_path)
+        self.assertTrue(index.contains("Great Magazine", "9.01"))
+        self.assertTrue(index.contains("Great Magazine", "9.02"))
+        self.assertFalse(index.contains("Great Magazine", "9.03"))
+        self.assertFalse(index.contains("Other Magazine", "9.01"))
+
+
+    def test_book_without_series(self):
+        index = LibraryIndex.open(self.library_path)
+        self.assertFalse(index.contains("Great Magazine", "1"))
+
+
+    def test_series_case_folded(self):
+        index = LibraryIndex.open(self.library_path)
+        self.assertTrue(index.contains("great magazine", "9.01"))
+        self.assertTrue(index.contains("GREAT MAGAZINE", "9.02"))
+
+
+    def test_number_compared_as_series_index(self):
+        index = LibraryIndex.open(self.library_path)
+        self.assertTrue(index.contains("Great Magazine", "9.010"))
+
+
+    def test_number_not_a_series_index(self):
+        index = LibraryIndex.open(self.library_path)
+        self.assertFalse(index.contains("Great Magazine", "1010.0.09"))
+        index.add("Great Magazine", "1010.0.09")
+        self.assertFalse(index.contains("Great Magazine", "1010.0.09"))
+
+
+    def test_add(self):
+        index = LibraryIndex.open(self.library_path)
+        index.add("Great Magazine", "9.03")
+        self.assertTrue(index.contains("great magazine", "9.03"))
+
+
+    def test_no_metadata_db(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(LibraryIndex.open(directory))
+
+
+    def test_content_server(self):
+        self.assertIsNone(LibraryIndex.open("http://localhost:8080#library"))
+
+
+    def test_not_a_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(join(directory, "metadata.db"), "w") as f:
+                f.write("not a database")
+            self.assertIsNone(LibraryIndex.open(directory))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import tempfile
+import unittest
+
+from closingbrace.calibre.match_cache import NegativeMatchCache
+from os.path import join
+
+
+FORMATS = ["mag-{Y:4d}-{M:2d}.pdf"]
+
+
+class NegativeMatchCacheTest(unittest.TestCase):
+    """Tests of NegativeMatchCache."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache_file = join(self.directory, "nomatch")
+        self.stats = {}
+        cache = NegativeMatchCache(self.cache_file, FORMATS)
+        for name in ["a.pdf", "b.pdf"]:
+            with open(join(self.directory, name), "w"):
+                pass
+            self.stats[name] = os.stat(join(self.directory, name))
+            cache.add(name, self.stats[name])
+        cache.write()
+
+
+    def cached(self, cache):
+        """Return the names of the files in the written cache."""
+        cache = NegativeMatchCache(self.cache_file, FORMATS)
+        return {name for name in self.stats
+                if cache.contains(name, self.stats[name])}
+
+
+    def test_read(self):
+        cache = NegativeMatchCache(self.cache_file, FORMATS)
+        self.assertEqual(self.cached(cache), {"a.pdf", "b.pdf"})
+
+
+    def test_other_formats(self):
+        cache = NegativeMatchCache(self.cache_file, ["other-{Y}.pdf"])
+        self.assertFalse(cache.contains("a.pdf", self.stats["a.pdf"]))
+
+
+    def test_complete_scan_drops_unseen(self):
+        cache = NegativeMatchCache(self.cache_file, FORMATS)
+        cache.start_scan()
+        cache.contains("a.pdf", self.stats["a.pdf"])
+        cache.write()
+        self.assertEqual(self.cached(cache), {"a.pdf"})
+
+
+    def test_stopped_scan_keeps_unseen(self):
+        cache = NegativeMatchCache(self.cache_file, FORMATS)
+        cache.start_scan()
+        cache.contains("a.pdf", self.stats["a.pdf"])
+        cache.stop_scan()
+        cache.write()
+        self.assertEqual(self.cached(cache), {"a.pdf", "b.pdf"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+
+from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.configuration import compile_format
+from closingbrace.calibre.matcher import MagazineMatcher
+from closingbrace.calibre.metrics import DisabledMetrics
+from closingbrace.calibre.metrics import FORMULA
+from tests import TemporaryDirectoryTest
+from types import SimpleNamespace
+
+
+MAGAZINE = """
+[Magazine]
+format = mag-{{V:d}}-{{I:d}}.pdf
+authors = Author
+publisher = Publisher
+year = 2000 + V
+month = I
+title = Magazine {{volume}}.{{index}} {{month:s}} {{year}}
+"""
+
+
+class RecordingMetrics(DisabledMetrics):
+    """Run metrics that record the stages that are timed."""
+
+    def __init__(self):
+        self.timed = []
+
+
+    def time(self, stage, files=()):
+        self.timed.append((stage, list(files)))
+        return super().time(stage, files)
+
+
+class MagazineMatcherTest(TemporaryDirectoryTest):
+    """Tests of the timing of the formulas by MagazineMatcher."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_config(MAGAZINE)
+        importer_config = ImporterConfiguration(self.config_file)
+        self.metrics = RecordingMetrics()
+        self.matcher = MagazineMatcher([importer_config.get_magazine(name)
+            for name in importer_config.magazines], self.metrics)
+
+
+    def test_match_times_evaluation(self):
+        matched, = self.matcher.match("mag-19-3.pdf")
+        self.assertEqual(self.metrics.timed, [])
+        self.assertEqual(matched.title, "Magazine 19.3 March 2019")
+        self.assertEqual(matched.number, "19.03")
+        self.assertEqual(self.metrics.timed,
+                [(FORMULA, ["mag-19-3.pdf"])])
+
+
+    def test_match_many_times_evaluation(self):
+        plan, = self.matcher.match_many(["a/mag-19-3.pdf", "mag-20-4.pdf",
+            "other.pdf"])
+        self.assertEqual(self.metrics.timed,
+                [(FORMULA, ["a/mag-19-3.pdf", "mag-20-4.pdf"])])
+
+
+# Formats that the index handles in different ways: mixed case,
+# non-ASCII and escaped braces in the literal text, formats without a
+# prefix or suffix, and formats that match the same files.
+FORMATS = ["Mag-{Y:4d}-{M:2}.pdf", "mag-{Y:4d}-{M:2}.pdf",
+        "mag-{Y:4d}-{M:2}-extra.pdf", "Ölmagazin-{V:d}.pdf",
+        "zeitschrift-{V:d}-ä.pdf", "{{special}}-{V:d}.pdf",
+        "lit-{{x}}-{V:d}.pdf", "{Y:4d}-{M:2}.pdf", "{V:d}.{I:d}",
+        "mag-{V:d}"]
+
+FILES = ["mag-2019-01.pdf", "MAG-2019-01.PDF", "Mag-2019-01.pdf\n",
+        "mag-2019-01-extra.pdf", "mag-2019-01-EXTRA.pdf", "mag-7",
+        "ölmagazin-3.pdf", "ÖLMAGAZIN-3.PDF", "olmagazin-3.pdf",
+        "zeitschrift-4-ä.pdf", "zeitschrift-4-Ä.pdf", "zeitschrift-4-a.pdf",
+        "{special}-5.pdf", "{{special}}-5.pdf", "special-5.pdf",
+        "lit-{x}-6.pdf", "LIT-{X}-6.PDF", "lit-x-6.pdf", "2019-01.pdf",
+        "2019-01.pdf\n", "3.4", "3.4\n", "magazine.pdf", "ämag-2019-01.pdf",
+        "", "\n"]
+
+
+class MagazineMatcherIndexTest(unittest.TestCase):
+    """Tests that the prefix and suffix index of MagazineMatcher finds
+    the same matches as parsing every file name against every format.
+    """
+
+    def setUp(self):
+        self.magazines = [SimpleNamespace(name=f"Magazine {number}",
+            format=format, format_parser=compile_format(format))
+            for number, format in enumerate(FORMATS)]
+        self.matcher = MagazineMatcher(self.magazines)
+
+
+    def parsed(self, matches):
+        """Return the magazine names and captured fields of the match
+        tuples.
+        """
+        return [(magazine.name, result.named)
+                for magazine, _, result in matches]
+
+
+    def test_same_matches_as_parse(self):
+        for file in FILES:
+            with self.subTest(file=file):
+                expected = [(magazine, file,
+                    magazine.format_parser.parse(file))
+                    for magazine in self.magazines]
+                self.assertEqual(self.parsed(self.matcher.parse(file)),
+                        self.parsed(match for match in expected if match[2]))
+
+
+    def test_several_magazines_match(self):
+        self.assertEqual([magazine.name for magazine, _, _ in
+            self.matcher.parse("MAG-2019-01.PDF")],
+            ["Magazine 0", "Magazine 1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
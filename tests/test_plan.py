@@ -0,0 +1,210 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import sys
+import unittest
+
+from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.matcher import MagazineMatcher
+from closingbrace.calibre.plan import FORMATS
+from closingbrace.calibre.plan import ImportPlan
+from closingbrace.calibre.plan import PlanError
+from os.path import join
+from tests import MAGAZINE
+from tests import TemporaryDirectoryTest
+from tests import start_importer
+from tests.test_backend import FAKE_CALIBREDB
+
+
+ROWS = [("a/mag-2019-01.pdf", "Magazine", "19.01", "Magazine, \"January\"",
+    "/archive/mag-2019-01.pdf"),
+    ("a/mag-2019-01.pdf", "Other", "1", "Other Ü 1", None),
+    ("mag-2019-02.pdf", "Magazine", "19.02", "Magazine\nFebruary", None)]
+
+OTHER_MAGAZINE = """
+[Other]
+format = mag-{{Y:4d}}-{{M:2}}.pdf
+authors = Author
+languages = eng
+publisher = Publisher
+title = Other {{month:s}} {{year}}
+archivedir = {directory}/archive
+"""
+
+
+class ImportPlanTest(TemporaryDirectoryTest):
+    """Tests of writing and reading an ImportPlan."""
+
+    def setUp(self):
+        super().setUp()
+        self.plan_file = join(self.directory, "plan")
+        self.plan = ImportPlan("/import")
+        for row in ROWS:
+            self.plan.append(*row)
+
+
+    def write(self, text):
+        """Write text to the plan file."""
+        with open(self.plan_file, "w") as f:
+            f.write(text)
+
+
+    def test_round_trip(self):
+        for plan_format in FORMATS:
+            with self.subTest(plan_format=plan_format):
+                self.plan.write(self.plan_file, plan_format)
+                plan = ImportPlan.read(self.plan_file, plan_format)
+                self.assertEqual(plan.import_dir, "/import")
+                self.assertEqual(list(plan.rows()), ROWS)
+                self.assertEqual([(file, len(issues))
+                    for file, issues in plan.files()],
+                    [("a/mag-2019-01.pdf", 2), ("mag-2019-02.pdf", 1)])
+
+
+    def test_csv_without_import_dir(self):
+        self.write("file,series,number,title,archive\n"
+                "mag-2019-02.pdf,Magazine,19.02,February,\n")
+        plan = ImportPlan.read(self.plan_file, "csv")
+        self.assertIsNone(plan.import_dir)
+        self.assertEqual(list(plan.rows()),
+                [("mag-2019-02.pdf", "Magazine", "19.02", "February", None)])
+
+
+    def test_invalid_csv(self):
+        for text in ["", "importdir\nfile,series,number,title,archive\n",
+                "importdir,/import\nfile,series,title\n",
+                "file,series,number,title,archive\na.pdf,Magazine\n"]:
+            with self.subTest(text=text):
+                self.write(text)
+                with self.assertRaises(PlanError):
+                    ImportPlan.read(self.plan_file, "csv")
+
+
+    def test_invalid_json(self):
+        columns = {"file": ["a.pdf"], "series": [], "number": [],
+                "title": [], "archive": []}
+        for content in [[], {"importdir": None},
+                {"importdir": None, "columns": columns}]:
+            with self.subTest(content=content):
+                self.write(json.dumps(content))
+                with self.assertRaises(PlanError):
+                    ImportPlan.read(self.plan_file, "json")
+
+
+    def test_missing_plan(self):
+        with self.assertRaises(PlanError):
+            ImportPlan.read(join(self.directory, "missing"), "json")
+
+
+class MatchManyTest(TemporaryDirectoryTest):
+    """Tests of the plans of MagazineMatcher.match_many."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_config(MAGAZINE + OTHER_MAGAZINE)
+        importer_config = ImporterConfiguration(self.config_file)
+        self.matcher = MagazineMatcher([importer_config.get_magazine(name)
+            for name in importer_config.magazines])
+
+
+    def test_plan(self):
+        plan, = self.matcher.match_many(["b/mag-2019-03.pdf", "other.pdf",
+            "mag-2018-12.pdf"])
+        self.assertEqual(list(plan.rows()), [
+            ("b/mag-2019-03.pdf", "Magazine", "0.00", "Magazine March 2019",
+                None),
+            ("b/mag-2019-03.pdf", "Other", "0.00", "Other March 2019",
+                join(self.directory, "archive", "mag-2019-03.pdf")),
+            ("mag-2018-12.pdf", "Magazine", "0.00", "Magazine December 2018",
+                None),
+            ("mag-2018-12.pdf", "Other", "0.00", "Other December 2018",
+                join(self.directory, "archive", "mag-2018-12.pdf"))])
+
+
+    def test_chunks(self):
+        files = ["mag-2019-01.pdf", "other.pdf", "mag-2019-02.pdf"]
+        plans = list(self.matcher.match_many(files, chunk_size=2))
+        self.assertEqual([[row[0] for row in plan.rows()] for plan in plans],
+                [["mag-2019-01.pdf", "mag-2019-01.pdf"],
+                    ["mag-2019-02.pdf", "mag-2019-02.pdf"]])
+        self.assertEqual([[row[:4] for row in plan.rows()] for plan in plans],
+                [[row[:4] for row in plan.rows()]
+                    for plan in [next(self.matcher.match_many(files[:2])),
+                        next(self.matcher.match_many(files[2:]))]])
+
+
+class ExecutePlanTest(TemporaryDirectoryTest):
+    """Tests of planning an import and executing the plan."""
+
+    def setUp(self):
+        super().setUp()
+        self.import_dir = join(self.directory, "import")
+        os.mkdir(self.import_dir)
+        for name in ["mag-2019-01.pdf", "mag-2019-02.pdf"]:
+            with open(join(self.import_dir, name), "wb") as f:
+                f.write(b"%PDF-1.4\n" + name.encode() + b"\n%%EOF\n")
+        calibredb = join(self.directory, "calibredb")
+        with open(calibredb, "w") as f:
+            f.write(FAKE_CALIBREDB.format(executable=sys.executable))
+        os.chmod(calibredb, 0o755)
+        self.log_file = join(self.directory, "commands.log")
+        self.write_config(importdir=self.import_dir, calibredb=calibredb,
+                librarypath=self.log_file)
+        self.plan_file = join(self.directory, "plan.csv")
+
+
+    def run_importer(self, *arguments):
+        """Run the importer with the command line arguments. Returns its
+        exit code.
+        """
+        return start_importer(self.config_file, *arguments,
+                "--plan-format", "csv").wait()
+
+
+    def added_titles(self):
+        """Return the titles of the books that calibredb added."""
+        if not os.path.exists(self.log_file):
+            return []
+        with open(self.log_file) as f:
+            return [command[command.index("--title") + 1]
+                    for command in map(json.loads, f) if command[0] == "add"]
+
+
+    def test_plan_is_executed_as_edited(self):
+        self.assertEqual(self.run_importer("--plan", self.plan_file), 0)
+        self.assertEqual(self.added_titles(), [])
+        plan = ImportPlan.read(self.plan_file, "csv")
+        self.assertEqual(plan.import_dir, self.import_dir)
+        edited = ImportPlan(plan.import_dir)
+        for file, series, number, title, archive in plan.rows():
+            if file == "mag-2019-01.pdf":
+                edited.append(file, series, number, "Edited", archive)
+        edited.write(self.plan_file, "csv")
+
+        self.assertEqual(self.run_importer("--execute-plan", self.plan_file),
+                0)
+        self.assertEqual(self.added_titles(), ["Edited"])
+        self.assertEqual(os.listdir(self.import_dir), ["mag-2019-02.pdf"])
+
+
+    def test_plan_of_other_import_directory(self):
+        self.assertEqual(self.run_importer("--plan", self.plan_file), 0)
+        plan = ImportPlan.read(self.plan_file, "csv")
+        moved = ImportPlan(join(self.directory, "elsewhere"))
+        moved.extend(plan)
+        moved.write(self.plan_file, "csv")
+        self.assertNotEqual(self.run_importer("--execute-plan",
+            self.plan_file), 0)
+        self.assertEqual(self.added_titles(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
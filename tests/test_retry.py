@@ -0,0 +1,105 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import tempfile
+import unittest
+
+from closingbrace.calibre.retry import CircuitBreaker
+from closingbrace.calibre.retry import RetryQueue
+from os.path import join
+
+
+class RetryQueueTest(unittest.TestCase):
+    """Tests of RetryQueue."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.queue_file = join(directory.name, "retry")
+        queue = self.queue()
+        queue.failed("a.pdf", 1, 2, "error a")
+        queue.failed("b.pdf", 1, 2, "error b")
+        queue.write()
+
+
+    def queue(self):
+        """Return the queue read from the queue file."""
+        return RetryQueue(self.queue_file, 60, 3600)
+
+
+    def files(self):
+        """Return the files in the written queue."""
+        return {entry.file for entry in self.queue().entries()}
+
+
+    def test_backoff(self):
+        queue = self.queue()
+        self.assertFalse(queue.is_due("a.pdf", 1, 2))
+        self.assertTrue(queue.is_due("a.pdf", 1, 3))
+        self.assertTrue(queue.is_due("c.pdf", 1, 2))
+
+
+    def test_failures_double_delay(self):
+        queue = self.queue()
+        queue.failed("a.pdf", 1, 2, "error a")
+        entry, = [entry for entry in queue.entries() if entry.file == "a.pdf"]
+        self.assertEqual(entry.failures, 2)
+
+
+    def test_complete_scan_drops_unseen(self):
+        queue = self.queue()
+        queue.start_scan()
+        queue.is_due("a.pdf", 1, 2)
+        queue.write()
+        self.assertEqual(self.files(), {"a.pdf"})
+
+
+    def test_stopped_scan_keeps_unseen(self):
+        queue = self.queue()
+        queue.start_scan()
+        queue.is_due("a.pdf", 1, 2)
+        queue.stop_scan()
+        queue.write()
+        self.assertEqual(self.files(), {"a.pdf", "b.pdf"})
+
+
+    def test_due(self):
+        queue = self.queue()
+        queue.failed("c.pdf", 1, 2, "error c")
+        next_attempt = queue.next_attempt(0)
+        self.assertEqual(queue.due(0, next_attempt - 1), [])
+        self.assertEqual(set(queue.due(0, next_attempt + 3600)),
+                {"a.pdf", "b.pdf", "c.pdf"})
+        self.assertEqual(queue.due(next_attempt + 3600,
+            next_attempt + 7200), [])
+        self.assertIsNone(queue.next_attempt(next_attempt + 3600))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Tests of CircuitBreaker."""
+
+    def test_opens_after_limit(self):
+        breaker = CircuitBreaker(2)
+        breaker.record(True)
+        breaker.record(False)
+        breaker.record(True)
+        self.assertFalse(breaker.is_open)
+        breaker.record(True)
+        self.assertTrue(breaker.is_open)
+
+
+    def test_never_opens(self):
+        breaker = CircuitBreaker(0)
+        for _ in range(10):
+            breaker.record(True)
+        self.assertFalse(breaker.is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import unittest
+
+from closingbrace.calibre.configuration import ImporterConfiguration
+from closingbrace.calibre.match_cache import NegativeMatchCache
+from closingbrace.calibre.matcher import MagazineMatcher
+from closingbrace.calibre.scheduler import ImportBudget
+from closingbrace.calibre.scheduler import order_files
+from os.path import join
+from tests import TemporaryDirectoryTest
+
+
+class ImportBudgetTest(unittest.TestCase):
+    """Tests of ImportBudget."""
+
+    def test_unlimited(self):
+        budget = ImportBudget()
+        for _ in range(100):
+            budget.start_file()
+        self.assertFalse(budget.is_exhausted())
+        self.assertIsNone(budget.reason)
+
+
+    def test_files(self):
+        budget = ImportBudget(max_files=2)
+        self.assertEqual(list(budget.limit(["a", "b", "c"])), ["a", "b", "c"])
+        budget.start_file()
+        self.assertFalse(budget.is_exhausted())
+        budget.start_file()
+        self.assertTrue(budget.is_exhausted())
+        self.assertEqual(budget.reason, "files")
+        self.assertEqual(list(budget.limit(["d"])), [])
+
+
+    def test_runtime(self):
+        budget = ImportBudget(max_runtime=0)
+        self.assertTrue(budget.is_exhausted())
+        self.assertEqual(budget.reason, "runtime")
+
+
+class OrderFilesTest(TemporaryDirectoryTest):
+    """Tests of order_files."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_config()
+        importer_config = ImporterConfiguration(self.config_file)
+        self.matcher = MagazineMatcher([importer_config.get_magazine(name)
+            for name in importer_config.magazines])
+        self.match_cache = NegativeMatchCache(join(self.directory, "nomatch"),
+                importer_config.formats)
+
+
+    def write(self, name, size=0):
+        """Write a file named name of size bytes."""
+        with open(join(self.directory, name), "wb") as f:
+            f.write(b"x" * size)
+        return name
+
+
+    def test_newest(self):
+        files = [self.write(name) for name in
+                ["mag-2019-01.pdf", "mag-2020-02.pdf", "mag-2019-11.pdf"]]
+        self.assertEqual(order_files(files, self.directory, self.matcher,
+            ["newest"]),
+            ["mag-2020-02.pdf", "mag-2019-11.pdf", "mag-2019-01.pdf"])
+
+
+    def test_smallest_then_path(self):
+        files = [self.write("mag-2019-02.pdf", 3),
+                self.write("mag-2019-03.pdf", 1),
+                self.write("mag-2019-01.pdf", 3)]
+        self.assertEqual(order_files(files, self.directory, self.matcher,
+            ["smallest"]),
+            ["mag-2019-03.pdf", "mag-2019-01.pdf", "mag-2019-02.pdf"])
+
+
+    def test_not_matching_left_out(self):
+        files = [self.write(name) for name in
+                ["mag-2019-01.pdf", "mag-x.pdf", "other.pdf"]]
+        self.assertEqual(order_files(files, self.directory, self.matcher,
+            ["newest"]), ["mag-2019-01.pdf"])
+
+
+    def test_match_cache(self):
+        files = [self.write(name) for name in ["mag-2019-01.pdf", "mag-x.pdf"]]
+        order_files(files, self.directory, self.matcher, ["newest"],
+                self.match_cache)
+        self.assertTrue(self.match_cache.contains("mag-x.pdf",
+            os.stat(join(self.directory, "mag-x.pdf"))))
+        self.assertFalse(self.match_cache.contains("mag-2019-01.pdf",
+            os.stat(join(self.directory, "mag-2019-01.pdf"))))
+
+
+    def test_match_cache_skips_parsing(self):
+        self.write("mag-2019-01.pdf")
+        self.match_cache.add("mag-2019-01.pdf",
+                os.stat(join(self.directory, "mag-2019-01.pdf")))
+        self.assertEqual(order_files(["mag-2019-01.pdf"], self.directory,
+            self.matcher, ["newest"], self.match_cache), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import sys
+import unittest
+
+from closingbrace.calibre.stability import SizeHistory
+from os.path import join
+from tests import TemporaryDirectoryTest
+from tests import start_importer
+from tests.test_backend import FAKE_CALIBREDB
+
+
+class SizeHistoryTest(TemporaryDirectoryTest):
+    """Tests of SizeHistory."""
+
+    def setUp(self):
+        super().setUp()
+        self.history_file = join(self.directory, "sizes")
+        for name in ["a.pdf", "b.pdf"]:
+            self.append(name, "start")
+
+
+    def append(self, name, text):
+        """Append text to the file named name."""
+        with open(join(self.directory, name), "a") as f:
+            f.write(text)
+
+
+    def is_stable(self, history, name):
+        """Check whether the file named name is stable in history."""
+        return history.is_stable(name, os.stat(join(self.directory, name)))
+
+
+    def scan(self, *names):
+        """Scan the files named names with the written history, write
+        it again and return the names of the stable files.
+        """
+        history = SizeHistory(self.history_file)
+        history.start_scan()
+        stable = [name for name in names if self.is_stable(history, name)]
+        history.write()
+        return stable
+
+
+    def test_stable_after_unchanged_scan(self):
+        self.assertEqual(self.scan("a.pdf", "b.pdf"), [])
+        self.append("b.pdf", " more")
+        self.assertEqual(self.scan("a.pdf", "b.pdf"), ["a.pdf"])
+        self.assertEqual(self.scan("a.pdf", "b.pdf"), ["a.pdf", "b.pdf"])
+
+
+    def test_unseen_files_are_dropped(self):
+        self.scan("a.pdf", "b.pdf")
+        self.scan("a.pdf")
+        self.assertEqual(self.scan("a.pdf", "b.pdf"), ["a.pdf"])
+
+
+    def test_stopped_scan_keeps_unseen_files(self):
+        self.scan("a.pdf", "b.pdf")
+        history = SizeHistory(self.history_file)
+        history.start_scan()
+        self.is_stable(history, "a.pdf")
+        history.stop_scan()
+        history.write()
+        self.assertEqual(self.scan("b.pdf"), ["b.pdf"])
+
+
+class CheckStableTest(TemporaryDirectoryTest):
+    """Tests of an importer that only imports stable files."""
+
+    def setUp(self):
+        super().setUp()
+        self.import_dir = join(self.directory, "import")
+        os.mkdir(self.import_dir)
+        calibredb = join(self.directory, "calibredb")
+        with open(calibredb, "w") as f:
+            f.write(FAKE_CALIBREDB.format(executable=sys.executable))
+        os.chmod(calibredb, 0o755)
+        self.log_file = join(self.directory, "commands.log")
+        self.write_config(importdir=self.import_dir, calibredb=calibredb,
+                librarypath=self.log_file, checkstable="yes")
+
+
+    def write_file(self, name, text):
+        """Write a complete PDF file with text into the import
+        directory.
+        """
+        with open(join(self.import_dir, name), "wb") as f:
+            f.write(b"%PDF-1.4\n" + text.encode() + b"\n%%EOF\n")
+
+
+    def run_importer(self):
+        """Run the importer and return the names of the files it added."""
+        self.assertEqual(start_importer(self.config_file).wait(), 0)
+        if not os.path.exists(self.log_file):
+            return []
+        with open(self.log_file) as f:
+            added = [os.path.basename(command[-1])
+                    for command in map(json.loads, f) if command[0] == "add"]
+        os.remove(self.log_file)
+        return added
+
+
+    def test_imported_once_stable(self):
+        self.write_file("mag-2019-01.pdf", "January")
+        self.write_file("mag-2019-02.pdf", "Febr")
+        self.assertEqual(self.run_importer(), [])
+        self.write_file("mag-2019-02.pdf", "February")
+        self.assertEqual(self.run_importer(), ["mag-2019-01.pdf"])
+        self.assertEqual(self.run_importer(), ["mag-2019-02.pdf"])
+        self.assertEqual(os.listdir(self.import_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
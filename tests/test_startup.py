@@ -0,0 +1,54 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import unittest
+
+from benchmarks.startup import FORBIDDEN
+from benchmarks.startup import run_importer
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+from tests import TemporaryDirectoryTest
+
+
+# The budgets of an empty run. The time budget is much larger than the
+# one of benchmarks/startup.py, so that the test doesn't fail on a slow
+# or busy machine.
+MAX_SECONDS = 2.0
+MAX_MODULES = 120
+
+
+class StartupTest(TemporaryDirectoryTest):
+    """Tests that a run on an empty import directory stays within the
+    startup budget of benchmarks/startup.py.
+    """
+
+    def setUp(self):
+        super().setUp()
+        import_dir = join(self.directory, "import")
+        os.mkdir(import_dir)
+        self.write_config(importdir=import_dir)
+        self.env = dict(os.environ)
+        self.env["PYTHONPATH"] = os.pathsep.join(filter(None,
+            [dirname(dirname(abspath(__file__))),
+                self.env.get("PYTHONPATH")]))
+        # The first run compiles and caches the configuration.
+        run_importer(self.config_file, self.env)
+
+
+    def test_empty_run(self):
+        seconds, modules = run_importer(self.config_file, self.env)
+        self.assertEqual(sorted(set(FORBIDDEN) & set(modules)), [])
+        self.assertLessEqual(len(modules), MAX_MODULES)
+        self.assertLessEqual(seconds, MAX_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
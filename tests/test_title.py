@@ -0,0 +1,66 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pickle
+import unittest
+
+from closingbrace.calibre.date_util import Month
+from closingbrace.calibre.formula import FormulaError
+from closingbrace.calibre.title import TitleTemplate
+
+
+TEMPLATES = [
+        "Magazine {month:s} {year}",
+        "Magazine {volume}.{index:02d} - {month:s}/{next_month:s} {year}",
+        "{{Magazine}} {year:>6d} {volume!r} {month!s:.3}",
+        "Magazine {year.real}",
+        "Magazine {index:{volume}}",
+        "Magazine",
+        ]
+
+
+class TitleTemplateTest(unittest.TestCase):
+    """Tests of TitleTemplate."""
+
+    def assertFormatted(self, template, title_template):
+        """Assert that title_template formats titles as str.format does
+        with template.
+        """
+        for volume, index, year, month in [(3, 4, 2019, 12), (1, 2, 2000, 1)]:
+            month = Month.of(month)
+            self.assertEqual(title_template.format(volume, index, year, month),
+                    template.format(volume=volume, index=index, year=year,
+                        month=month, next_month=month.next()))
+
+
+    def test_format(self):
+        for template in TEMPLATES:
+            with self.subTest(template=template):
+                self.assertFormatted(template, TitleTemplate(template))
+
+
+    def test_pickle(self):
+        for template in TEMPLATES:
+            with self.subTest(template=template):
+                self.assertFormatted(template,
+                        pickle.loads(pickle.dumps(TitleTemplate(template))))
+
+
+    def test_unknown_field(self):
+        with self.assertRaises(FormulaError):
+            TitleTemplate("Magazine {day}")
+
+
+    def test_invalid_template(self):
+        with self.assertRaises(FormulaError):
+            TitleTemplate("Magazine {year")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# Calibre Magazine Importer
+# A script to import digital magazines into a Calibre library.
+#
+# Copyright (c) 2019 Hans Vredeveld
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import tempfile
+import unittest
+import zipfile
+
+from closingbrace.calibre.validator import InvalidFileError
+from closingbrace.calibre.validator import validate_file
+from os.path import join
+
+
+class ValidateFileTest(unittest.TestCase):
+    """Tests of validate_file."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+
+    def write(self, name, content):
+        """Write a file named name with content. Returns its path."""
+        file_path = join(self.directory, name)
+        with open(file_path, "wb") as f:
+            f.write(content)
+        return file_path
+
+
+    def epub(self):
+        """Return the content of a small EPUB file."""
+        file_path = join(self.directory, "content.zip")
+        with zipfile.ZipFile(file_path, "w") as zip_file:
+            zip_file.writestr("mimetype", "application/epub+zip")
+            zip_file.writestr("content.opf", "x" * 4096)
+        with open(file_path, "rb") as f:
+            return f.read()
+
+
+    def test_complete_pdf(self):
+        validate_file(self.write("a.pdf", b"%PDF-1.4\n" + b"x" * 4096
+            + b"\n%%EOF\n"))
+
+
+    def test_truncated_pdf(self):
+        with self.assertRaises(InvalidFileError):
+            validate_file(self.write("a.pdf", b"%PDF-1.4\n" + b"x" * 4096))
+
+
+    def test_complete_epub(self):
+        validate_file(self.write("a.epub", self.epub()))
+
+
+    def test_truncated_epub(self):
+        with self.assertRaises(InvalidFileError):
+            validate_file(self.write("a.epub", self.epub()[:-100]))
+
+
+    def test_other_types_are_not_checked(self):
+        validate_file(self.write("a.txt", b""))
+
+
+if __name__ == "__main__":
+    unittest.main()